@@ -0,0 +1,80 @@
+"""
+パスワードのハッシュ化(Argon2)のパラメータを選ぶためのベンチマーク
+1. パラメータ(memory_cost, time_cost, hash_len)ごとの1件あたりの時間と、1プロセスあたりの1秒間の検証数
+2. 現在の設定(config.ARGON2_PARAMETERS)で同時にログインが集中した場合のPasswordHashServiceの待ち時間
+
+使い方:
+    python -m benchmarks.argon2_bench
+
+1件あたり数十から数百ミリ秒のため、ログインの応答時間と同時に処理できる数の目安として使用する
+(1件あたりのメモリ使用量はmemory_cost KiB、同時に実行する数はPASSWORD_HASH_WORKERSで制限する)
+"""
+import asyncio
+import os
+import secrets
+import statistics
+import sys
+import time
+from argon2 import PasswordHasher
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from config import ARGON2_PARAMETERS
+from hashed.service import PasswordHashService, HashingBusy
+
+MEMORY_COSTS = [19456, 47104, 65536]
+TIME_COSTS = [2, 3, 5]
+HASH_LENS = [32, 256]
+REPEAT = 3
+BURST_SIZES = [10, 50]
+BURST_WORKERS = [1, 2, 4]
+PASSWORD = "Benchmark1234"
+
+def measure_parameters():
+    print("パラメータごとの検証時間(1プロセス)")
+    print(f"  {'memory_cost':>12}{'time_cost':>10}{'hash_len':>10}{'ms/hash':>10}{'verify/s':>10}")
+    for memory_cost in MEMORY_COSTS:
+        for time_cost in TIME_COSTS:
+            for hash_len in HASH_LENS:
+                ph = PasswordHasher(memory_cost=memory_cost, time_cost=time_cost, parallelism=1, hash_len=hash_len)
+                hash = ph.hash(PASSWORD, salt=secrets.token_bytes(128))
+                start = time.perf_counter()
+                for _ in range(REPEAT):
+                    ph.verify(hash, PASSWORD)
+                elapsed = (time.perf_counter() - start) / REPEAT
+                current = " *" if (memory_cost, time_cost, hash_len) == (ARGON2_PARAMETERS["memory_cost"], ARGON2_PARAMETERS["time_cost"], ARGON2_PARAMETERS["hash_len"]) else ""
+                print(f"  {memory_cost:>12}{time_cost:>10}{hash_len:>10}{elapsed * 1000:>10.1f}{1 / elapsed:>10.1f}{current}")
+    print("  (*: 現在の設定)")
+
+async def measure_burst():
+    print()
+    print(f"同時ログインの待ち時間(現在の設定: {ARGON2_PARAMETERS})")
+    print(f"  {'logins':>8}{'workers':>9}{'total s':>9}{'p50 ms':>9}{'p95 ms':>9}{'max wait ms':>13}{'rejected':>10}")
+    hash = PasswordHasher(**ARGON2_PARAMETERS).hash(PASSWORD, salt=secrets.token_bytes(128))
+    for workers in BURST_WORKERS:
+        service = PasswordHashService(workers=workers, max_waiting=max(BURST_SIZES))
+        #プロセスの起動時間を含めないよう一度実行しておく
+        await asyncio.gather(*(service.verify(PASSWORD, hash) for _ in range(workers)))
+        for burst in BURST_SIZES:
+            service.max_wait = 0.0
+
+            async def login():
+                start = time.perf_counter()
+                try:
+                    await service.verify(PASSWORD, hash)
+                except HashingBusy:
+                    return None
+                return time.perf_counter() - start
+
+            start = time.perf_counter()
+            results = await asyncio.gather(*(login() for _ in range(burst)))
+            total = time.perf_counter() - start
+            latencies = sorted(latency for latency in results if latency is not None)
+            rejected = len(results) - len(latencies)
+            p50 = statistics.median(latencies) * 1000
+            p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+            print(f"  {burst:>8}{workers:>9}{total:>9.2f}{p50:>9.0f}{p95:>9.0f}{service.metrics()['max_wait_ms']:>13.0f}{rejected:>10}")
+        service.shutdown()
+
+if __name__ == "__main__":
+    measure_parameters()
+    asyncio.run(measure_burst())
@@ -0,0 +1,106 @@
+"""
+ルームへのメッセージ送信(ファンアウト)のベンチマーク
+参加者ごとにdictを作成してsend_jsonでエンコードする従来の方法と、
+manager.broadcastで一度だけエンコードして同じフレームを送信する方法のメッセージ1件あたりのCPU時間を比較する
+
+使い方:
+    python -m benchmarks.broadcast_bench
+
+ソケットへの書き込みは行わず、エンコードと送信キューの処理のみを計測する
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+import pytz
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from websocket.manager import ConnectionManager
+from websocket.outbox import Outbox
+from websocket.codec import orjson
+
+ROOM_SIZES = [2, 50, 500]
+MESSAGES = 200
+MESSAGE_TEXT = "ベンチマーク用のメッセージ " * 8
+
+class NullWebSocket:
+    """
+    送信内容を破棄するwebsocket
+    send_jsonはStarletteのWebSocket.send_jsonと同じ方法でエンコードする
+    """
+    async def send_json(self, data):
+        json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+    async def send_text(self, text):
+        pass
+
+def make_manager(room_size: int):
+    manager = ConnectionManager()
+    user_ids = [str(uuid.uuid4()) for _ in range(room_size)]
+    for user_id in user_ids:
+        websocket = NullWebSocket()
+        manager.active_connections[user_id] = websocket
+        #maxsizeはベンチマーク中に上限に達しない大きさにする
+        outbox = Outbox(websocket, MESSAGES * 4)
+        outbox.start()
+        manager.outboxes[websocket] = outbox
+    return manager, user_ids
+
+async def drain(manager: ConnectionManager):
+    while any(outbox.queue for outbox in manager.outboxes.values()):
+        await asyncio.sleep(0)
+
+async def send_per_recipient(manager: ConnectionManager, sender_id: str, recipients: list, room_id: str):
+    """従来の方法: 参加者ごとにdictとcreated_atを作成し、send_jsonでエンコードして送信する"""
+    for participant_id in recipients:
+        websocket = manager.active_connections[participant_id]
+        await websocket.send_json({
+            "type":"ReceiveMessage",
+            "content":{
+                "id":str(uuid.uuid4()),
+                "roomid":room_id,
+                "senderid":sender_id,
+                "type":"text",
+                "text":MESSAGE_TEXT,
+                "created_at":str(pytz.timezone('Asia/Tokyo').localize(datetime.now())+timedelta(hours=9))}})
+
+async def send_broadcast(manager: ConnectionManager, sender_id: str, recipients: list, room_id: str):
+    """新しい方法: 一度だけエンコードして同じフレームを各接続の送信キューに追加する"""
+    manager.broadcast({
+        "type":"ReceiveMessage",
+        "content":{
+            "id":str(uuid.uuid4()),
+            "roomid":room_id,
+            "senderid":sender_id,
+            "type":"text",
+            "text":MESSAGE_TEXT,
+            "created_at":str(pytz.timezone('Asia/Tokyo').localize(datetime.now())+timedelta(hours=9))}},
+        recipients)
+
+async def measure(send, room_size: int) -> float:
+    """メッセージ1件あたりのCPU時間(マイクロ秒)を返す"""
+    manager, user_ids = make_manager(room_size)
+    sender_id, recipients = user_ids[0], user_ids[1:]
+    room_id = str(uuid.uuid4())
+    start = time.process_time()
+    for _ in range(MESSAGES):
+        await send(manager, sender_id, recipients, room_id)
+    await drain(manager)
+    elapsed = time.process_time() - start
+    for outbox in manager.outboxes.values():
+        outbox.close()
+    return elapsed / MESSAGES * 1e6
+
+async def main():
+    print(f"encoder: {'orjson' if orjson is not None else 'json'}, {MESSAGES} messages per room size")
+    print(f"{'room size':>10} {'per recipient (us/msg)':>24} {'broadcast (us/msg)':>20} {'speedup':>8}")
+    for room_size in ROOM_SIZES:
+        old = await measure(send_per_recipient, room_size)
+        new = await measure(send_broadcast, room_size)
+        print(f"{room_size:>10} {old:>24.1f} {new:>20.1f} {old / new:>7.1f}x")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,111 @@
+"""
+GetRoomsInfoのデータベース側のベンチマーク
+従来の1+2N回のクエリと、fetch_rooms_infoによる1回のクエリのラウンドトリップ数と所要時間を比較する
+
+使い方:
+    BENCH_DSN="host=localhost dbname=bench user=postgres" python -m benchmarks.getroomsinfo_bench
+
+一時テーブルのみを使用するため、既存のテーブルには影響しない
+"""
+import asyncio
+import os
+import sys
+import time
+import uuid
+import psycopg
+from psycopg.rows import dict_row
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from config import DATABASE_CONNINFO
+from database.database import async_database
+
+ROOM_COUNTS = [10, 100, 1000]
+PARTICIPANTS_PER_ROOM = 5
+REPEAT = 20
+
+class CountingCursor:
+    """
+    executeの呼び出し回数(ラウンドトリップ数)を数えるカーソルのラッパー
+    """
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.round_trips = 0
+
+    async def execute(self, *args, **kwargs):
+        self.round_trips += 1
+        return await self.cursor.execute(*args, **kwargs)
+
+    async def fetchall(self):
+        return await self.cursor.fetchall()
+
+async def create_tables(conn):
+    """一時テーブルを作成する(同名の一時テーブルが通常のテーブルより優先される)"""
+    await conn.execute("""
+        CREATE TEMP TABLE rooms (
+            id uuid PRIMARY KEY, name text NOT NULL, avatar_path text NOT NULL DEFAULT '/default.png')
+    """)
+    await conn.execute("""
+        CREATE TEMP TABLE room_participants (
+            id uuid NOT NULL, user_id uuid NOT NULL,
+            joined_at timestamptz NOT NULL DEFAULT now(), last_viewed_at timestamptz NOT NULL DEFAULT now(),
+            PRIMARY KEY (id, user_id))
+    """)
+    await conn.execute("CREATE INDEX ON room_participants (user_id)")
+
+async def seed(conn, user_id: str, room_count: int):
+    """ユーザーをroom_count個のルームに参加させる"""
+    await conn.execute("TRUNCATE rooms, room_participants")
+    rooms = [(str(uuid.uuid4()), f"room-{i}") for i in range(room_count)]
+    async with conn.cursor() as cursor:
+        await cursor.executemany("INSERT INTO rooms (id, name) VALUES (%s, %s)", rooms)
+        participants = []
+        for room_id, _ in rooms:
+            participants.append((room_id, user_id))
+            for _ in range(PARTICIPANTS_PER_ROOM - 1):
+                participants.append((room_id, str(uuid.uuid4())))
+        await cursor.executemany("INSERT INTO room_participants (id, user_id) VALUES (%s, %s)", participants)
+    await conn.execute("ANALYZE rooms")
+    await conn.execute("ANALYZE room_participants")
+
+async def old_get_rooms_info(cursor, user_id: str):
+    """従来の実装(1+2N回のクエリ)"""
+    rooms = await async_database.fetch(cursor, "room_participants", {"user_id": user_id})
+    participants = {}
+    for room in rooms:
+        room_data = await async_database.fetch(cursor, "rooms", {"id": str(room["id"])})
+        room_participants = await async_database.fetch(cursor, "room_participants", {"id": str(room["id"])})
+        participants[str(room["id"])] = [str(p["user_id"]) for p in room_participants]
+    return participants
+
+async def new_get_rooms_info(cursor, user_id: str):
+    """集約クエリによる実装(1回のクエリ)"""
+    rooms = await async_database.fetch_rooms_info(cursor, user_id)
+    return {room["id"]: room["participants"] for room in rooms}
+
+async def measure(conn, func, user_id: str):
+    round_trips = 0
+    elapsed = []
+    for _ in range(REPEAT):
+        async with conn.cursor(row_factory=dict_row) as raw_cursor:
+            cursor = CountingCursor(raw_cursor)
+            start = time.perf_counter()
+            await func(cursor, user_id)
+            elapsed.append(time.perf_counter() - start)
+            round_trips = cursor.round_trips
+    elapsed.sort()
+    return round_trips, elapsed[len(elapsed)//2]*1000, elapsed[int(len(elapsed)*0.95)-1]*1000
+
+async def main():
+    dsn = os.environ.get("BENCH_DSN", DATABASE_CONNINFO)
+    async with await psycopg.AsyncConnection.connect(dsn, autocommit=True) as conn:
+        await create_tables(conn)
+        user_id = str(uuid.uuid4())
+        print(f"{'rooms':>6} {'impl':>5} {'round trips':>12} {'p50 ms':>9} {'p95 ms':>9}")
+        for room_count in ROOM_COUNTS:
+            await seed(conn, user_id, room_count)
+            for name, func in (("old", old_get_rooms_info), ("new", new_get_rooms_info)):
+                round_trips, p50, p95 = await measure(conn, func, user_id)
+                print(f"{room_count:>6} {name:>5} {round_trips:>12} {p50:>9.2f} {p95:>9.2f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,92 @@
+"""
+SendMessageのメッセージ保存のベンチマーク
+メッセージごとに接続を取得してINSERTとコミットを行う従来の方法と、
+MessageWriterで複数の送信者のメッセージをまとめてコミットする方法の1秒あたりの保存件数を比較する
+
+使い方:
+    BENCH_DSN="host=localhost dbname=bench user=postgres" python -m benchmarks.messagewriter_bench
+
+bench_messagewriterスキーマにmessagesテーブルを作成して使用し、終了時に削除する
+"""
+import asyncio
+import os
+import sys
+import time
+import uuid
+import psycopg
+from psycopg_pool import AsyncConnectionPool
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from config import DATABASE_CONNINFO
+from database.database import async_database
+from websocket.messagewriter import MessageWriter
+
+SENDER_COUNTS = [1, 100, 1000]
+TOTAL_MESSAGES = 3000
+POOL_SIZE = 10
+SCHEMA = "bench_messagewriter"
+MESSAGE_TEXT = "ベンチマーク用のメッセージ " * 8
+
+def create_schema(dsn: str):
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        conn.execute(f"CREATE SCHEMA {SCHEMA}")
+        conn.execute(f"""
+            CREATE TABLE {SCHEMA}.messages (
+                id uuid PRIMARY KEY, room_id uuid NOT NULL, sender_id uuid, type text NOT NULL,
+                content text NOT NULL, created_at timestamptz NOT NULL DEFAULT now())
+        """)
+        conn.execute(f"CREATE INDEX ON {SCHEMA}.messages (room_id, created_at, id)")
+
+def drop_schema(dsn: str):
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+
+def make_message(room_id: str, sender_id: str) -> dict:
+    return {"id":str(uuid.uuid4()),"room_id":room_id,"sender_id":sender_id,"type":"text","content":MESSAGE_TEXT}
+
+async def write_per_message(message: dict):
+    """従来の方法: メッセージごとに接続を取得し、一件INSERTしてコミットする"""
+    async with async_database.get_connection() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute("BEGIN")
+            await async_database.insert(cursor, "messages", message)
+            await conn.commit()
+
+async def run_senders(senders: int, write) -> float:
+    """senders人が並行してTOTAL_MESSAGES件を送信し、1秒あたりの保存件数を返す"""
+    room_id = str(uuid.uuid4())
+    per_sender = TOTAL_MESSAGES // senders
+
+    async def sender():
+        sender_id = str(uuid.uuid4())
+        for _ in range(per_sender):
+            await write(make_message(room_id, sender_id))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(sender() for _ in range(senders)))
+    return per_sender * senders / (time.perf_counter() - start)
+
+async def main():
+    dsn = os.environ.get("BENCH_DSN", DATABASE_CONNINFO)
+    create_schema(dsn)
+    #接続プールの接続はベンチマーク用のスキーマを参照する
+    async_database.pool = AsyncConnectionPool(dsn, min_size=POOL_SIZE, max_size=POOL_SIZE, open=False,
+                                              kwargs={"options": f"-c search_path={SCHEMA}"})
+    await async_database.pool.open(wait=True)
+    try:
+        print(f"{TOTAL_MESSAGES} messages, pool size {POOL_SIZE}")
+        print(f"{'senders':>8}{'per message (msg/s)':>22}{'group commit (msg/s)':>24}{'mean batch':>12}{'speedup':>9}")
+        for senders in SENDER_COUNTS:
+            old = await run_senders(senders, write_per_message)
+            writer = MessageWriter()
+            writer.start()
+            new = await run_senders(senders, writer.write)
+            await writer.stop()
+            print(f"{senders:>8}{old:>22.0f}{new:>24.0f}{writer.metrics()['mean_batch']:>12.1f}{new / old:>8.1f}x")
+    finally:
+        await async_database.pool.close()
+        drop_schema(dsn)
+
+if __name__ == "__main__":
+    asyncio.run(main())
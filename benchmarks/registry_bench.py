@@ -0,0 +1,124 @@
+"""
+接続管理(ConnectionManager)の登録・解除・参照のベンチマーク
+一つのasyncio.Lockとリストを使用する従来の方法と、ユーザーごとに分割したロックと辞書・集合を使用する方法を
+10000接続で比較する
+
+使い方:
+    python -m benchmarks.registry_bench
+
+各フェーズは全ての操作を同時に開始し(ロックの競合が発生する状態で)、全体の所要時間から1操作あたりの時間を求める
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List
+import pytz
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from websocket.manager import ConnectionManager
+
+CONNECTIONS = 10000
+LOOKUPS = 100000
+
+class NullWebSocket:
+    async def send_json(self, data):
+        pass
+
+    async def send_text(self, text):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+class LegacyConnectionManager:
+    """
+    従来のConnectionManagerの接続管理部分(全ての操作を一つのロックで排他し、オンラインのユーザーをリストで管理する)
+    """
+    def __init__(self):
+        self.active_connections: Dict[str, object] = {}
+        self.active_users_id: List[str] = []
+        self.latest_token_valid: Dict[str, datetime] = {}
+        self.lock = asyncio.Lock()
+
+    async def verified_connect(self, websocket, user_id: str):
+        async with self.lock:
+            self.active_connections[user_id] = websocket
+            self.active_users_id.append(user_id)
+            self.latest_token_valid[user_id] = pytz.timezone('Asia/Tokyo').localize(datetime.now())+timedelta(hours=9)
+
+    async def disconnect(self, websocket, user_id: str):
+        async with self.lock:
+            if user_id in self.active_connections:
+                del self.active_connections[user_id]
+            if user_id in self.active_users_id:
+                self.active_users_id.remove(user_id)
+            if user_id in self.latest_token_valid:
+                del self.latest_token_valid[user_id]
+        await websocket.close()
+
+    async def is_online(self, user_id: str) -> bool:
+        #JoinRoom/LeaveRoomと同じくロックを取得してリストを参照する
+        async with self.lock:
+            return user_id in self.active_users_id
+
+class StripedConnectionManager:
+    """
+    現在のConnectionManagerを同じインターフェースで呼び出すためのラッパー
+    """
+    def __init__(self):
+        self.manager = ConnectionManager()
+
+    async def verified_connect(self, websocket, user_id: str):
+        await self.manager.verified_connect(websocket, user_id)
+
+    async def disconnect(self, websocket, user_id: str):
+        await self.manager.disconnect(websocket, user_id)
+
+    async def is_online(self, user_id: str) -> bool:
+        return self.manager.is_online(user_id)
+
+async def timed(coroutines) -> float:
+    """全てのコルーチンを同時に実行し、所要時間(秒)を返す"""
+    start = time.perf_counter()
+    await asyncio.gather(*coroutines)
+    return time.perf_counter() - start
+
+async def run(manager) -> Dict[str, float]:
+    """各フェーズの1操作あたりの時間(マイクロ秒)を返す"""
+    user_ids = [str(uuid.uuid4()) for _ in range(CONNECTIONS)]
+    websockets = {user_id: NullWebSocket() for user_id in user_ids}
+    lookup_ids = [random.choice(user_ids) for _ in range(LOOKUPS)]
+    results = {}
+
+    elapsed = await timed(manager.verified_connect(websockets[user_id], user_id) for user_id in user_ids)
+    results["connect"] = elapsed / CONNECTIONS * 1e6
+
+    elapsed = await timed(manager.is_online(user_id) for user_id in lookup_ids)
+    results["lookup"] = elapsed / LOOKUPS * 1e6
+
+    #接続・切断を繰り返しながら参照する
+    churn_ids = user_ids[:CONNECTIONS // 10]
+    async def churn(user_id: str):
+        await manager.disconnect(websockets[user_id], user_id)
+        await manager.verified_connect(websockets[user_id], user_id)
+    elapsed = await timed([churn(user_id) for user_id in churn_ids] + [manager.is_online(user_id) for user_id in lookup_ids])
+    results["lookup under churn"] = elapsed / (len(churn_ids) * 2 + LOOKUPS) * 1e6
+
+    elapsed = await timed(manager.disconnect(websockets[user_id], user_id) for user_id in user_ids)
+    results["disconnect"] = elapsed / CONNECTIONS * 1e6
+    return results
+
+async def main():
+    print(f"{CONNECTIONS} connections, {LOOKUPS} lookups")
+    legacy = await run(LegacyConnectionManager())
+    striped = await run(StripedConnectionManager())
+    print(f"{'phase':>20} {'global lock + list (us/op)':>28} {'striped + dict (us/op)':>24}")
+    for phase in legacy:
+        print(f"{phase:>20} {legacy[phase]:>28.2f} {striped[phase]:>24.2f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
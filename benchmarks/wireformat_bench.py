@@ -0,0 +1,81 @@
+"""
+websocketのフレームの形式(JSON・MessagePack)のベンチマーク
+代表的なフレームについて、形式ごとのフレーム1件あたりのバイト数とエンコード・デコードのCPU時間を比較する
+受信側はparse_request(解析と検証)の時間も計測する
+
+使い方:
+    python -m benchmarks.wireformat_bench
+"""
+import base64
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from websocket.codec import FORMATS, encode, decode
+from websocket.dispatcher import parse_request
+
+ITERATIONS = 2000
+MESSAGE_TEXT = "ベンチマーク用のメッセージ " * 8
+
+def message(room_id: str) -> dict:
+    return {
+        "id":str(uuid.uuid4()),
+        "room_id":room_id,
+        "sender_id":str(uuid.uuid4()),
+        "type":"text",
+        "content":MESSAGE_TEXT,
+        "created_at":str(datetime.now())}
+
+def outgoing_frames() -> dict:
+    """サーバーが送信するフレーム"""
+    room_id = str(uuid.uuid4())
+    return {
+        "reply": {"id":1,"type":"reply-SendMessage","content":{"message":"Message sent"}},
+        "ReceiveMessage": {"type":"ReceiveMessage","content":message(room_id)},
+        "Latest-Message (100件)": {"type":"Latest-Message","content":[message(room_id) for _ in range(100)]},
+        "ReceiveMessage (画像 64KB)": {"type":"ReceiveMessage","content":{**message(room_id),"type":"image","content":base64.b64encode(os.urandom(48 * 1024)).decode()}},
+    }
+
+def incoming_frames() -> dict:
+    """クライアントが送信するフレーム"""
+    room_id = str(uuid.uuid4())
+    return {
+        "SendMessage (テキスト)": {"id":1,"type":"SendMessage","content":{"type":"text","roomid":room_id,"message":MESSAGE_TEXT}},
+        "SendMessage (画像 64KB)": {"id":2,"type":"SendMessage","content":{"type":"image","roomid":room_id,"image":base64.b64encode(os.urandom(48 * 1024)).decode()}},
+        "GetHistory": {"id":3,"type":"GetHistory","content":{"roomid":room_id,"limit":50}},
+    }
+
+def measure(func, iterations: int = ITERATIONS) -> float:
+    """1回あたりの時間(µs)"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+def main():
+    print(f"formats: {', '.join(FORMATS)}")
+    print()
+    print("送信するフレーム")
+    print(f"  {'frame':<28}{'format':<10}{'bytes':>10}{'encode µs':>12}{'decode µs':>12}")
+    for name, frame in outgoing_frames().items():
+        for format in FORMATS:
+            data = encode(frame, format)
+            size = len(data.encode("utf-8")) if isinstance(data, str) else len(data)
+            encode_us = measure(lambda: encode(frame, format))
+            decode_us = measure(lambda: decode(data))
+            print(f"  {name:<28}{format:<10}{size:>10}{encode_us:>12.2f}{decode_us:>12.2f}")
+    print()
+    print("受信するフレーム")
+    print(f"  {'frame':<28}{'format':<10}{'bytes':>10}{'parse µs':>12}")
+    for name, frame in incoming_frames().items():
+        for format in FORMATS:
+            data = encode(frame, format)
+            size = len(data.encode("utf-8")) if isinstance(data, str) else len(data)
+            parse_us = measure(lambda: parse_request(data))
+            print(f"  {name:<28}{format:<10}{size:>10}{parse_us:>12.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -2,3 +2,63 @@ VALIDITY_HOURS = {
     "access_token": 1, #アプリを一時間起動したままにすることを制限(ほぼ制約なし)
     "refresh_token": 24*30*6 #半年に一回再ログインを要求
 }
+
+DATABASE_CONNINFO = "host=192.168.0.151 dbname=chatandschedule user=postgres password=maguro39"
+APPLY_MIGRATIONS_ON_STARTUP = True #起動時に未適用のマイグレーションを適用する(python -m database.migrate でも適用可能)
+
+UNREAD_BACKLOG_LIMIT = 100 #接続時に送信するルームごとの未読メッセージの上限(超えた分は件数のみ送信)
+UNREAD_CHUNK_SIZE = 100 #接続時に未読メッセージを送信する1フレームあたりの最大件数
+UNREAD_MAX_QUEUED_FRAMES = 4 #未読メッセージの送信中に送信キューに溜めるフレーム数の上限(超えた場合は送信されるまで次の取得を待つ)
+SEARCH_PAGE_SIZE = 20 #ユーザー検索の1ページあたりの件数
+SEARCH_DEBOUNCE_MS = 150 #ユーザー検索の1ページ目はこの時間内に次の検索が来た場合に取り消す
+HISTORY_PAGE_SIZE = 50 #メッセージ履歴の1ページあたりの件数(省略時)
+HISTORY_MAX_PAGE_SIZE = 200 #メッセージ履歴の1ページあたりの件数の上限
+OUTBOX_MAX_SIZE = 256 #接続ごとの送信キューの上限
+OUTBOX_OVERFLOW_POLICY = "drop_oldest" #送信キューが上限に達した場合の動作("drop_oldest": 古いエフェメラルなイベントを破棄, "disconnect": 切断)
+EVENT_BUS_BACKEND = "postgres" #ワーカー間のイベントバス("postgres": LISTEN/NOTIFY, "inprocess": 単一プロセス(テスト用), "none": 使用しない)
+#"postgres"はbroadcast_room・他のワーカーのユーザー宛ての送信ごとにNOTIFYを発行する(送信タスクが溜まった分を一つのトランザクションにまとめる)
+#ワーカーが一つの場合は配送先がないため"none"にしてNOTIFYの負荷をなくす
+EVENT_BUS_CHANNEL = "chat_events" #LISTEN/NOTIFYのチャンネル名
+EVENT_PAYLOAD_TTL_SECONDS = 300 #NOTIFYの上限を超えたイベントの本体を保持する時間
+CONNECTION_LOCK_STRIPES = 64 #接続の登録・解除に使用するロックの分割数
+MAX_IN_FLIGHT_PER_CONNECTION = 8 #接続ごとに同時に実行するハンドラの上限
+MAX_IN_FLIGHT_GLOBAL = 500 #全接続で同時に実行するハンドラの上限
+RATE_LIMITS = { #メッセージの種類ごとの流量制限(1秒あたりの回数, 連続で受け付ける回数)
+    "SendMessage": (5, 20),
+    "SearchUsers": (5, 10),
+    "GetHistory": (5, 10),
+    "CreateRoom": (0.2, 3),
+    "JoinRoom": (1, 5),
+    "LeaveRoom": (1, 5),
+    "Friend": (1, 5),
+    "UnFriend": (1, 5),
+}
+DEFAULT_RATE_LIMIT = (10, 20) #RATE_LIMITSにないメッセージの種類の流量制限
+TOKEN_EXPIRY_WARNING_SECONDS = 600 #アクセストークンの有効期限の何秒前に警告を送信するか
+TOKEN_TIMER_TICK_SECONDS = 1 #有効期限を管理するタイマーホイールの1tickの秒数
+TOKEN_TIMER_SLOTS = 4096 #タイマーホイールのスロット数(tick_seconds*slotsが有効期限より長いとスロットの再確認が減る)
+FRIEND_REQUEST_CACHE_SIZE = 10000 #友達申請をメモリに保持するユーザー数の上限(超えた場合は最も古く参照したユーザーから削除)
+FRIEND_REQUEST_CACHE_TTL_SECONDS = 300 #友達申請をメモリに保持する時間
+REPLAY_BUFFER_SIZE = 200 #再接続時に再送できるユーザーごとのイベント数(OUTBOX_MAX_SIZEより小さくする)
+REPLAY_RETENTION_SECONDS = 300 #切断したユーザーの再送用のイベントを保持する時間
+REPLAY_MAX_DETACHED = 10000 #再送用のイベントを保持する切断したユーザー数の上限
+READ_POSITION_FLUSH_MS = 500 #フォーカス・フォーカス解除による既読位置(last_viewed_at)の更新をまとめてデータベースに書き込む間隔(他のワーカーから既読位置を読んだ場合の遅れの上限)
+MESSAGE_WRITER_MAX_BATCH = 500 #メッセージを一度に保存する最大件数
+MESSAGE_WRITER_CONCURRENCY = 2 #メッセージを保存するタスクの数(同時にコミットするトランザクションの数、同じルームのメッセージは同じタスクが保存する)
+AUTH_SESSION_CACHE_SIZE = 10000 #HTTPのAPIで検証済みのアクセストークンを保持する数の上限
+AUTH_SESSION_CACHE_TTL_SECONDS = 60 #検証済みのアクセストークンを保持する時間(他のワーカーで無効になった場合もこの時間内に反映される)
+ARGON2_PARAMETERS = { #パスワードのハッシュ化のパラメータ(既存のハッシュはハッシュに含まれるパラメータで検証する)
+    "memory_cost": 47104,
+    "time_cost": 5,
+    "parallelism": 1,
+    "hash_len": 256,
+}
+PASSWORD_HASH_WORKERS = 2 #パスワードのハッシュ化・検証を行うプロセス数(同時に実行するハッシュ化の上限)
+PASSWORD_HASH_MAX_WAITING = 32 #ハッシュ化の順番を待つリクエストの上限(超えた場合は503を返す)
+NOTIFY_TRANSPORT = "fcm" #プッシュ通知の送信先("fcm": Firebase Cloud Messaging, "fake": 送信せずに記録する(ローカル環境・テスト用))
+NOTIFY_WORKERS = 2 #プッシュ通知を送信するスレッド数
+NOTIFY_QUEUE_SIZE = 10000 #送信待ちのプッシュ通知の上限(超えた場合は破棄し、メッセージの送信は待たせない)
+NOTIFY_BATCH_SIZE = 500 #一度に送信するデバイス数(FCMのマルチキャストの上限は500)
+NOTIFY_DRAIN_SIZE = 100 #送信スレッドがキューから一度に取り出す通知の数(まとめて送信先のトークンを取得する)
+NOTIFY_MAX_RETRIES = 3 #一時的なエラーで送信に失敗したデバイスへの再送回数
+NOTIFY_RETRY_BASE_SECONDS = 1 #再送までの待ち時間(再送のたびに2倍にする)
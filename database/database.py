@@ -1,13 +1,17 @@
 from psycopg import sql
-from psycopg_pool import ConnectionPool
-from typing import Optional, List, Dict
+from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool, AsyncConnectionPool
+from typing import Optional, List, Dict, Sequence, Tuple, Union
+from contextlib import contextmanager, asynccontextmanager
+import inspect
+from config import DATABASE_CONNINFO
 
 class Database:
     def __init__(self):
         try:
             # 接続プールの作成
             self.pool = ConnectionPool(
-                "host=192.168.0.151 dbname=chatandschedule user=postgres password=maguro39",
+                DATABASE_CONNINFO,
                 min_size=1,
                 max_size=10
             )
@@ -26,6 +30,20 @@ class Database:
             print(f"Error getting connection: {e}")
             raise e
 
+    @contextmanager
+    def unit_of_work(self):
+        """
+        トランザクションの範囲を作成する(AsyncDatabase.unit_of_workの同期版)
+        ブロックを正常に抜けるとコミットし、例外が発生した場合はロールバックする
+        コミットした場合のみ、接続をプールへ返却した後に登録された処理を実行する
+        """
+        with self.pool.connection() as conn:
+            with conn.transaction():
+                with conn.cursor(row_factory=dict_row) as cursor:
+                    uow = UnitOfWork(cursor, sync=True)
+                    yield uow
+        uow.run_after_commit_sync()
+
     def fetch_all_data(self, cursor, table: str) -> Optional[List[Dict]]:
         try:
             query = sql.SQL("SELECT * FROM {}").format(sql.Identifier(table))
@@ -167,23 +185,538 @@ class Database:
             print(f"Error fetching data: {e}")
             raise e
         
-    def in_fetch(self, cursor, table: str, key: str, filters: List) -> Optional[List[Dict]]:
+    def bulk_fetch(self, cursor, table: str, keys: Union[str, Sequence[str]], values: List, columns: Optional[List[str]] = None, key_types: Optional[Dict[str, str]] = None) -> Optional[List[Dict]]:
+        """
+        複数のキーに一致する行を一度のクエリで取得する
+        keysが複数列の場合はvaluesにタプルのリストを渡す
+        key_typesで配列パラメータの型を指定する(例: {"id": "uuid"}、keysが複数列の場合は全ての列に必須)
+        """
+        try:
+            if values == []:
+                return []
+            query, params = _bulk_fetch_query(table, keys, values, columns, key_types)
+            cursor.execute(query, params)
+            return cursor.fetchall()
+        except Exception as e:
+            print(f"Error fetching data: {e}")
+            raise e
+
+    def fetch_room_fcm_tokens(self, cursor, room_id: str, exclude_user_ids: List[str]) -> List[str]:
+        """
+        ルームの参加者(exclude_user_idsを除く)のFCMトークンを取得する
+        """
+        try:
+            cursor.execute("""
+                SELECT u.fcm_token FROM room_participants rp
+                JOIN users u ON u.id = rp.user_id
+                WHERE rp.id = %s AND NOT rp.user_id = ANY(%s::uuid[])
+                AND u.fcm_token IS NOT NULL AND u.fcm_token <> ''
+            """, [room_id, exclude_user_ids])
+            return [row["fcm_token"] if isinstance(row, dict) else row[0] for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"Error fetching data: {e}")
+            raise e
+
+    def clear_fcm_tokens(self, cursor, fcm_tokens: List[str]) -> int:
+        """
+        無効になったFCMトークンを削除する(戻り値は更新した行数)
+        """
+        try:
+            cursor.execute("UPDATE users SET fcm_token = NULL WHERE fcm_token = ANY(%s::text[])", [fcm_tokens])
+            return cursor.rowcount
+        except Exception as e:
+            print(f"Error updating data: {e}")
+            raise e
+
+def _bulk_fetch_query(table: str, keys: Union[str, Sequence[str]], values: List, columns: Optional[List[str]], key_types: Optional[Dict[str, str]]):
+    """
+    bulk_fetchのクエリを作成する
+    値はリテラルとして埋め込まず配列のパラメータとして渡すため、値の個数によらずクエリの形が変わらない
+    (psycopgの自動プリペアによりプランがキャッシュされる)
+    """
+    if key_types is None:
+        key_types = {}
+    if columns:
+        select = sql.SQL(", ").join(map(sql.Identifier, columns))
+    else:
+        select = sql.SQL("*")
+
+    def array_param(key: str):
+        if key in key_types:
+            return sql.SQL("%s::{}[]").format(sql.Identifier(key_types[key]))
+        return sql.SQL("%s")
+
+    if isinstance(keys, str):
+        query = sql.SQL("SELECT {} FROM {} WHERE {} = ANY({})").format(
+            select,
+            sql.Identifier(table),
+            sql.Identifier(keys),
+            array_param(keys)
+        )
+        return query, [list(values)]
+
+    #複数列のキーは列ごとの配列をunnestして比較する(型のない配列はunnestできないため全ての列の型が必要)
+    missing = [key for key in keys if key not in key_types]
+    if missing:
+        raise ValueError(f"key_types is required for multi-column keys: {missing}")
+    query = sql.SQL("SELECT {} FROM {} WHERE ({}) IN (SELECT * FROM unnest({}))").format(
+        select,
+        sql.Identifier(table),
+        sql.SQL(", ").join(map(sql.Identifier, keys)),
+        sql.SQL(", ").join(array_param(key) for key in keys)
+    )
+    return query, [list(column) for column in zip(*values)]
+
+class UnitOfWork:
+    """
+    一つのトランザクションの範囲を表す
+    websocketへの送信やFCMの呼び出しなどの通信はafter_commitで登録しておき、
+    コミットして接続をプールへ返却した後にまとめて実行する
+    syncがTrueの場合(Database.unit_of_work)は登録された処理をawaitできないため、コルーチン関数は登録できない
+    """
+    def __init__(self, cursor, sync: bool = False):
+        self.cursor = cursor
+        self.sync = sync
+        self._after_commit = []
+
+    def after_commit(self, func, *args, **kwargs):
+        """
+        コミット後に実行する処理を登録する(funcの戻り値がawaitableならawaitする)
+        ロールバックされた場合は実行されない
+        """
+        if self.sync and inspect.iscoroutinefunction(func):
+            raise TypeError(f"Cannot register coroutine function {func!r} in a sync unit of work")
+        self._after_commit.append((func, args, kwargs))
+
+    async def run_after_commit(self):
+        """登録された処理を登録順に実行する"""
+        events, self._after_commit = self._after_commit, []
+        for func, args, kwargs in events:
+            try:
+                result = func(*args, **kwargs)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                print(f"Error running after commit: {e}")
+
+    def run_after_commit_sync(self):
+        """登録された処理を登録順に実行する(Database.unit_of_workから呼び出す)"""
+        events, self._after_commit = self._after_commit, []
+        for func, args, kwargs in events:
+            try:
+                result = func(*args, **kwargs)
+                if inspect.iscoroutine(result):
+                    #登録時に判別できなかったコルーチン(コルーチンを返す関数など)は実行できないため破棄する
+                    result.close()
+                    raise TypeError(f"{func!r} returned a coroutine in a sync unit of work")
+            except Exception as e:
+                print(f"Error running after commit: {e}")
+
+class AsyncDatabase:
+    """
+    Databaseの非同期版
+    websocketのハンドラなどイベントループ上から呼び出す場合はこちらを使用する
+    """
+    def __init__(self):
+        try:
+            # 接続プールの作成(イベントループ上でopen()を呼び出すまで接続しない)
+            self.pool = AsyncConnectionPool(
+                DATABASE_CONNINFO,
+                min_size=1,
+                max_size=10,
+                open=False
+            )
+        except Exception as e:
+            print(f"Error creating async connection pool: {e}")
+            self.pool = None
+
+    async def open(self):
+        """接続プールを開く(アプリケーションの起動時に呼び出す)"""
+        try:
+            await self.pool.open()
+            print('\033[32m' + "DBinfo" + '\033[0m' + ":   " + "Async database connection pool created successfully")
+        except Exception as e:
+            print(f"Error opening async connection pool: {e}")
+            raise e
+
+    async def close(self):
+        """接続プールを閉じる(アプリケーションの終了時に呼び出す)"""
+        try:
+            await self.pool.close()
+        except Exception as e:
+            print(f"Error closing async connection pool: {e}")
+
+    def get_connection(self):
+        """接続プールから接続を取得(async withで使用する)"""
+        try:
+            return self.pool.connection()
+        except Exception as e:
+            print(f"Error getting connection: {e}")
+            raise e
+
+    @asynccontextmanager
+    async def unit_of_work(self):
+        """
+        トランザクションの範囲を作成する
+        ブロックを正常に抜けるとコミットし、例外が発生した場合はロールバックする
+        どちらの場合も接続はプールへ返却され、コミットした場合のみ登録された送信処理を実行する
+        """
+        async with self.pool.connection() as conn:
+            async with conn.transaction():
+                async with conn.cursor(row_factory=dict_row) as cursor:
+                    uow = UnitOfWork(cursor)
+                    yield uow
+        await uow.run_after_commit()
+
+    async def fetch_all_data(self, cursor, table: str) -> Optional[List[Dict]]:
+        try:
+            query = sql.SQL("SELECT * FROM {}").format(sql.Identifier(table))
+            await cursor.execute(query)
+            return await cursor.fetchall()
+        except Exception as e:
+            print(f"Error fetching all data: {e}")
+            raise e
+
+    async def fetch(self, cursor, table: str, filters: dict) -> Optional[List[Dict]]:
         try:
-            # IN句のフィルタのためのプレースホルダーを作成
-            placeholders = sql.SQL(', ').join(filter for filter in filters)
-            query = sql.SQL("SELECT * FROM {} WHERE {} IN ({})").format(
+            filter_clauses = []
+            values = []
+            for key, value in filters.items():
+                filter_clauses.append(sql.SQL("{} = %s").format(sql.Identifier(key)))
+                values.append(value)
+            query = sql.SQL("SELECT * FROM {} WHERE {}").format(
                 sql.Identifier(table),
-                sql.Identifier(key),
-                placeholders
+                sql.SQL(" AND ").join(filter_clauses)
             )
-            cursor.execute(query)
-            return cursor.fetchall()
-        
+            await cursor.execute(query, values)
+            return await cursor.fetchall()
+        except Exception as e:
+            print(f"Error fetching data: {e}")
+            raise e
+
+    async def fetch_before_datetime(self, cursor, table:str, filters: dict, datetime_column: str, datetime: str) -> Optional[List[Dict]]:
+        try:
+            filter_clauses = []
+            values = []
+            for key, value in filters.items():
+                filter_clauses.append(sql.SQL("{} = %s").format(sql.Identifier(key)))
+                values.append(value)
+            values.append(datetime)
+            query = sql.SQL("SELECT * FROM {} WHERE {} AND {} <= %s").format(
+                sql.Identifier(table),
+                sql.SQL(" AND ").join(filter_clauses),
+                sql.Identifier(datetime_column)
+            )
+            await cursor.execute(query, values)
+            return await cursor.fetchall()
+        except Exception as e:
+            print(f"Error fetching data: {e}")
+            raise e
+
+    async def fetch_after_datetime(self, cursor, table:str, filters: dict, datetime_column: str, datetime: str) -> Optional[List[Dict]]:
+        try:
+            filter_clauses = []
+            values = []
+            for key, value in filters.items():
+                filter_clauses.append(sql.SQL("{} = %s").format(sql.Identifier(key)))
+                values.append(value)
+            values.append(datetime)
+            query = sql.SQL("SELECT * FROM {} WHERE {} AND {} > %s").format(
+                sql.Identifier(table),
+                sql.SQL(" AND ").join(filter_clauses),
+                sql.Identifier(datetime_column)
+            )
+            await cursor.execute(query, values)
+            return await cursor.fetchall()
+        except Exception as e:
+            print(f"Error fetching data: {e}")
+            raise e
+
+    async def insert(self, cursor, table: str, data: dict) -> bool:
+        try:
+            keys = data.keys()
+            values = list(data.values())
+            query = sql.SQL("INSERT INTO {} ({}) VALUES ({})").format(
+                sql.Identifier(table),
+                sql.SQL(", ").join(map(sql.Identifier, keys)),
+                sql.SQL(", ").join(sql.Placeholder() * len(keys))
+            )
+            await cursor.execute(query, values)
+            return True
+        except Exception as e:
+            print(f"Error inserting data: {e}")
+            return False
+
+    async def update(self, cursor, table: str, data: dict, filters: dict) -> bool:
+        try:
+            set_clauses = []
+            filter_clauses = []
+            values = []
+            for key, value in data.items():
+                set_clauses.append(sql.SQL("{} = %s").format(sql.Identifier(key)))
+                values.append(value)
+            for key, value in filters.items():
+                filter_clauses.append(sql.SQL("{} = %s").format(sql.Identifier(key)))
+                values.append(value)
+            query = sql.SQL("UPDATE {} SET {} WHERE {}").format(
+                sql.Identifier(table),
+                sql.SQL(", ").join(set_clauses),
+                sql.SQL(" AND ").join(filter_clauses)
+            )
+            await cursor.execute(query, values)
+            return True
+        except Exception as e:
+            print(f"Error updating data: {e}")
+            return False
+
+    async def delete(self, cursor, table: str, filters: dict) -> bool:
+        try:
+            filter_clauses = []
+            values = []
+            for key, value in filters.items():
+                filter_clauses.append(sql.SQL("{} = %s").format(sql.Identifier(key)))
+                values.append(value)
+            query = sql.SQL("DELETE FROM {} WHERE {}").format(
+                sql.Identifier(table),
+                sql.SQL(" AND ").join(filter_clauses)
+            )
+            await cursor.execute(query, values)
+            return True
+        except Exception as e:
+            print(f"Error deleting data: {e}")
+            return False
+
+    async def like(self, cursor, table: str, filters: dict, like_filteers: dict, limit:str) -> Optional[List[Dict]]:
+        try:
+            filter_clauses = []
+            values = []
+            for key, value in filters.items():
+                filter_clauses.append(sql.SQL("{} = %s").format(sql.Identifier(key)))
+                values.append(value)
+            for key, value in like_filteers.items():
+                filter_clauses.append(sql.SQL("{} LIKE %s").format(sql.Identifier(key)))
+                values.append(f'%{value}%')
+            query = sql.SQL("SELECT * FROM {} WHERE {} LIMIT {}").format(
+                sql.Identifier(table),
+                sql.SQL(" AND ").join(filter_clauses),
+                sql.Literal(int(limit))
+            )
+            await cursor.execute(query, values)
+            return await cursor.fetchall()
+        except Exception as e:
+            print(f"Error fetching data: {e}")
+            raise e
+
+    async def bulk_fetch(self, cursor, table: str, keys: Union[str, Sequence[str]], values: List, columns: Optional[List[str]] = None, key_types: Optional[Dict[str, str]] = None) -> Optional[List[Dict]]:
+        """
+        複数のキーに一致する行を一度のクエリで取得する
+        keysが複数列の場合はvaluesにタプルのリストを渡す
+        key_typesで配列パラメータの型を指定する(例: {"id": "uuid"}、keysが複数列の場合は全ての列に必須)
+        """
+        try:
+            if values == []:
+                return []
+            query, params = _bulk_fetch_query(table, keys, values, columns, key_types)
+            await cursor.execute(query, params)
+            return await cursor.fetchall()
+        except Exception as e:
+            print(f"Error fetching data: {e}")
+            raise e
+
+    async def fetch_rooms_info(self, cursor, user_id: str) -> Optional[List[Dict]]:
+        """
+        ユーザーが参加しているルームの情報と各ルームの参加者を一度のクエリで取得する
+        participantsには参加者のユーザーIDの配列が入る
+        """
+        try:
+            query = sql.SQL("""
+                SELECT r.id::text AS id, r.name, r.avatar_path, me.joined_at,
+                       array_agg(p.user_id::text) AS participants
+                FROM room_participants me
+                JOIN rooms r ON r.id = me.id
+                JOIN room_participants p ON p.id = me.id
+                WHERE me.user_id = %s
+                GROUP BY r.id, r.name, r.avatar_path, me.joined_at
+                ORDER BY me.joined_at
+            """)
+            await cursor.execute(query, [user_id])
+            return await cursor.fetchall()
         except Exception as e:
             print(f"Error fetching data: {e}")
             raise e
 
+    async def fetch_unread_messages(self, cursor, user_id: str, limit: int, chunk_size: int, after: Optional[Dict] = None) -> Tuple[List[Dict], Dict[str, int], Optional[Dict]]:
+        """
+        ユーザーが参加している全てのルームの未読メッセージを(ルームID, 作成日時, ID)の順にchunk_size行ずつ取得する
+        ルームごとに新しいものからlimit件までを返し、未読がlimit件を超えるルームは未読の総数を返す
+        afterに前回の戻り値のnextを渡すと続きを返す(1回目に取得した時刻までのメッセージのみを対象にするため、途中で送信されたメッセージは含まない)
+        戻り値: (メッセージのリスト, {ルームID: 未読件数}, next(最後の場合はNone))
+        """
+        try:
+            params = {"user_id": user_id, "limit": limit, "chunk_size": chunk_size}
+            keyset = sql.SQL("")
+            if after is None:
+                as_of = sql.SQL("statement_timestamp()")
+            else:
+                as_of = sql.SQL("%(as_of)s::timestamptz")
+                keyset = sql.SQL("AND rp.id >= %(after_room_id)s::uuid AND (rp.id, m.created_at, m.id) > (%(after_room_id)s::uuid, %(after_created_at)s::timestamptz, %(after_id)s::uuid)")
+                params.update({"as_of": after["as_of"], "after_room_id": after["room_id"], "after_created_at": after["created_at"], "after_id": after["id"]})
+            #limit+1件目の行が存在するルームのみ未読件数を数える
+            query = sql.SQL("""
+                SELECT m.id::text AS id, rp.id::text AS room_id,
+                       COALESCE(m.sender_id::text, 'None') AS sender_id,
+                       m.type, m.content, m.created_at, m.rn, {as_of} AS as_of,
+                       CASE WHEN m.rn > %(limit)s THEN (
+                           SELECT count(*) FROM messages c
+                           WHERE c.room_id = rp.id AND c.created_at > rp.last_viewed_at AND c.created_at <= {as_of}
+                       ) END AS unread_count
+                FROM room_participants rp
+                CROSS JOIN LATERAL (
+                    SELECT id, sender_id, type, content, created_at,
+                           row_number() OVER (ORDER BY created_at DESC, id DESC) AS rn
+                    FROM messages
+                    WHERE room_id = rp.id AND created_at > rp.last_viewed_at AND created_at <= {as_of}
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT %(limit)s + 1
+                ) m
+                WHERE rp.user_id = %(user_id)s {keyset}
+                ORDER BY rp.id, m.created_at, m.id
+                LIMIT %(chunk_size)s
+            """).format(as_of=as_of, keyset=keyset)
+            await cursor.execute(query, params)
+            rows = await cursor.fetchall()
+            next = None
+            if len(rows) == chunk_size:
+                last = rows[-1]
+                next = {"room_id": last["room_id"], "created_at": last["created_at"], "id": last["id"], "as_of": last["as_of"]}
+            messages = []
+            unread_counts = {}
+            for row in rows:
+                rn = row.pop("rn")
+                unread_count = row.pop("unread_count")
+                row.pop("as_of")
+                if rn > limit:
+                    unread_counts[row["room_id"]] = unread_count
+                else:
+                    messages.append(row)
+            return messages, unread_counts, next
+        except Exception as e:
+            print(f"Error fetching data: {e}")
+            raise e
+
+    async def search_users(self, cursor, key: str, exclude_user_id: str, limit: int, after: Optional[Dict] = None) -> Optional[List[Dict]]:
+        """
+        ユーザー名で検索し、類似度の高い(トライグラムの距離が近い)順にid, name, avatar_pathを返す
+        keyが短い(3文字未満)場合は前方一致、それ以外は部分一致で検索する
+        GiSTのトライグラムインデックスを距離順に走査するため、一致する行が多くてもlimit件で走査を打ち切る
+        afterに前のページの最後の行の{"score", "id"}を渡すと続きを返す(scoreは距離)
+        """
+        try:
+            escaped = key.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            params = {
+                "key": key,
+                "pattern": f"{escaped}%" if len(key) < 3 else f"%{escaped}%",
+                "exclude_user_id": exclude_user_id,
+                "limit": limit
+            }
+            keyset = sql.SQL("")
+            if after is not None:
+                keyset = sql.SQL("AND (name <-> %(key)s, id) > (%(after_score)s::real, %(after_id)s::uuid)")
+                params["after_score"] = after["score"]
+                params["after_id"] = after["id"]
+            query = sql.SQL("""
+                SELECT id::text AS id, name, avatar_path, name <-> %(key)s AS score
+                FROM users
+                WHERE name ILIKE %(pattern)s AND id <> %(exclude_user_id)s {}
+                ORDER BY name <-> %(key)s, id
+                LIMIT %(limit)s
+            """).format(keyset)
+            await cursor.execute(query, params)
+            return await cursor.fetchall()
+        except Exception as e:
+            print(f"Error fetching data: {e}")
+            raise e
+
+    async def fetch_message_history(self, cursor, room_id: str, limit: int, before: Optional[Dict] = None) -> Optional[List[Dict]]:
+        """
+        ルームのメッセージを新しい順にlimit件取得する
+        beforeに前のページの最後の行の{"created_at", "id"}を渡すとそれより古いメッセージを返す
+        (OFFSETを使用しないため、どのページでも取得のコストは変わらない)
+        """
+        try:
+            params = {"room_id": room_id, "limit": limit}
+            keyset = sql.SQL("")
+            if before is not None:
+                keyset = sql.SQL("AND (created_at, id) < (%(before_created_at)s::timestamptz, %(before_id)s::uuid)")
+                params["before_created_at"] = before["created_at"]
+                params["before_id"] = before["id"]
+            query = sql.SQL("""
+                SELECT id::text AS id, room_id::text AS room_id,
+                       COALESCE(sender_id::text, 'None') AS sender_id,
+                       type, content, created_at
+                FROM messages
+                WHERE room_id = %(room_id)s {}
+                ORDER BY created_at DESC, id DESC
+                LIMIT %(limit)s
+            """).format(keyset)
+            await cursor.execute(query, params)
+            return await cursor.fetchall()
+        except Exception as e:
+            print(f"Error fetching data: {e}")
+            raise e
+
+    async def insert_friend_request(self, cursor, user_id: str, requester_id: str) -> bool:
+        """
+        requester_idからuser_idへの友達申請を保存する
+        既に同じ申請がある場合は何もしない(戻り値は新たに保存した場合のみTrue)
+        """
+        try:
+            await cursor.execute("""
+                INSERT INTO friend_requests (user_id, requester_id) VALUES (%s, %s)
+                ON CONFLICT (user_id, requester_id) DO NOTHING
+                RETURNING user_id
+            """, [user_id, requester_id])
+            return await cursor.fetchone() is not None
+        except Exception as e:
+            print(f"Error inserting data: {e}")
+            raise e
+
+    async def update_last_viewed_at(self, cursor, room_ids: List[str], user_ids: List[str], viewed_at: List) -> int:
+        """
+        複数の(ルーム, ユーザー)のlast_viewed_atを一度のUPDATEで更新する
+        既に新しい値が保存されている場合は更新しない(戻り値は更新した行数)
+        """
+        try:
+            await cursor.execute("""
+                UPDATE room_participants rp
+                SET last_viewed_at = v.viewed_at
+                FROM unnest(%s::uuid[], %s::uuid[], %s::timestamptz[]) AS v(id, user_id, viewed_at)
+                WHERE rp.id = v.id AND rp.user_id = v.user_id AND rp.last_viewed_at < v.viewed_at
+            """, [room_ids, user_ids, viewed_at])
+            return cursor.rowcount
+        except Exception as e:
+            print(f"Error updating data: {e}")
+            raise e
+
+    async def insert_messages(self, cursor, messages: List[Dict]) -> List[str]:
+        """
+        複数のメッセージを一度のINSERTで保存する
+        messagesは{"id", "room_id", "sender_id", "type", "content", "created_at"}のリスト(戻り値は保存したメッセージのID)
+        created_atは呼び出し側で設定する(now()では同じトランザクションのメッセージが全て同じ時刻になり、順序がidで決まってしまうため)
+        """
+        try:
+            await cursor.execute("""
+                INSERT INTO messages (id, room_id, sender_id, type, content, created_at)
+                SELECT * FROM unnest(%s::uuid[], %s::uuid[], %s::uuid[], %s::text[], %s::text[], %s::timestamptz[])
+                RETURNING id::text AS id
+            """, [[message[key] for message in messages] for key in ("id", "room_id", "sender_id", "type", "content", "created_at")])
+            return [row["id"] for row in await cursor.fetchall()]
+        except Exception as e:
+            print(f"Error inserting data: {e}")
+            raise e
+
 database = Database()
+async_database = AsyncDatabase()
 
 # example
 """
@@ -191,4 +724,15 @@ from psycopg.rows import dict_row
 with database.get_connection() as conn:
     with conn.cursor(row_factory=dict_row) as cursor:
         a = database.fetch(cursor, "users", {"name": "test"})
-"""
\ No newline at end of file
+
+# async example
+from psycopg.rows import dict_row
+async with async_database.get_connection() as conn:
+    async with conn.cursor(row_factory=dict_row) as cursor:
+        a = await async_database.fetch(cursor, "users", {"name": "test"})
+
+# unit of work example
+async with async_database.unit_of_work() as uow:
+    await async_database.insert(uow.cursor, "rooms", {"id": roomid, "name": "test"})
+    uow.after_commit(manager.send_personal_message, {"type": "JoinRoom", "content": {...}}, ws)
+"""
@@ -0,0 +1,198 @@
+import argparse
+import asyncio
+import os
+import re
+import sys
+import psycopg
+from psycopg import sql
+from datetime import datetime
+from typing import List, Tuple
+from config import DATABASE_CONNINFO
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "migrations")
+MIGRATION_LOCK_ID = 4315001 #複数のワーカーが同時に起動した場合に一度だけ適用するためのアドバイザリロック
+
+def list_migrations() -> List[Tuple[int, str, str]]:
+    """
+    migrationsディレクトリのマイグレーションを(バージョン, 名前, パス)のリストでバージョン順に返す
+    ファイル名は "0001_name.sql" の形式
+    """
+    migrations = []
+    for file_name in os.listdir(MIGRATIONS_DIR):
+        match = re.fullmatch(r"(\d+)_(\w+)\.sql", file_name)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_DIR, file_name)))
+    migrations.sort()
+    return migrations
+
+def apply_migrations(conninfo: str = DATABASE_CONNINFO) -> List[str]:
+    """
+    未適用のマイグレーションをバージョン順に適用する
+    各マイグレーションは一つのトランザクションで適用し、schema_migrationsに記録する
+    戻り値は適用したマイグレーションの名前のリスト
+    """
+    applied_names = []
+    with psycopg.connect(conninfo, autocommit=True) as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version integer PRIMARY KEY,
+                name text NOT NULL,
+                applied_at timestamp with time zone NOT NULL DEFAULT now()
+            )
+        """)
+        conn.execute("SELECT pg_advisory_lock(%s)", [MIGRATION_LOCK_ID])
+        try:
+            applied = {row[0] for row in conn.execute("SELECT version FROM schema_migrations").fetchall()}
+            for version, name, path in list_migrations():
+                if version in applied:
+                    continue
+                with open(path, encoding="utf-8") as f:
+                    migration = f.read()
+                with conn.transaction():
+                    conn.execute(migration)
+                    conn.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", [version, name])
+                applied_names.append(f"{version:04d}_{name}")
+                print('\033[32m' + "DBinfo" + '\033[0m' + ":   " + f"Applied migration {version:04d}_{name}")
+        finally:
+            conn.execute("SELECT pg_advisory_unlock(%s)", [MIGRATION_LOCK_ID])
+    return applied_names
+
+class RecordingCursor:
+    """
+    実行せずにクエリとパラメータを記録するカーソル
+    database.pyのメソッドが発行するクエリの形を取得するために使用する
+    """
+    def __init__(self):
+        self.queries = []
+        self.rowcount = 0
+
+    def execute(self, query, params=None):
+        self.queries.append((query, params))
+
+    def fetchall(self):
+        return []
+
+class AsyncRecordingCursor(RecordingCursor):
+    """RecordingCursorの非同期版"""
+    async def execute(self, query, params=None):
+        self.queries.append((query, params))
+
+    async def fetchall(self):
+        return []
+
+
+SAMPLE_UUID = "00000000-0000-4000-8000-000000000000"
+SAMPLE_TOKEN = "sample-token"
+SAMPLE_DATETIME = datetime(2024, 1, 1)
+
+def query_shapes() -> List[Tuple[str, object, object]]:
+    """
+    ホットパスで発行されるクエリの形を(名前, クエリ, パラメータ)のリストで返す
+    """
+    from database.database import database, async_database
+
+    sync_shapes = {
+        "users by id": lambda c: database.fetch(c, "users", {"id": SAMPLE_UUID}),
+        "users by access_token": lambda c: database.fetch(c, "users", {"access_token": SAMPLE_TOKEN}),
+        "users by refresh_token": lambda c: database.fetch(c, "users", {"refresh_token": SAMPLE_TOKEN}),
+        "users by email": lambda c: database.fetch(c, "users", {"email": "user@example.com"}),
+        "access_tokens by access_token": lambda c: database.fetch(c, "access_tokens", {"access_token": SAMPLE_TOKEN}),
+        "refresh_tokens by refresh_token": lambda c: database.fetch(c, "refresh_tokens", {"refresh_token": SAMPLE_TOKEN}),
+        "rooms by id": lambda c: database.fetch(c, "rooms", {"id": SAMPLE_UUID}),
+        "room_participants by id": lambda c: database.fetch(c, "room_participants", {"id": SAMPLE_UUID}),
+        "room_participants by user_id": lambda c: database.fetch(c, "room_participants", {"user_id": SAMPLE_UUID}),
+        "room_participants bulk by id": lambda c: database.bulk_fetch(c, "room_participants", "id", [SAMPLE_UUID], ["user_id"], {"id": "uuid"}),
+        "friendships by id": lambda c: database.fetch(c, "friendships", {"id": SAMPLE_UUID}),
+        "friendships by (id, friend_id)": lambda c: database.fetch(c, "friendships", {"id": SAMPLE_UUID, "friend_id": SAMPLE_UUID}),
+        "messages after datetime": lambda c: database.fetch_after_datetime(c, "messages", {"room_id": SAMPLE_UUID}, "created_at", SAMPLE_DATETIME),
+        "update room_participants last_viewed_at": lambda c: database.update(c, "room_participants", {"last_viewed_at": SAMPLE_DATETIME}, {"id": SAMPLE_UUID, "user_id": SAMPLE_UUID}),
+        "delete messages by room_id": lambda c: database.delete(c, "messages", {"room_id": SAMPLE_UUID}),
+    }
+    async_shapes = {
+        "rooms info": lambda c: async_database.fetch_rooms_info(c, SAMPLE_UUID),
+        "unread messages": lambda c: async_database.fetch_unread_messages(c, SAMPLE_UUID, 100, 100),
+        "unread messages next chunk": lambda c: async_database.fetch_unread_messages(c, SAMPLE_UUID, 100, 100, {"room_id": SAMPLE_UUID, "created_at": SAMPLE_DATETIME, "id": SAMPLE_UUID, "as_of": SAMPLE_DATETIME}),
+        "search users by name": lambda c: async_database.search_users(c, "sample", SAMPLE_UUID, 21),
+        "message history": lambda c: async_database.fetch_message_history(c, SAMPLE_UUID, 51, {"created_at": SAMPLE_DATETIME, "id": SAMPLE_UUID}),
+        "bulk insert messages": lambda c: async_database.insert_messages(c, [{"id": SAMPLE_UUID, "room_id": SAMPLE_UUID, "sender_id": SAMPLE_UUID, "type": "text", "content": "sample"}]),
+        "bulk update last_viewed_at": lambda c: async_database.update_last_viewed_at(c, [SAMPLE_UUID], [SAMPLE_UUID], [SAMPLE_DATETIME]),
+    }
+
+    shapes = []
+    for name, issue in sync_shapes.items():
+        cursor = RecordingCursor()
+        issue(cursor)
+        for query, params in cursor.queries:
+            shapes.append((name, query, params))
+    for name, issue in async_shapes.items():
+        cursor = AsyncRecordingCursor()
+        asyncio.run(issue(cursor))
+        for query, params in cursor.queries:
+            shapes.append((name, query, params))
+    return shapes
+
+def find_full_scans(conn, plan: dict) -> List[str]:
+    """
+    実行計画からテーブル全体を走査しているノードを再帰的に探す
+    Seq Scanに加えて、インデックスの先頭列を条件に使用していないインデックススキャン(インデックス全体の走査)も対象とする
+    """
+    scans = []
+    node_type = plan.get("Node Type")
+    if node_type == "Seq Scan":
+        scans.append((plan.get("Relation Name"), "sequential scan"))
+    elif node_type in ("Index Scan", "Index Only Scan", "Bitmap Index Scan"):
+        row = conn.execute("""
+            SELECT i.indrelid::regclass::text, a.attname
+            FROM pg_index i
+            JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+            WHERE i.indexrelid = to_regclass(%s)
+        """, [plan.get("Index Name")]).fetchone()
+        if row is not None and not re.search(rf"\b{re.escape(row[1])}\b", plan.get("Index Cond", "")):
+            scans.append((row[0], f"full index scan on {plan.get('Index Name')}"))
+    for child in plan.get("Plans", []):
+        scans += find_full_scans(conn, child)
+    return scans
+
+def check_query_plans(conninfo: str = DATABASE_CONNINFO, min_rows: int = 0) -> bool:
+    """
+    各クエリの形をEXPLAINし、行数がmin_rows以上のテーブルを全体走査しているものがあれば失敗とする
+    enable_seqscanを無効にして計画するため、使用できるインデックスがない場合のみ全体走査が残る
+    (テーブルが小さい開発環境でもインデックスの不足を検出できる)
+    """
+    ok = True
+    with psycopg.connect(conninfo, autocommit=True) as conn:
+        conn.execute("SET enable_seqscan = off")
+        for name, query, params in query_shapes():
+            try:
+                explain = sql.SQL("EXPLAIN (FORMAT JSON) {}").format(query if isinstance(query, sql.Composable) else sql.SQL(query))
+                plan = conn.execute(explain, params).fetchone()[0][0]["Plan"]
+            except Exception as e:
+                print(f"Error explaining {name}: {e}")
+                ok = False
+                continue
+            problems = []
+            for table, scan in find_full_scans(conn, plan):
+                rows = conn.execute("SELECT reltuples FROM pg_class WHERE oid = to_regclass(%s)", [table]).fetchone()
+                #reltuplesが負の場合は未ANALYZE(行数不明)
+                if rows is None or rows[0] < 0 or rows[0] >= min_rows:
+                    problems.append(f"{scan} ({table})")
+            if problems:
+                ok = False
+                print(f"NG  {name}: {', '.join(problems)}")
+            else:
+                print(f"OK  {name}")
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description="データベースのマイグレーション")
+    parser.add_argument("--check", action="store_true", help="マイグレーション後にクエリの実行計画を確認する")
+    parser.add_argument("--min-rows", type=int, default=0, help="Seq Scanを失敗とするテーブルの最小行数")
+    parser.add_argument("--conninfo", default=DATABASE_CONNINFO, help="接続先(省略時はconfig.pyの設定)")
+    args = parser.parse_args()
+
+    apply_migrations(args.conninfo)
+    if args.check and not check_query_plans(args.conninfo, min_rows=args.min_rows):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
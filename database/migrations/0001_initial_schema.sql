@@ -0,0 +1,64 @@
+-- アプリケーションが使用するテーブル
+-- 既存のデータベースに適用しても問題ないようにIF NOT EXISTSで作成する
+
+CREATE TABLE IF NOT EXISTS users (
+    id uuid PRIMARY KEY,
+    name text NOT NULL,
+    email text NOT NULL,
+    hash_password text NOT NULL,
+    salt text NOT NULL,
+    device_id text,
+    fcm_token text,
+    access_token text,
+    refresh_token text,
+    avatar_path text NOT NULL DEFAULT '/default.png',
+    created_at timestamp with time zone NOT NULL DEFAULT now(),
+    updated_at timestamp with time zone NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS access_tokens (
+    access_token text PRIMARY KEY,
+    validity_hours integer NOT NULL,
+    created_at timestamp with time zone NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS refresh_tokens (
+    refresh_token text PRIMARY KEY,
+    validity_hours integer NOT NULL,
+    created_at timestamp with time zone NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS rooms (
+    id uuid PRIMARY KEY,
+    name text NOT NULL,
+    avatar_path text NOT NULL DEFAULT '/default.png',
+    created_at timestamp with time zone NOT NULL DEFAULT now(),
+    updated_at timestamp with time zone NOT NULL DEFAULT now()
+);
+
+-- idはルームID
+CREATE TABLE IF NOT EXISTS room_participants (
+    id uuid NOT NULL,
+    user_id uuid NOT NULL,
+    joined_at timestamp with time zone NOT NULL DEFAULT now(),
+    last_viewed_at timestamp with time zone NOT NULL DEFAULT now(),
+    PRIMARY KEY (id, user_id)
+);
+
+-- システムメッセージはsender_idがNULL
+CREATE TABLE IF NOT EXISTS messages (
+    id uuid PRIMARY KEY,
+    room_id uuid NOT NULL,
+    sender_id uuid,
+    type text NOT NULL,
+    content text NOT NULL,
+    created_at timestamp with time zone NOT NULL DEFAULT now()
+);
+
+-- idはユーザーID(友達関係は双方向に2行で保存する)
+CREATE TABLE IF NOT EXISTS friendships (
+    id uuid NOT NULL,
+    friend_id uuid NOT NULL,
+    created_at timestamp with time zone NOT NULL DEFAULT now(),
+    PRIMARY KEY (id, friend_id)
+);
@@ -0,0 +1,13 @@
+-- 頻繁に実行されるクエリのためのインデックス
+-- room_participantsの(id, user_id)とfriendshipsの(id, friend_id)は主キーのインデックスを使用する
+
+-- ルームの未読メッセージ・履歴の取得 (room_id = ? AND created_at > ? ORDER BY created_at, id)
+CREATE INDEX IF NOT EXISTS messages_room_id_created_at_idx ON messages (room_id, created_at, id);
+
+-- ユーザーが参加しているルームの取得 (user_id = ?)
+CREATE INDEX IF NOT EXISTS room_participants_user_id_idx ON room_participants (user_id);
+
+-- 認証 (access_token = ?, refresh_token = ?) 及びログイン・登録 (email = ?)
+CREATE INDEX IF NOT EXISTS users_access_token_idx ON users (access_token);
+CREATE INDEX IF NOT EXISTS users_refresh_token_idx ON users (refresh_token);
+CREATE UNIQUE INDEX IF NOT EXISTS users_email_idx ON users (email);
@@ -0,0 +1,5 @@
+-- ユーザー名検索のためのトライグラムインデックス
+-- name ILIKE '%key%' 及び similarity(name, key) による検索で使用する
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS users_name_trgm_idx ON users USING gin (name gin_trgm_ops);
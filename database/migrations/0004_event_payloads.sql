@@ -0,0 +1,10 @@
+-- ワーカー間のイベントバス(LISTEN/NOTIFY)でNOTIFYのペイロードの上限を超えるイベントの本体
+-- 通知にはidのみを含め、受信したワーカーがこのテーブルから読み出す
+CREATE TABLE IF NOT EXISTS event_payloads (
+    id uuid PRIMARY KEY,
+    payload text NOT NULL,
+    created_at timestamp with time zone NOT NULL DEFAULT now()
+);
+
+-- 古いペイロードの削除 (created_at < ?)
+CREATE INDEX IF NOT EXISTS event_payloads_created_at_idx ON event_payloads (created_at);
@@ -0,0 +1,8 @@
+-- 承認待ちの友達申請(requester_id -> user_id)
+-- 友達登録時又は取り消し時に削除する
+CREATE TABLE IF NOT EXISTS friend_requests (
+    user_id uuid NOT NULL,
+    requester_id uuid NOT NULL,
+    created_at timestamp with time zone NOT NULL DEFAULT now(),
+    PRIMARY KEY (user_id, requester_id)
+);
@@ -0,0 +1,6 @@
+-- ユーザー名検索のトライグラムインデックスをGiSTに置き換える
+-- GINは name ILIKE '%key%' の絞り込みには使えるが、類似度順の並べ替えには一致した全ての行の取得と並べ替えが必要になる
+-- GiSTは ORDER BY name <-> key (距離の近い順)をインデックスの走査順で返せるため、LIMIT件で走査を打ち切れる
+DROP INDEX IF EXISTS users_name_trgm_idx;
+
+CREATE INDEX IF NOT EXISTS users_name_trgm_gist_idx ON users USING gist (name gist_trgm_ops);
@@ -1,14 +1,11 @@
-import asyncio
 import argon2
 from argon2 import PasswordHasher
+from config import ARGON2_PARAMETERS
+
+#ハッシュ化・検証はhashed.serviceのプロセスプールで実行する(このモジュールの関数はプロセス内で呼び出される)
+ph = PasswordHasher(**ARGON2_PARAMETERS)
 
 def generate_hash(password: str, salt: str):
-    ph = PasswordHasher(
-        memory_cost=47104,
-        time_cost=5,
-        parallelism=1,
-        hash_len=256
-    )
     try:
         hash = ph.hash(password, salt=bytes.fromhex(salt))
         return hash
@@ -19,22 +16,16 @@ def generate_hash(password: str, salt: str):
         print(f"Error hashing password: {e}")
         return None
 
-def verify_pw(password: str, hash: str, salt: str) -> bool:
-    ph = PasswordHasher(
-        memory_cost=47104,
-        time_cost=5,
-        parallelism=1,
-        hash_len=256
-    )
+def verify_pw(password: str, hash: str) -> bool:
+    """
+    パスワードを検証する
+    ハッシュにソルトとパラメータが含まれるため、ハッシュ化し直さずにPasswordHasher.verifyで比較する
+    """
     try:
-        sended_hash = ph.hash(password, salt=bytes.fromhex(salt))
-        if sended_hash == hash:
-            return True
-        else:
-            raise argon2.exceptions.VerificationError
+        return ph.verify(hash, password)
     except argon2.exceptions.VerificationError:
         print("Error verifying password")
         return False
     except Exception as e:
         print(f"Error verifying password: {e}")
-        return False
\ No newline at end of file
+        return False
@@ -0,0 +1,92 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict
+import asyncio
+import multiprocessing
+import threading
+import time
+from config import PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_WAITING
+from hashed import hashed
+
+class HashingBusy(Exception):
+    """ハッシュ化の順番を待つリクエストが上限に達している"""
+    pass
+
+class PasswordHashService:
+    """
+    パスワードのハッシュ化・検証を専用のプロセスプールで実行する
+    同時に実行するのはworkers件までで、それ以外はmax_waiting件まで順番を待つ(超えた場合はHashingBusyを送出する)
+    hash()・verify()はイベントループ上でawaitする(順番を待つ間・実行中もスレッドを占有しないため、
+    ログインが集中してもスレッドプールで実行される他のAPIが止まらない)
+    """
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_waiting: int = PASSWORD_HASH_MAX_WAITING):
+        self.workers = workers
+        self.max_waiting = max_waiting
+        self.semaphore = asyncio.Semaphore(workers)
+        #プロセスプールの作成・終了を排他する(shutdown()はイベントループの外から呼び出される場合がある)
+        self.lock = threading.Lock()
+        self.executor: ProcessPoolExecutor | None = None
+        #メトリクス
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_run = 0.0
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        with self.lock:
+            if self.executor is None:
+                #スレッドを持つプロセスからforkしないようspawnでプロセスを作成する
+                self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self.executor
+
+    def shutdown(self):
+        """プロセスプールを終了する(アプリケーションの終了時に呼び出す)"""
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(cancel_futures=True)
+                self.executor = None
+
+    async def run(self, func, *args):
+        if self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise HashingBusy
+        self.waiting += 1
+        queued_at = time.perf_counter()
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        started_at = time.perf_counter()
+        self.running += 1
+        self.total_wait += started_at - queued_at
+        self.max_wait = max(self.max_wait, started_at - queued_at)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.get_executor(), func, *args)
+        finally:
+            self.semaphore.release()
+            self.running -= 1
+            self.completed += 1
+            self.total_run += time.perf_counter() - started_at
+
+    async def hash(self, password: str, salt: str) -> str | None:
+        """パスワードをハッシュ化する(失敗した場合はNone)"""
+        return await self.run(hashed.generate_hash, password, salt)
+
+    async def verify(self, password: str, hash: str) -> bool:
+        """パスワードを検証する"""
+        return await self.run(hashed.verify_pw, password, hash)
+
+    def metrics(self) -> Dict[str, float]:
+        return {
+            "waiting": self.waiting,
+            "running": self.running,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "mean_wait_ms": self.total_wait / self.completed * 1000 if self.completed else 0,
+            "max_wait_ms": self.max_wait * 1000,
+            "mean_run_ms": self.total_run / self.completed * 1000 if self.completed else 0,
+        }
+
+password_hasher = PasswordHashService()
@@ -2,13 +2,54 @@ from fastapi import FastAPI
 from routers import login, register, delete, refresh, websocket, usersinfo, avatar, setinfo
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
+from database.database import async_database
+from database.migrate import apply_migrations
+from websocket.manager import manager
+from websocket.eventbus import create_event_bus
+from websocket.readposition import read_positions
+from websocket.messagewriter import message_writer
+from websocket.notifier import notifier
+from hashed.service import password_hasher
+from config import APPLY_MIGRATIONS_ON_STARTUP
+import asyncio
 import firebase_admin
 from firebase_admin import credentials
 
 cred = credentials.Certificate("./firebase-adminsdk-key.json")
 firebase_admin.initialize_app(cred)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    アプリケーションの起動時及び終了時の処理
+    """
+    if APPLY_MIGRATIONS_ON_STARTUP:
+        await asyncio.to_thread(apply_migrations)
+    #非同期接続プールはイベントループ上で開く必要がある
+    await async_database.open()
+    #他のワーカーとの間でルーム及びユーザー宛てのイベントを配送する
+    await manager.start_event_bus(create_event_bus())
+    #全ての接続のアクセストークンの有効期限を一つのタスクで管理する
+    manager.token_timer.start()
+    #フォーカスによる既読位置の更新をまとめて書き込む
+    read_positions.start()
+    #SendMessageのメッセージをまとめて保存する
+    message_writer.start()
+    #プッシュ通知を専用のスレッドで送信する
+    notifier.start()
+    yield
+    await message_writer.stop()
+    manager.token_timer.stop()
+    #接続プールを閉じる前に残っている既読位置を書き込む
+    await read_positions.stop()
+    await manager.stop_event_bus()
+    #送信待ちの通知を送信してから止める(送信スレッドは同期の接続プールを使用する)
+    await asyncio.to_thread(notifier.stop)
+    await async_database.close()
+    password_hasher.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 @app.exception_handler(RequestValidationError)
 def validation_handler(request, exc):
@@ -0,0 +1,116 @@
+from fastapi import HTTPException, Header
+from datetime import datetime, timedelta
+from typing import Dict
+import threading
+import pytz
+from anyio import from_thread
+from psycopg.rows import dict_row
+from config import AUTH_SESSION_CACHE_SIZE, AUTH_SESSION_CACHE_TTL_SECONDS
+from database.database import database
+from websocket.cache import TTLCache
+from websocket.manager import manager
+
+class AuthSession:
+    """
+    検証済みのアクセストークンに対応するユーザー
+    """
+    def __init__(self, user_id: str, device_id: str, expires_at: datetime):
+        self.user_id = user_id
+        self.device_id = device_id
+        self.expires_at = expires_at
+
+class AuthSessionCache:
+    """
+    アクセストークン -> AuthSessionのキャッシュ
+    HTTPのAPIはスレッドプールで実行されるためロックで排他する
+    ログイン・トークンの再発行・ユーザーの削除で無効になったアクセストークンはinvalidate()で削除し、
+    イベントバスで他のワーカーのキャッシュからも削除する
+    """
+    def __init__(self, max_size: int = AUTH_SESSION_CACHE_SIZE, ttl: float = AUTH_SESSION_CACHE_TTL_SECONDS):
+        self.cache = TTLCache(max_size, ttl)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, access_token: str) -> AuthSession | None:
+        with self.lock:
+            session = self.cache.get(access_token)
+            if session is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return session
+
+    def set(self, access_token: str, session: AuthSession):
+        with self.lock:
+            self.cache.set(access_token, session)
+
+    def invalidate(self, access_token: str, publish: bool = True):
+        """
+        アクセストークンをキャッシュから削除する(スレッドプールから呼び出す)
+        """
+        with self.lock:
+            self.cache.pop(access_token)
+        if publish:
+            try:
+                from_thread.run_sync(manager.publish, {"type":"auth_session","access_token":access_token})
+            except Exception as e:
+                print(f"Error publishing auth session invalidation: {e}")
+
+    def handle_event(self, event: Dict):
+        """他のワーカーで無効になったアクセストークンをキャッシュから削除する"""
+        self.invalidate(event["access_token"], publish=False)
+
+    def metrics(self) -> Dict[str, int]:
+        return {"size": len(self.cache), "hits": self.hits, "misses": self.misses}
+
+session_cache = AuthSessionCache()
+manager.register_event_handler("auth_session", session_cache.handle_event)
+
+def now() -> datetime:
+    return pytz.timezone('Asia/Tokyo').localize(datetime.now())+timedelta(hours=9)
+
+def authenticate(access_token: str, device_id: str | None = None) -> AuthSession:
+    """
+    アクセストークンを確認し、対応するユーザーを返す
+    キャッシュにない場合のみデータベースを参照する
+    device_idを指定した場合はデバイスIDも確認する(同一デバイスであるか)
+    """
+    session = session_cache.get(access_token)
+    if session is None:
+        try:
+            with database.get_connection() as conn:
+                with conn.cursor(row_factory=dict_row) as cursor:
+                    user = database.fetch(cursor,"users", {"access_token": access_token})
+                    token = database.fetch(cursor,"access_tokens", {"access_token": access_token})
+        except Exception as e:
+            print(f"Error fetching user data: {e}")
+            raise HTTPException(status_code=500, detail="Error fetching user data")
+        if user == [] or token == []:
+            raise HTTPException(status_code=401, detail="Invalid auth")
+        session = AuthSession(str(user[0]["id"]), user[0]["device_id"], token[0]["created_at"]+timedelta(hours=token[0]["validity_hours"]))
+        session_cache.set(access_token, session)
+
+    #アクセストークンの有効期限の確認及びデバイスIDの確認
+    if not now() < session.expires_at:
+        session_cache.invalidate(access_token, publish=False)
+        raise HTTPException(status_code=401, detail="Invalid auth")
+    if device_id is not None and not session.device_id == device_id:
+        raise HTTPException(status_code=401, detail="Invalid auth")
+    return session
+
+def get_session(access_token: str = Header(...)) -> AuthSession:
+    """
+    アクセストークンのみを確認する依存関係
+    """
+    if not access_token:
+        raise HTTPException(status_code=400, detail="Invalid headers")
+    return authenticate(access_token)
+
+def get_device_session(access_token: str = Header(...), device_id: str = Header(...)) -> AuthSession:
+    """
+    アクセストークン及びデバイスIDを確認する依存関係
+    """
+    if not access_token or not device_id:
+        raise HTTPException(status_code=400, detail="Invalid headers")
+    return authenticate(access_token, device_id)
@@ -1,12 +1,13 @@
 from fastapi import APIRouter, HTTPException, Request, Response, UploadFile, Header, Depends
 from database.database import database
+from routers.authsession import AuthSession, get_device_session
 import os
 from datetime import datetime, timedelta
 import pytz
 import glob
 from psycopg.rows import dict_row
 from websocket.manager import manager
-import asyncio
+from anyio import from_thread
 
 router = APIRouter()
 
@@ -47,36 +48,32 @@ def get_user_headers(
     return {"device_id": device_id, "access_token": access_token}
 
 @router.post("/avatars/users/{userid}", status_code=201)
-def post_useravatar(file: UploadFile, userid:str, headers:dict = Depends(get_user_headers)):
-    async def send_message_to_ws(ws, id, name, avatar_path, is_frinend):
+def post_useravatar(file: UploadFile, userid:str, headers:dict = Depends(get_user_headers), session:AuthSession = Depends(get_device_session)):
+    async def send_message_to_user(user_id, id, name, avatar_path, is_frinend):
         """
         非同期的に更新されたユーザー情報を送信
         """
-        print("send_message_to_ws")
-        await manager.send_personal_message({
+        print("send_message_to_user")
+        manager.send_to_user({
             "type":"UpdateUser",
             "content":{
                 "id":id,
                 "name":name,
                 "avatar_path":f"/avatars/users{avatar_path}",
                 "is_friend":is_frinend}},
-            ws)
+            user_id)
 
+    #アクセストークンの有効期限の確認及びデバイスIDの確認(get_device_sessionで確認済み)
+    if not session.user_id == userid:
+        raise HTTPException(status_code=401, detail="Invalid auth")
     #アップロードされたファイルの保存
     try:
         with database.get_connection() as conn:
             with conn.cursor(row_factory=dict_row) as cursor:
                 user = database.fetch(cursor, "users", {"id":userid})
-                token = database.fetch(cursor,"access_tokens", {"access_token": headers['access_token']})
                 if user == []:
                     raise HTTPException(status_code=404, detail="User not found")
                 
-                #パスワードの確認及びアクセストークンの有効期限の確認及びデバイスIDの確認(同一デバイスであるか)
-                if (not user[0]["access_token"] == headers['access_token'] or 
-                    not pytz.timezone('Asia/Tokyo').localize(datetime.now())+timedelta(hours=9) < token[0]["created_at"]+timedelta(hours=token[0]["validity_hours"]) or 
-                    not user[0]["device_id"] == headers['device_id']):
-                    raise HTTPException(status_code=401, detail="Invalid auth")
-                
                 os.makedirs(f"./avatars/users/{userid}", exist_ok=True)
                 #既存のアバター画像を削除
                 for p in glob.glob(f"./avatars/users/{userid}/avatar-*.png", recursive=True):
@@ -101,14 +98,12 @@ def post_useravatar(file: UploadFile, userid:str, headers:dict = Depends(get_use
                 for room in rooms:
                     if not str(room["id"]) in rooms_id:
                         rooms_id.append(str(room["id"]))
-                room_participants = database.in_fetch(cursor, "room_participants", "id", rooms_id)
+                room_participants = database.bulk_fetch(cursor, "room_participants", "id", rooms_id, ["user_id"], {"id": "uuid"})
                 for room_participant in room_participants:
                     if not str(room_participant["user_id"]) in [id[0] for id in users_id] and not str(room_participant["user_id"]) == userid:
                         users_id.append((str(room_participant["user_id"]),False))
                 for participant in users_id:
-                    if participant[0] in manager.active_connections:
-                        friend_ws = manager.active_connections[participant[0]]
-                        asyncio.run(send_message_to_ws(friend_ws, userid, user[0]["name"], path, participant[1]))
+                    from_thread.run(send_message_to_user, participant[0], userid, user[0]["name"], path, participant[1])
                 conn.commit()
                 return {"detail": "avatar uploaded"}
     except Exception as e:
@@ -128,39 +123,32 @@ def get_room_headers(
     return {"device_id": device_id, "access_token": access_token, "user_id": user_id}
 
 @router.post("/avatars/rooms/{roomid}", status_code=201)
-def post_roomavatar(file: UploadFile, roomid:str, headers:dict = Depends(get_room_headers)):
-    async def send_message_to_ws(ws, id, name, avatar_path, joined_at):
+def post_roomavatar(file: UploadFile, roomid:str, headers:dict = Depends(get_room_headers), session:AuthSession = Depends(get_device_session)):
+    async def send_message_to_user(user_id, id, name, avatar_path, joined_at):
         """
         非同期的に更新されたルーム情報を送信
         """
-        await manager.send_personal_message({
+        manager.send_to_user({
             "type":"UpdateRoom",
             "content":{
                 "id":id,
                 "name":name,
                 "avatar_path":f"/avatars/rooms{avatar_path}",
                 "joined_at":joined_at}},
-            ws)
+            user_id)
 
+    #アクセストークンの有効期限の確認及びデバイスIDの確認(get_device_sessionで確認済み)
+    if not session.user_id == headers["user_id"]:
+        raise HTTPException(status_code=401, detail="Invalid auth")
     #アップロードされたファイルの保存
     try:
         with database.get_connection() as conn:
             with conn.cursor(row_factory=dict_row) as cursor:
-                user = database.fetch(cursor, "users", {"id":headers["user_id"]})
-                token = database.fetch(cursor,"access_tokens", {"access_token": headers['access_token']})
                 room_participants = database.fetch(cursor, "room_participants", {"id":roomid})
                 room_info = database.fetch(cursor, "rooms", {"id":roomid})
-                if user == []:
-                    raise HTTPException(status_code=404, detail="User not found")
                 if room_info == []:
                     raise HTTPException(status_code=404, detail="Room not found")
                 
-                #パスワードの確認及びアクセストークンの有効期限の確認及びデバイスIDの確認(同一デバイスであるか)
-                if (not user[0]["access_token"] == headers['access_token'] or 
-                    not pytz.timezone('Asia/Tokyo').localize(datetime.now())+timedelta(hours=9) < token[0]["created_at"]+timedelta(hours=token[0]["validity_hours"]) or 
-                    not user[0]["device_id"] == headers['device_id']):
-                    raise HTTPException(status_code=401, detail="Invalid auth")
-                
                 os.makedirs(f"./avatars/rooms/{roomid}", exist_ok=True)
                 #既存のアバター画像を削除
                 for p in glob.glob(f"./avatars/rooms/{roomid}/avatar-*.png", recursive=True):
@@ -181,9 +169,7 @@ def post_roomavatar(file: UploadFile, roomid:str, headers:dict = Depends(get_roo
                     if not str(participant["user_id"]) == headers["user_id"]:
                         participants.append({"id":str(participant["user_id"]),"joined_at":str(participant["joined_at"])})
                 for participant in participants:
-                    if participant["id"] in manager.active_connections:
-                        friend_ws = manager.active_connections[participant["id"]]
-                        asyncio.run(send_message_to_ws(friend_ws, roomid, room_info[0]["name"],path,participant["joined_at"]))
+                    from_thread.run(send_message_to_user, participant["id"], roomid, room_info[0]["name"],path,participant["joined_at"])
                 return {"detail": "avatar uploaded"}
     except Exception as e:
         print(f"Error saving avatar: {e}")
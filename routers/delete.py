@@ -1,11 +1,13 @@
 from fastapi import APIRouter, HTTPException, Request, Depends, Header
 from pydantic import BaseModel
-from database.database import database
-from hashed import hashed
+from database.database import database, async_database
+from routers.authsession import AuthSession, get_device_session, session_cache
+from hashed.service import password_hasher, HashingBusy
 from datetime import datetime, timedelta
 import pytz
 from psycopg.rows import dict_row
 import psycopg
+from anyio import to_thread
 import os
 import shutil
 
@@ -13,24 +15,22 @@ router = APIRouter()
 
 def delete_user(user_id:str, user:dict) -> bool:
     try:
-        with database.get_connection() as conn:
-            with conn.cursor(row_factory=dict_row) as cursor:
-                cursor.execute("BEGIN")
-                if (database.delete(cursor,"users", {"id":user_id}) and
-                    database.delete(cursor,"access_tokens", {"access_token":user[0]['access_token']}) and
-                    database.delete(cursor,"refresh_tokens", {"refresh_token":user[0]['refresh_token']})
-                ):
-                    if os.path.isdir(f"../avatars/users/{user_id}"):
-                        shutil.rmtree(f"../avatars/users/{user_id}")
-                    conn.commit()
-                    return True
-                else:
-                    raise Exception
+        with database.unit_of_work() as uow:
+            cursor = uow.cursor
+            if (database.delete(cursor,"users", {"id":user_id}) and
+                database.delete(cursor,"access_tokens", {"access_token":user[0]['access_token']}) and
+                database.delete(cursor,"refresh_tokens", {"refresh_token":user[0]['refresh_token']})
+            ):
+                if os.path.isdir(f"../avatars/users/{user_id}"):
+                    shutil.rmtree(f"../avatars/users/{user_id}")
+                #削除したユーザーのアクセストークンはコミット後にキャッシュから削除する
+                uow.after_commit(session_cache.invalidate, user[0]["access_token"])
+                return True
+            else:
+                raise Exception
     except Exception as e:
         print(f"Error deleting user: {e}")
-        if conn:
-            conn.rollback()
-            print("transaction rollback")
+        print("transaction rollback")
         return False
 
 def get_headers(
@@ -42,15 +42,17 @@ def get_headers(
         raise HTTPException(status_code=400, detail="Invalid headers")
     return {"password": password, "device_id": device_id, "access_token": access_token}
 
+#パスワードの検証をイベントループ上で待つため非同期で定義する(ユーザー情報の削除はスレッドプールで実行する)
 @router.delete("/users/{user_id}", status_code=204)
-def users_delete(request:Request,user_id:str, headers:dict = Depends(get_headers)):
+async def users_delete(request:Request,user_id:str, headers:dict = Depends(get_headers), session:AuthSession = Depends(get_device_session)):
+    #アクセストークンの有効期限の確認及びデバイスIDの確認(get_device_sessionで確認済み)
+    if not session.user_id == user_id:
+        raise HTTPException(status_code=401, detail="Invalid auth")
     user = []
-    token = []
     try:
-        with database.get_connection() as conn:
-            with conn.cursor(row_factory=dict_row) as cursor:
-                user = database.fetch(cursor,"users", {"id": user_id})
-                token = database.fetch(cursor,"access_tokens", {"access_token": headers['access_token']})
+        async with async_database.get_connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cursor:
+                user = await async_database.fetch(cursor,"users", {"id": user_id})
     except psycopg.errors.InvalidTextRepresentation as e:
         print(f"Error fetching user data: {e}")
         raise HTTPException(status_code=400, detail="Invalid user_id type")
@@ -61,17 +63,17 @@ def users_delete(request:Request,user_id:str, headers:dict = Depends(get_headers
     if user == []:
         raise HTTPException(status_code=401, detail="User not found")
         
-    #パスワードの確認及びアクセストークンの有効期限の確認及びデバイスIDの確認(同一デバイスであるか)
-    if (not user[0]["access_token"] == headers['access_token'] or 
-        not pytz.timezone('Asia/Tokyo').localize(datetime.now())+timedelta(hours=9) < token[0]["created_at"]+timedelta(hours=token[0]["validity_hours"]) or 
-        not hashed.verify_pw(headers['password'], user[0]["hash_password"], user[0]["salt"]) or
-        not user[0]["device_id"] == headers['device_id']
-        ):
+    #パスワードの確認
+    try:
+        is_valid_password = await password_hasher.verify(headers['password'], user[0]["hash_password"])
+    except HashingBusy:
+        raise HTTPException(status_code=503, detail="Server busy")
+    if not is_valid_password:
         raise HTTPException(status_code=401, detail="Invalid auth")
     
     #ユーザー情報の削除
     try:
-        if delete_user(user_id, user):
+        if await to_thread.run_sync(delete_user, user_id, user):
             return
         else:
             raise Exception
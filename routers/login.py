@@ -1,14 +1,16 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import List
-from database.database import database
-from hashed import hashed
+from database.database import database, async_database
+from routers.authsession import session_cache
+from hashed.service import password_hasher, HashingBusy
 import secrets
 import string
 from datetime import datetime, timedelta
 import pytz
 from config import VALIDITY_HOURS
 from psycopg.rows import dict_row
+from anyio import to_thread
 
 router = APIRouter()
 
@@ -20,56 +22,59 @@ class LoginRequest(BaseModel):
 
 def generate_tokens(user: LoginRequest, userdata, new_tokens):
     try:
-        with database.get_connection() as conn:
-            with conn.cursor(row_factory=dict_row) as cursor:
-                cursor.execute("BEGIN")
-                if database.update(
-                    cursor,
-                    "users",
-                    {"device_id":user.deviceid,"access_token":new_tokens["access_token"],"refresh_token":new_tokens["refresh_token"],"fcm_token":user.fcmtoken},
-                    {"email":user.email}
-                ) and database.update(
-                    cursor,
-                    "access_tokens",
-                    {"access_token":new_tokens["access_token"], "validity_hours":VALIDITY_HOURS["access_token"], "created_at":datetime.now(pytz.timezone('Asia/Tokyo'))},
-                    {"access_token":userdata[0]["access_token"]}
-                ) and database.update(
-                    cursor,
-                    "refresh_tokens",
-                    {"refresh_token":new_tokens["refresh_token"], "validity_hours":VALIDITY_HOURS["refresh_token"], "created_at":datetime.now(pytz.timezone('Asia/Tokyo'))},
-                    {"refresh_token":userdata[0]["refresh_token"]}
-                ):
-                    conn.commit()
-                    return True
-                else:
-                    raise Exception
+        with database.unit_of_work() as uow:
+            cursor = uow.cursor
+            if database.update(
+                cursor,
+                "users",
+                {"device_id":user.deviceid,"access_token":new_tokens["access_token"],"refresh_token":new_tokens["refresh_token"],"fcm_token":user.fcmtoken},
+                {"email":user.email}
+            ) and database.update(
+                cursor,
+                "access_tokens",
+                {"access_token":new_tokens["access_token"], "validity_hours":VALIDITY_HOURS["access_token"], "created_at":datetime.now(pytz.timezone('Asia/Tokyo'))},
+                {"access_token":userdata[0]["access_token"]}
+            ) and database.update(
+                cursor,
+                "refresh_tokens",
+                {"refresh_token":new_tokens["refresh_token"], "validity_hours":VALIDITY_HOURS["refresh_token"], "created_at":datetime.now(pytz.timezone('Asia/Tokyo'))},
+                {"refresh_token":userdata[0]["refresh_token"]}
+            ):
+                #無効になったアクセストークン(以前のデバイスのもの)はコミット後にキャッシュから削除する
+                uow.after_commit(session_cache.invalidate, userdata[0]["access_token"])
+                return True
+            else:
+                raise Exception
     except Exception as e:
         print(f"Error update tokens: {e}")
-        if conn:
-            conn.rollback()
-            print("transaction rollback")
+        print("transaction rollback")
         return False
 
+#パスワードの検証をイベントループ上で待つため非同期で定義する(トークンの更新はスレッドプールで実行する)
 @router.post("/auth/login", status_code=200)
-def users_login(user:LoginRequest):
+async def users_login(user:LoginRequest):
     userdata = []
     try:
-        with database.get_connection() as conn:
-            with conn.cursor(row_factory=dict_row) as cursor:
-                userdata = database.fetch(cursor,"users", {"email": user.email})
+        async with async_database.get_connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cursor:
+                userdata = await async_database.fetch(cursor,"users", {"email": user.email})
     except Exception as e:
         print(f"Error fetching user data: {e}")
         raise HTTPException(status_code=500, detail="Error fetching user data")
     
     if userdata == []:#ユーザーが存在しない場合
         raise HTTPException(status_code=401, detail="User not found")
-    if hashed.verify_pw(user.password, userdata[0]["hash_password"], userdata[0]["salt"]):#ユーザーが存在する場合
+    try:
+        is_valid_password = await password_hasher.verify(user.password, userdata[0]["hash_password"])
+    except HashingBusy:
+        raise HTTPException(status_code=503, detail="Server busy")
+    if is_valid_password:#ユーザーが存在する場合
         try:
             new_tokens = {
                 "access_token": ''.join(secrets.choice(string.ascii_letters + string.digits) for i in range(32)),
                 "refresh_token": ''.join(secrets.choice(string.ascii_letters + string.digits) for i in range(64))
             }
-            if generate_tokens(user, userdata, new_tokens):
+            if await to_thread.run_sync(generate_tokens, user, userdata, new_tokens):
                 token_created = pytz.timezone('Asia/Tokyo').localize(datetime.now())+timedelta(hours=9)
                 return {
                     "detail": "Login successful",
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, HTTPException, Request, Header, Depends
 from database.database import database
+from routers.authsession import session_cache
 from datetime import datetime, timedelta
 import pytz
 import string
@@ -12,22 +13,20 @@ router = APIRouter()
 
 def generate_tokens(user: dict, new_access_token: dict, headers: dict):
     try:
-        with database.get_connection() as conn:
-            with conn.cursor(row_factory=dict_row) as cursor:
-                cursor.execute("BEGIN")
-                if (database.delete(cursor,"access_tokens", {"access_token":user[0]["access_token"]}) and
-                    database.update(cursor,"users", {"access_token":new_access_token}, {"refresh_token":headers['refresh_token']}) and
-                    database.insert(cursor,"access_tokens", {"access_token":new_access_token, "validity_hours":VALIDITY_HOURS["access_token"]})
-                ):
-                    conn.commit()
-                    return True
-                else:
-                    raise Exception
+        with database.unit_of_work() as uow:
+            cursor = uow.cursor
+            if (database.delete(cursor,"access_tokens", {"access_token":user[0]["access_token"]}) and
+                database.update(cursor,"users", {"access_token":new_access_token}, {"refresh_token":headers['refresh_token']}) and
+                database.insert(cursor,"access_tokens", {"access_token":new_access_token, "validity_hours":VALIDITY_HOURS["access_token"]})
+            ):
+                #無効になったアクセストークンはコミット後にキャッシュから削除する
+                uow.after_commit(session_cache.invalidate, user[0]["access_token"])
+                return True
+            else:
+                raise Exception
     except Exception as e:
         print(f"Error update tokens: {e}")
-        if conn:
-            conn.rollback()
-            print("transaction rollback")
+        print("transaction rollback")
         return False
 
 def get_headers(
@@ -1,7 +1,7 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel, Field, EmailStr, AfterValidator, ValidationInfo
 from typing import List
-from database.database import database
+from database.database import database, async_database
 import asyncio
 from datetime import datetime, timedelta
 import pytz
@@ -10,10 +10,11 @@ from config import VALIDITY_HOURS
 import re
 from uuid import uuid4
 from psycopg.rows import dict_row
+from anyio import to_thread
 
 import string
 import secrets
-from hashed import hashed
+from hashed.service import password_hasher, HashingBusy
 
 router = APIRouter()
 
@@ -92,21 +93,25 @@ def register_user(body:RegisterRequest, password:dict, tokens:dict, id:string) -
             print("transaction rollback")
         return False
 
+#パスワードのハッシュ化をイベントループ上で待つため非同期で定義する(ユーザーの登録はスレッドプールで実行する)
 @router.post("/users", status_code=201)
-def users_register(body:RegisterRequest):
-    with database.get_connection() as conn:
-        with conn.cursor(row_factory=dict_row) as cursor:
-            if not database.fetch(cursor,"users", {"email":body.email}) == []:
+async def users_register(body:RegisterRequest):
+    async with async_database.get_connection() as conn:
+        async with conn.cursor(row_factory=dict_row) as cursor:
+            if not await async_database.fetch(cursor,"users", {"email":body.email}) == []:
                 raise HTTPException(status_code=409, detail="Email already registered")
 
     password = { "salt":secrets.token_hex(128) }
-    password["hash"] = hashed.generate_hash(body.password, password["salt"])
+    try:
+        password["hash"] = await password_hasher.hash(body.password, password["salt"])
+    except HashingBusy:
+        raise HTTPException(status_code=503, detail="Server busy")
     tokens = {
         "access_token": ''.join(secrets.choice(string.ascii_letters + string.digits) for i in range(32)),
         "refresh_token": ''.join(secrets.choice(string.ascii_letters + string.digits) for i in range(64))
     }
     id = str(uuid4())
-    if not password["hash"] == None and register_user(body, password, tokens, id):
+    if not password["hash"] == None and await to_thread.run_sync(register_user, body, password, tokens, id):
         token_created = pytz.timezone('Asia/Tokyo').localize(datetime.now())+timedelta(hours=9)
         return {
             "detail": "User registered",
@@ -1,10 +1,11 @@
 from fastapi import APIRouter, HTTPException, Header, Depends
 from database.database import database
+from routers.authsession import AuthSession, get_device_session
 from datetime import datetime, timedelta
 import pytz
 from psycopg.rows import dict_row
 from websocket.manager import manager
-import asyncio
+from anyio import from_thread
 from pydantic import BaseModel
 
 router = APIRouter()
@@ -21,38 +22,34 @@ def get_user_headers(
     return {"device_id": device_id, "access_token": access_token}
 
 @router.post("/users/{userid}", status_code=201)
-def set_userinfo(body:Request, userid:str, headers:dict = Depends(get_user_headers)):
+def set_userinfo(body:Request, userid:str, headers:dict = Depends(get_user_headers), session:AuthSession = Depends(get_device_session)):
     """
     アバター以外のユーザー情報を更新するAPI
     """
-    async def send_message_to_ws(ws, id, name, avatar_path, is_frinend):
+    async def send_message_to_user(user_id, id, name, avatar_path, is_frinend):
         """
         非同期的に更新されたユーザー情報を送信
         """
-        print("send_message_to_ws")
-        await manager.send_personal_message({
+        print("send_message_to_user")
+        manager.send_to_user({
             "type":"UpdateUser",
             "content":{
                 "id":id,
                 "name":name,
                 "avatar_path":f"/avatars/users{avatar_path}",
                 "is_friend":is_frinend}},
-            ws)
+            user_id)
 
+    #アクセストークンの有効期限の確認及びデバイスIDの確認(get_device_sessionで確認済み)
+    if not session.user_id == userid:
+        raise HTTPException(status_code=401, detail="Invalid auth")
     try:
         with database.get_connection() as conn:
             with conn.cursor(row_factory=dict_row) as cursor:
                 user = database.fetch(cursor, "users", {"id":userid})
-                token = database.fetch(cursor,"access_tokens", {"access_token": headers['access_token']})
                 if user == []:
                     raise HTTPException(status_code=404, detail="User not found")
                 
-                #パスワードの確認及びアクセストークンの有効期限の確認及びデバイスIDの確認(同一デバイスであるか)
-                if (not user[0]["access_token"] == headers['access_token'] or 
-                    not pytz.timezone('Asia/Tokyo').localize(datetime.now())+timedelta(hours=9) < token[0]["created_at"]+timedelta(hours=token[0]["validity_hours"]) or 
-                    not user[0]["device_id"] == headers['device_id']):
-                    raise HTTPException(status_code=401, detail="Invalid auth")
-                
                 cursor.execute("BEGIN")
                 if not database.update(cursor, "users", {"name":body.name, "updated_at":pytz.timezone('Asia/Tokyo').localize(datetime.now())+timedelta(hours=9)}, {"id":userid}):
                     raise Exception
@@ -68,14 +65,12 @@ def set_userinfo(body:Request, userid:str, headers:dict = Depends(get_user_heade
                 for room in rooms:
                     if not str(room["id"]) in rooms_id:
                         rooms_id.append(str(room["id"]))
-                room_participants = database.in_fetch(cursor, "room_participants", "id", rooms_id)
+                room_participants = database.bulk_fetch(cursor, "room_participants", "id", rooms_id, ["user_id"], {"id": "uuid"})
                 for room_participant in room_participants:
                     if not str(room_participant["user_id"]) in [id[0] for id in users_id] and not str(room_participant["user_id"]) == userid:
                         users_id.append((str(room_participant["user_id"]),False))
                 for participant in users_id:
-                    if participant[0] in manager.active_connections:
-                        friend_ws = manager.active_connections[participant[0]]
-                        asyncio.run(send_message_to_ws(friend_ws, userid, body.name, user[0]["avatar_path"], participant[1]))
+                    from_thread.run(send_message_to_user, participant[0], userid, body.name, user[0]["avatar_path"], participant[1])
                 conn.commit()
                 return {"detail": "infomation updated"}
     except Exception as e:
@@ -95,40 +90,34 @@ def get_room_headers(
     return {"device_id": device_id, "access_token": access_token, "userid": userid}
 
 @router.post("/rooms/{roomid}", status_code=201)
-def set_roominfo(body:Request, roomid:str, headers:dict = Depends(get_room_headers)):
+def set_roominfo(body:Request, roomid:str, headers:dict = Depends(get_room_headers), session:AuthSession = Depends(get_device_session)):
     """
     アバター以外のルーム情報を更新するAPI
     """
-    async def send_message_to_ws(ws, id, name, avatar_path, joined_at):
+    async def send_message_to_user(user_id, id, name, avatar_path, joined_at):
         """
         非同期的に更新されたルーム情報を送信
         """
-        await manager.send_personal_message({
+        manager.send_to_user({
             "type":"UpdateRoom",
             "content":{
                 "id":id,
                 "name":name,
                 "avatar_path":f"/avatars/rooms{avatar_path}",
                 "joined_at":joined_at}},
-            ws)
+            user_id)
 
+    #アクセストークンの有効期限の確認及びデバイスIDの確認(get_device_sessionで確認済み)
+    if not session.user_id == headers["userid"]:
+        raise HTTPException(status_code=401, detail="Invalid auth")
     try:
         with database.get_connection() as conn:
             with conn.cursor(row_factory=dict_row) as cursor:
-                user = database.fetch(cursor, "users", {"id":headers["userid"]})
-                token = database.fetch(cursor,"access_tokens", {"access_token": headers['access_token']})
                 room_participants = database.fetch(cursor, "room_participants", {"id":roomid})
                 room_info = database.fetch(cursor, "rooms", {"id":roomid})
-                if user == []:
-                    raise HTTPException(status_code=404, detail="User not found")
                 if room_participants == [] or room_info == []:
                     raise HTTPException(status_code=404, detail="Room not found")
                 
-                #パスワードの確認及びアクセストークンの有効期限の確認及びデバイスIDの確認(同一デバイスであるか)
-                if (not user[0]["access_token"] == headers['access_token'] or 
-                    not pytz.timezone('Asia/Tokyo').localize(datetime.now())+timedelta(hours=9) < token[0]["created_at"]+timedelta(hours=token[0]["validity_hours"]) or 
-                    not user[0]["device_id"] == headers['device_id']):
-                    raise HTTPException(status_code=401, detail="Invalid auth")
                 #ルーム情報の更新
                 cursor.execute("BEGIN")
                 if not database.update(cursor, "rooms", {"name":body.name, "updated_at":pytz.timezone('Asia/Tokyo').localize(datetime.now())+timedelta(hours=9)}, {"id":roomid}):
@@ -140,9 +129,7 @@ def set_roominfo(body:Request, roomid:str, headers:dict = Depends(get_room_heade
                     if not str(participant["user_id"]) == headers["userid"]:
                         participants.append({"id":str(participant["user_id"]),"joined_at":str(participant["joined_at"])})
                 for participant in participants:
-                    if participant["id"] in manager.active_connections:
-                        friend_ws = manager.active_connections[participant["id"]]
-                        asyncio.run(send_message_to_ws(friend_ws, roomid, body.name,room_info[0]["avatar_path"],participant["joined_at"]))
+                    from_thread.run(send_message_to_user, participant["id"], roomid, body.name,room_info[0]["avatar_path"],participant["joined_at"])
                 
                 conn.commit()
                 return {"detail": "infomation updated"}
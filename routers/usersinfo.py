@@ -2,6 +2,7 @@ from fastapi import APIRouter, HTTPException, Request, Header, Depends
 from pydantic import BaseModel, Field, EmailStr, AfterValidator, ValidationInfo
 from typing import List
 from database.database import database
+from routers.authsession import AuthSession, get_session
 import asyncio
 from datetime import datetime, timedelta
 import pytz
@@ -25,29 +26,9 @@ def get_headers(
     return {"access_token": access_token, "user_id": user_id, "participants_id": participants_id}
 
 @router.get("/users", status_code=200)
-def userdinfo(request:Request, headers:dict = Depends(get_headers)):
-    user = []
-    token = []
-    try:
-        with database.get_connection() as conn:
-            with conn.cursor(row_factory=dict_row) as cursor:
-                user = database.fetch(cursor,"users", {"id": headers['user_id']})
-                token = database.fetch(cursor,"access_tokens", {"access_token": headers['access_token']})
-    except psycopg.errors.InvalidTextRepresentation as e:
-        print(f"Error fetching user data: {e}")
-        raise HTTPException(status_code=400, detail="Invalid user_id type")
-    except Exception as e:
-        print(f"Error fetching user data: {e}")
-        raise HTTPException(status_code=500, detail="Error fetching user data")
-    
-    if user == []:
-        raise HTTPException(status_code=401, detail="User not found")
-
-    print(pytz.timezone('Asia/Tokyo').localize(datetime.now())+timedelta(hours=9))
-
-    #アクセストークンの確認及び有効期限の確認
-    if (not user[0]["access_token"] == headers['access_token'] or 
-        not pytz.timezone('Asia/Tokyo').localize(datetime.now())+timedelta(hours=9) < token[0]["created_at"]+timedelta(hours=token[0]["validity_hours"])):
+def userdinfo(request:Request, headers:dict = Depends(get_headers), session:AuthSession = Depends(get_session)):
+    #アクセストークンの確認及び有効期限の確認(get_sessionで確認済み、キャッシュにある場合はデータベースを参照しない)
+    if not session.user_id == headers['user_id']:
         raise HTTPException(status_code=401, detail="Invalid auth")
     try:
         with database.get_connection() as conn:
@@ -2,93 +2,51 @@ from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from typing import Dict
 import asyncio
 import json
-from config import VALIDITY_HOURS
-from datetime import datetime, timedelta
-import pytz
+from websocket.codec import negotiate_format
 from websocket.manager import manager
 from websocket.getlatestmsg import get_latest_message
 from websocket.usercheck import check_user_id, check_access_token
-from websocket.reauth import ReAuth
-from websocket.sendmessage import SendMessage
-from websocket.room import JoinRoom, CreateRoom, LeaveRoom
-from websocket.friend import Friend,UnFriend,GetFriendList
-from websocket.focus import Focus, UnFocus
-from websocket.getroomsinfo import GetRoomsInfo
-from websocket.searchuser import SearchUsers
+from websocket.dispatcher import parse_request, reply_validation_error, get_handler
+from websocket.admission import admission_controller
+from pydantic import ValidationError
 
 router = APIRouter()
 
-async def check_token_exprire(ws: WebSocket, user_id: str):
+async def receive_frame(ws: WebSocket) -> str | bytes:
     """
-    アクセストークンの有効期限を確認し、有効期限が切れた場合に切断する
+    テキストフレームまたはバイナリフレームを受信する(テキストフレームはstr、バイナリフレームはbytesを返す)
     """
-    while True:
-        #print(f"Token check: {user_id}", manager.latest_token_valid[user_id],"{}h".format(VALIDITY_HOURS["access_token"]))
-        await asyncio.sleep(VALIDITY_HOURS["access_token"]*3600-600)
-        await manager.send_personal_message({"type":"AuthInfo","content":{"message":"Your access token has expired after 10 minutes. Please refresh access token."}},ws)
-        await asyncio.sleep(600)
-        if pytz.timezone('Asia/Tokyo').localize(datetime.now())+timedelta(hours=9) > manager.latest_token_valid[user_id] + timedelta(hours=VALIDITY_HOURS["access_token"]):
-            #print(f"Token expired: {user_id}")
-            raise WebSocketDisconnect
+    message = await ws.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+    if message.get("text") is not None:
+        return message["text"]
+    return message["bytes"]
 
 async def recv_msg(ws: WebSocket, user_id: str, tg: asyncio.TaskGroup):
     """
-    メッセージの受信及び形式の確認等を行う
+    メッセージを受信し、形式を検証してメッセージの種類に対応するハンドラに渡す
+    同時に実行するハンドラの数と種類ごとの頻度が上限を超える場合は実行せずに再試行を求める
     """
-    def msg_key_check(data: Dict):
-        if (not "id" in data.keys() or
-            not "type" in data.keys() or
-            not "content" in data.keys()):
-            raise KeyError
-
+    admission = admission_controller.connection()
     while True:
         try:
             #print(f"waitng for message from {user_id}")
-            raw_data = await ws.receive_text()
-            data = json.loads(raw_data)
-            msg_key_check(data)
-            if data["type"] == "ReAuth":
-                tg.create_task(ReAuth(ws, user_id, data))
-            elif data["type"] == "SendMessage":
-                tg.create_task(SendMessage(ws, user_id, data))
-            elif data["type"] == "CreateRoom":
-                tg.create_task(CreateRoom(ws, user_id, data))
-            elif data["type"] == "JoinRoom":
-                tg.create_task(JoinRoom(ws, user_id, data))
-            elif data["type"] == "LeaveRoom":
-                tg.create_task(LeaveRoom(ws, user_id, data))
-            elif data["type"] == "Friend":
-                tg.create_task(Friend(ws, user_id, data))
-            elif data["type"] == "UnFriend":
-                tg.create_task(UnFriend(ws, user_id, data))
-            elif data["type"] == "Focus":
-                tg.create_task(Focus(ws, user_id, data))
-            elif data["type"] == "UnFocus":
-                tg.create_task(UnFocus(ws, user_id, data))
-            elif data["type"] == "GetRoomsInfo":
-                tg.create_task(GetRoomsInfo(ws, user_id, data))
-            elif data["type"] == "SearchUsers":
-                tg.create_task(SearchUsers(ws, user_id,data))
-            elif data["type"] == "GetFriendList":
-                tg.create_task(GetFriendList(ws, user_id, data))
-            else:
-                await manager.send_personal_message({"id":data["id"],"type":f"reply-{data['type']}","content":{"message":"Invalid message type"}}, ws)
+            raw_data = await receive_frame(ws)
+            try:
+                request = parse_request(raw_data)
+            except ValidationError as e:
+                await reply_validation_error(ws, raw_data, e)
+                continue
+            rejection = admission.admit(request.type)
+            if rejection is not None:
+                reason, retry_after_ms = rejection
+                await manager.send_personal_message({"id":request.id,"type":f"reply-{request.type}","content":{"message":"Busy, retry later","reason":reason,"retry_after_ms":retry_after_ms}}, ws, ephemeral=True)
+                continue
+            task = tg.create_task(get_handler(request)(ws, user_id, request))
+            task.add_done_callback(admission.release)
         except WebSocketDisconnect:
             raise WebSocketDisconnect
-        except json.JSONDecodeError:
-            #key-errorに対するエラーハンドリング
-            try:
-                await manager.send_personal_message({"type":f"reply-{data['type']}","content":{"message":"Invalid message format"}}, ws)
-            except Exception as e:
-                await manager.send_personal_message({"type":"Error","content":{"message":"Invalid message format"}},ws)
-            pass
-        except KeyError:
-            #key-errorに対するエラーハンドリング
-            try:
-                await manager.send_personal_message({"type":f"reply-{data['type']}","content":{"message":"Invalid json key"}}, ws)
-            except Exception as e:
-                await manager.send_personal_message({"type":"Error","content":{"message":"Invalid json key"}},ws)
-            pass
         except Exception as e:
             print(f"Error: {e}",type(e))
             raise e
@@ -112,12 +70,25 @@ async def websocket_endpoint(ws: WebSocket, user_id: str):
         return
 
     #認証成功
-    await manager.verified_connect(ws, user_id)
-    await manager.send_personal_message({"type":"reply-init","content":{"status":"200","message":"Connection established"}},ws)
+    #content.formatで送受信の形式を選択できる("json"(既定)または"msgpack"、使用できない形式の場合はjson)
+    format = negotiate_format(data["content"].get("format"))
+    await manager.verified_connect(ws, user_id, format)
+    try:
+        await manager.load_user_rooms(user_id)
+    except Exception as e:
+        print(f"Error loading rooms: {e}")
+        await manager.disconnect(ws, user_id)
+        return
+    #content.resume_fromとcontent.epochを指定した場合は、前回の接続で受信したseqより後のイベントのみを再送する
+    #再送できない場合(epochが異なる・バッファから破棄済みなど)は未読メッセージを全て送信する
+    resumed, epoch, seq = manager.check_resume(user_id, data["content"].get("resume_from"), data["content"].get("epoch"))
+    #reply-initの後に再送するイベントが続くよう、間で中断せずに送信キューに追加する(送信キューへの追加はawaitで中断しない)
+    await manager.send_personal_message({"type":"reply-init","content":{"status":"200","message":"Connection established","format":format,"resumed":resumed,"epoch":epoch,"seq":seq}},ws)
+    manager.replay(ws, user_id, data["content"].get("resume_from") if resumed else None)
     try:
         async with asyncio.TaskGroup() as tg:
-            GetLatestMessage = tg.create_task(get_latest_message(ws, user_id))
-            CheckToken = tg.create_task(check_token_exprire(ws, user_id))
+            if not resumed:
+                GetLatestMessage = tg.create_task(get_latest_message(ws, user_id))
             Recv = tg.create_task(recv_msg(ws, user_id, tg))
     except* WebSocketDisconnect:
         await manager.disconnect(ws, user_id)
@@ -0,0 +1,31 @@
+"""
+テストで使用するwebsocketの代わり
+"""
+import asyncio
+
+class FakeWebSocket:
+    """
+    送信したフレームを記録する
+    blockedをTrueにすると送信を止める(送信の遅いクライアントの代わり)
+    """
+    def __init__(self, blocked: bool = False):
+        self.sent = []
+        self.closed_code = None
+        self.unblocked = asyncio.Event()
+        if not blocked:
+            self.unblocked.set()
+
+    async def send_text(self, data: str):
+        await self.unblocked.wait()
+        self.sent.append(data)
+
+    async def send_bytes(self, data: bytes):
+        await self.unblocked.wait()
+        self.sent.append(data)
+
+    async def send_json(self, data):
+        await self.unblocked.wait()
+        self.sent.append(data)
+
+    async def close(self, code: int = 1000):
+        self.closed_code = code
@@ -0,0 +1,54 @@
+import pytest
+from websocket import admission
+from websocket.admission import AdmissionController, TokenBucket
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission.time, "monotonic", clock)
+    return clock
+
+def test_bucket_allows_burst_then_rejects_with_wait(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    assert [bucket.try_acquire() for _ in range(3)] == [0, 0, 0]
+    assert bucket.try_acquire() == pytest.approx(0.5)
+
+def test_bucket_refills_at_rate_up_to_capacity(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    for _ in range(3):
+        bucket.try_acquire()
+    clock.now += 0.5
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() > 0
+    clock.now += 60
+    assert [bucket.try_acquire() for _ in range(3)] == [0, 0, 0]
+    assert bucket.try_acquire() > 0
+
+def test_rate_limit_is_per_message_type(clock, monkeypatch):
+    monkeypatch.setattr(admission, "RATE_LIMITS", {"CreateRoom": (1, 1)})
+    connection = AdmissionController(max_in_flight=100).connection()
+    assert connection.admit("CreateRoom") is None
+    reason, retry_after_ms = connection.admit("CreateRoom")
+    assert reason == "rate_limited" and retry_after_ms > 0
+    assert connection.admit("SendMessage") is None
+
+def test_in_flight_limits_and_release(clock):
+    controller = AdmissionController(max_in_flight=3)
+    first = controller.connection()
+    first.max_in_flight = 2
+    second = controller.connection()
+    assert first.admit("SendMessage") is None
+    assert first.admit("SendMessage") is None
+    assert first.admit("SendMessage")[0] == "too_many_requests"
+    assert second.admit("SendMessage") is None
+    assert second.admit("SendMessage")[0] == "server_busy"
+    first.release()
+    assert second.admit("SendMessage") is None
+    assert controller.metrics()["rejected"] == {"too_many_requests": 1, "server_busy": 1}
@@ -0,0 +1,68 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import pytest
+from database.database import database
+from routers import authsession, refresh
+from routers.authsession import AuthSession, session_cache
+
+class FakePool:
+    """トランザクションの開始・コミット・ロールバックを記録する"""
+    def __init__(self, log):
+        self.log = log
+
+    @contextmanager
+    def connection(self):
+        yield self
+
+    @contextmanager
+    def transaction(self):
+        self.log.append("begin")
+        try:
+            yield
+        except Exception:
+            self.log.append("rollback")
+            raise
+        self.log.append("commit")
+
+    @contextmanager
+    def cursor(self, row_factory=None):
+        yield None
+
+@pytest.fixture
+def log(monkeypatch):
+    log = []
+    monkeypatch.setattr(database, "pool", FakePool(log))
+    monkeypatch.setattr(authsession, "from_thread", SimpleNamespace(run_sync=lambda func, *args: func(*args)))
+    monkeypatch.setattr(authsession.manager, "publish", lambda event: log.append(("publish", event["access_token"])))
+    session_cache.set("old", AuthSession("alice", "device", datetime.now() + timedelta(hours=1)))
+    yield log
+    session_cache.cache.pop("old")
+
+def test_refresh_invalidates_the_old_token_once_after_commit(log, monkeypatch):
+    def write(cursor, table, *args):
+        #コミット前は他のリクエストから古いトークンがまだ使える
+        assert session_cache.get("old") is not None
+        log.append(table)
+        return True
+    for name in ("delete", "update", "insert"):
+        monkeypatch.setattr(database, name, write)
+    assert refresh.generate_tokens([{"access_token": "old"}], "new", {"refresh_token": "refresh"})
+    assert log == ["begin", "access_tokens", "users", "access_tokens", "commit", ("publish", "old")]
+    assert session_cache.get("old") is None
+
+def test_failed_refresh_keeps_the_token_and_publishes_nothing(log, monkeypatch):
+    monkeypatch.setattr(database, "delete", lambda *args: True)
+    monkeypatch.setattr(database, "update", lambda *args: False)
+    assert not refresh.generate_tokens([{"access_token": "old"}], "new", {"refresh_token": "refresh"})
+    assert log == ["begin", "rollback"]
+    assert session_cache.get("old") is not None
+
+def test_sync_unit_of_work_rejects_coroutine_callbacks(log):
+    async def notify():
+        pass
+    with pytest.raises(TypeError):
+        with database.unit_of_work() as uow:
+            uow.after_commit(notify)
+    #登録に失敗した場合はロールバックされる
+    assert log == ["begin", "rollback"]
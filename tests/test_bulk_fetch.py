@@ -0,0 +1,16 @@
+import pytest
+from database.database import _bulk_fetch_query
+
+def test_single_key_passes_values_as_one_array():
+    query, params = _bulk_fetch_query("users", "id", ["a", "b"], ["id"], {"id": "uuid"})
+    assert params == [["a", "b"]]
+    assert "ANY(%s::\"uuid\"[])" in query.as_string(None)
+
+def test_multi_column_keys_are_unnested_per_column():
+    query, params = _bulk_fetch_query("room_participants", ["id", "user_id"], [("r1", "u1"), ("r2", "u2")], None, {"id": "uuid", "user_id": "uuid"})
+    assert params == [["r1", "r2"], ["u1", "u2"]]
+    assert "unnest" in query.as_string(None)
+
+def test_multi_column_keys_require_key_types():
+    with pytest.raises(ValueError):
+        _bulk_fetch_query("room_participants", ["id", "user_id"], [("r1", "u1")], None, {"id": "uuid"})
@@ -0,0 +1,120 @@
+import asyncio
+from contextlib import asynccontextmanager
+import pytest
+from database.database import async_database
+from websocket import cache
+from websocket.cache import TTLCache
+from websocket.friendrequests import FriendRequestStore
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    return clock
+
+def test_items_expire_after_ttl(clock):
+    ttl_cache = TTLCache(10, ttl=5)
+    ttl_cache.set("a", 1)
+    clock.now = 5
+    assert ttl_cache.get("a") == 1
+    clock.now = 5.1
+    assert ttl_cache.get("a") is None
+    assert len(ttl_cache) == 0
+
+def test_least_recently_used_item_is_evicted(clock):
+    ttl_cache = TTLCache(2, ttl=60)
+    ttl_cache.set("a", 1)
+    ttl_cache.set("b", 2)
+    ttl_cache.get("a")
+    ttl_cache.set("c", 3)
+    assert ttl_cache.get("b") is None
+    assert (ttl_cache.get("a"), ttl_cache.get("c")) == (1, 3)
+
+def test_set_renews_ttl_and_pop_removes(clock):
+    ttl_cache = TTLCache(2, ttl=5)
+    ttl_cache.set("a", 1)
+    clock.now = 4
+    ttl_cache.set("a", 2)
+    clock.now = 8
+    assert ttl_cache.get("a") == 2
+    ttl_cache.pop("a")
+    ttl_cache.pop("missing")
+    assert ttl_cache.get("a") is None
+
+class FakeFriendRequests:
+    """friend_requestsテーブルの代わり(fetchの途中でhookを実行できる)"""
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = 0
+        self.hook = None
+
+    @asynccontextmanager
+    async def get_connection(self):
+        yield self
+
+    @asynccontextmanager
+    async def cursor(self, row_factory=None):
+        yield None
+
+    async def fetch(self, cursor, table, filters):
+        self.queries += 1
+        if self.hook is not None:
+            self.hook()
+        return [{"requester_id": requester_id} for user_id, requester_id in self.rows if user_id == filters["user_id"]]
+
+    async def insert_friend_request(self, cursor, user_id, requester_id):
+        self.rows.add((user_id, requester_id))
+        return True
+
+class FakeUnitOfWork:
+    def __init__(self):
+        self.cursor = None
+        self.callbacks = []
+
+    def after_commit(self, func, *args):
+        self.callbacks.append((func, args))
+
+    def commit(self):
+        for func, args in self.callbacks:
+            func(*args)
+
+@pytest.fixture
+def table(monkeypatch):
+    fake = FakeFriendRequests({("alice", "bob")})
+    for name in ("get_connection", "fetch", "insert_friend_request"):
+        monkeypatch.setattr(async_database, name, getattr(fake, name))
+    return fake
+
+def test_requests_are_cached_until_invalidated(table):
+    store = FriendRequestStore()
+    assert asyncio.run(store.get_requests("alice")) == {"bob"}
+    assert asyncio.run(store.get_requests("alice")) == {"bob"}
+    assert table.queries == 1
+    store.handle_event({"user_id": "alice"})
+    asyncio.run(store.get_requests("alice"))
+    assert table.queries == 2
+    assert store.metrics()["hits"] == 1
+
+def test_add_invalidates_only_after_commit(table):
+    store = FriendRequestStore()
+    asyncio.run(store.get_requests("alice"))
+    uow = FakeUnitOfWork()
+    assert asyncio.run(store.add(uow, "alice", "carol"))
+    assert asyncio.run(store.get_requests("alice")) == {"bob"}
+    uow.commit()
+    assert asyncio.run(store.get_requests("alice")) == {"bob", "carol"}
+
+def test_invalidation_during_fetch_does_not_cache_stale_result(table):
+    store = FriendRequestStore()
+    table.hook = lambda: store.handle_event({"user_id": "alice"})
+    asyncio.run(store.get_requests("alice"))
+    table.hook = None
+    asyncio.run(store.get_requests("alice"))
+    assert table.queries == 2
@@ -0,0 +1,42 @@
+import base64
+import json
+import pytest
+from websocket.codec import Frame, add_seq, decode, encode
+from websocket.dispatcher import parse_request
+
+IMAGE = bytes(range(256)) * 4
+
+def test_add_seq_to_json_object():
+    assert json.loads(add_seq('{"type":"AuthInfo"}', "json", 7)) == {"type":"AuthInfo","seq":7}
+
+def test_add_seq_to_empty_json_object():
+    assert add_seq("{}", "json", 1) == '{"seq":1}'
+    assert json.loads(add_seq("{ } ", "json", 2)) == {"seq":2}
+
+def test_add_seq_rejects_non_object_frames():
+    with pytest.raises(ValueError):
+        add_seq("[1,2]", "json", 1)
+    with pytest.raises(ValueError):
+        add_seq("", "json", 1)
+
+def test_add_seq_to_msgpack_maps():
+    pytest.importorskip("msgpack")
+    assert decode(add_seq(encode({}, "msgpack"), "msgpack", 3)) == {"seq":3}
+    assert decode(add_seq(encode({"type":"AuthInfo"}, "msgpack"), "msgpack", 4)) == {"type":"AuthInfo","seq":4}
+    large = {f"key{i}": i for i in range(20)}
+    assert decode(add_seq(encode(large, "msgpack"), "msgpack", 5)) == {**large, "seq":5}
+
+def test_images_are_sent_as_binary_in_msgpack_only():
+    pytest.importorskip("msgpack")
+    image = base64.b64encode(IMAGE).decode()
+    frame = Frame({"type":"ReceiveMessage","content":{"type":"image","image":image}})
+    assert decode(frame.encode("msgpack"))["content"]["image"] == IMAGE
+    assert json.loads(frame.encode("json"))["content"]["image"] == image
+    history = {"type":"Latest-Message","content":[{"type":"text","content":"hello"},{"type":"image","content":image}]}
+    assert [row["content"] for row in decode(encode(history, "msgpack"))["content"]] == ["hello", IMAGE]
+
+def test_msgpack_binary_image_is_stored_as_base64():
+    pytest.importorskip("msgpack")
+    raw = encode({"id":1,"type":"SendMessage","content":{"type":"image","roomid":"6f1c2a4e-8d3b-4c5a-9e7f-1a2b3c4d5e6f","image":base64.b64encode(IMAGE).decode()}}, "msgpack")
+    request = parse_request(raw)
+    assert request.content.image == base64.b64encode(IMAGE).decode()
@@ -0,0 +1,39 @@
+import asyncio
+from websocket.manager import ConnectionManager
+from tests.fakes import FakeWebSocket
+
+def test_same_user_always_maps_to_the_same_stripe():
+    manager = ConnectionManager()
+    assert manager.user_lock("alice") is manager.user_lock("alice")
+    stripes = {id(manager.user_lock(f"user-{i}")) for i in range(1000)}
+    assert len(stripes) == len(manager.locks)
+
+def test_concurrent_connects_and_disconnects_keep_the_index_consistent():
+    async def main():
+        manager = ConnectionManager()
+        sockets = {f"user-{i}": FakeWebSocket() for i in range(200)}
+        await asyncio.gather(*(manager.verified_connect(ws, user_id) for user_id, ws in sockets.items()))
+        online = all(manager.is_online(user_id) for user_id in sockets)
+        leaving = list(sockets.items())[::2]
+        await asyncio.gather(*(manager.disconnect(ws, user_id) for user_id, ws in leaving))
+        return manager, sockets, leaving, online
+    manager, sockets, leaving, online = asyncio.run(main())
+    assert online
+    left = {user_id for user_id, _ in leaving}
+    assert set(manager.active_connections) == set(sockets) - left
+    assert len(manager.outboxes) == len(sockets) - len(left)
+
+def test_late_disconnect_of_old_socket_keeps_the_reconnected_one():
+    async def main():
+        manager = ConnectionManager()
+        old, new = FakeWebSocket(), FakeWebSocket()
+        await manager.verified_connect(old, "alice")
+        manager.user_rooms["alice"] = set()
+        manager.add_room_member("room", "alice")
+        await manager.verified_connect(new, "alice")
+        await manager.disconnect(old, "alice")
+        return manager, old, new
+    manager, old, new = asyncio.run(main())
+    assert manager.active_connections["alice"] is new
+    assert new in manager.outboxes and old not in manager.outboxes
+    assert manager.get_online_room_members("room") == {"alice"}
@@ -0,0 +1,93 @@
+import asyncio
+import json
+import pytest
+from websocket.eventbus import EventBus, InProcessEventBus, create_event_bus
+from websocket.manager import ConnectionManager
+from tests.fakes import FakeWebSocket
+
+ROOM_ID = "6f1c2a4e-8d3b-4c5a-9e7f-1a2b3c4d5e6f"
+
+async def settle():
+    """イベントバスの送信タスクと送信キューを進める"""
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+async def start_workers(count: int):
+    """同じhubを共有するイベントバスでcount個のワーカーを模擬する"""
+    hub = []
+    managers = []
+    for _ in range(count):
+        manager = ConnectionManager()
+        await manager.start_event_bus(InProcessEventBus(hub))
+        managers.append(manager)
+    return managers
+
+async def connect(manager: ConnectionManager, user_id: str, rooms=()) -> FakeWebSocket:
+    ws = FakeWebSocket()
+    await manager.verified_connect(ws, user_id)
+    manager.user_rooms.setdefault(user_id, set())
+    for room_id in rooms:
+        manager.add_room_member(room_id, user_id)
+    manager.replay(ws, user_id)
+    return ws
+
+async def stop_workers(managers):
+    for manager in managers:
+        for outbox in manager.outboxes.values():
+            outbox.close()
+        await manager.stop_event_bus()
+
+def received(ws: FakeWebSocket):
+    return [json.loads(frame)["content"] for frame in ws.sent]
+
+def test_broadcast_room_fans_out_to_members_on_other_workers():
+    async def main():
+        first, second = await start_workers(2)
+        sender = await connect(first, "alice", [ROOM_ID])
+        local = await connect(first, "bob", [ROOM_ID])
+        remote = await connect(second, "carol", [ROOM_ID])
+        outsider = await connect(second, "dave")
+        first.broadcast_room({"type":"ReceiveMessage","content":{"text":"hello"}}, ROOM_ID, exclude_user_id="alice")
+        await settle()
+        await stop_workers([first, second])
+        return sender, local, remote, outsider
+    sender, local, remote, outsider = asyncio.run(main())
+    assert received(local) == [{"text":"hello"}]
+    assert received(remote) == [{"text":"hello"}]
+    assert received(sender) == []
+    assert received(outsider) == []
+
+def test_send_to_user_reaches_other_worker_once():
+    async def main():
+        first, second = await start_workers(2)
+        remote = await connect(second, "carol")
+        first.send_to_user({"type":"AuthInfo","content":{"n":1}}, "carol")
+        await settle()
+        await stop_workers([first, second])
+        return remote
+    assert received(asyncio.run(main())) == [{"n":1}]
+
+def test_membership_change_for_remote_user_updates_their_worker():
+    async def main():
+        first, second = await start_workers(2)
+        await connect(second, "carol")
+        first.add_room_member(ROOM_ID, "carol")
+        await settle()
+        joined = second.get_online_room_members(ROOM_ID).copy()
+        first.remove_room_member(ROOM_ID, "carol")
+        await settle()
+        left = second.get_online_room_members(ROOM_ID).copy()
+        await stop_workers([first, second])
+        return joined, left
+    joined, left = asyncio.run(main())
+    assert joined == {"carol"}
+    assert left == set()
+
+def test_event_bus_requires_send():
+    with pytest.raises(TypeError):
+        EventBus()
+
+def test_none_backend_disables_the_bus():
+    assert create_event_bus("none") is None
+    with pytest.raises(ValueError):
+        create_event_bus("redis")
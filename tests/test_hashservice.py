@@ -0,0 +1,50 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from hashed.service import PasswordHashService, HashingBusy
+
+def run_until(release: threading.Event, value):
+    release.wait(5)
+    return value
+
+def service_with_threads(workers: int, max_waiting: int) -> PasswordHashService:
+    #プロセスを起動せずに順番待ちの動作を確かめるため、同じ数のスレッドで実行する
+    service = PasswordHashService(workers=workers, max_waiting=max_waiting)
+    service.executor = ThreadPoolExecutor(workers)
+    return service
+
+def test_requests_over_the_waiting_limit_are_rejected():
+    service = service_with_threads(workers=2, max_waiting=3)
+    release = threading.Event()
+    async def main():
+        tasks = [asyncio.create_task(service.run(run_until, release, i)) for i in range(5)]
+        await asyncio.sleep(0.01)
+        assert service.metrics()["running"] == 2
+        assert service.metrics()["waiting"] == 3
+        with pytest.raises(HashingBusy):
+            await service.run(run_until, release, 5)
+        release.set()
+        return await asyncio.gather(*tasks)
+    assert asyncio.run(main()) == [0, 1, 2, 3, 4]
+    assert service.metrics()["rejected"] == 1
+    assert service.metrics()["completed"] == 5
+    service.shutdown()
+
+def test_cancelled_waiter_gives_up_its_place():
+    service = service_with_threads(workers=1, max_waiting=1)
+    release = threading.Event()
+    async def main():
+        running = asyncio.create_task(service.run(run_until, release, "running"))
+        waiting = asyncio.create_task(service.run(run_until, release, "waiting"))
+        await asyncio.sleep(0.01)
+        #クライアントが切断してハンドラが取り消された場合
+        waiting.cancel()
+        await asyncio.sleep(0)
+        assert service.metrics()["waiting"] == 0
+        queued = asyncio.create_task(service.run(run_until, release, "queued"))
+        await asyncio.sleep(0.01)
+        release.set()
+        return await running, await queued
+    assert asyncio.run(main()) == ("running", "queued")
+    service.shutdown()
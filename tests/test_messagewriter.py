@@ -0,0 +1,116 @@
+import asyncio
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+import pytest
+from psycopg import DataError, OperationalError
+from database.database import async_database
+from websocket.messagewriter import MessageWriter
+
+class FakeDatabase:
+    """保存したバッチを記録し、badのメッセージを含むバッチは失敗させる(errorを設定した場合は全てのバッチを失敗させる)"""
+    def __init__(self):
+        self.inserts = []
+        self.saved = []
+        self.rows = []
+        self.bad = set()
+        self.error = None
+        self.active = {}
+        self.overlaps = 0
+
+    @asynccontextmanager
+    async def unit_of_work(self):
+        yield SimpleNamespace(cursor=None)
+
+    async def insert_messages(self, cursor, messages):
+        ids = [message["id"] for message in messages]
+        self.inserts.append(ids)
+        if self.error is not None:
+            raise self.error
+        rooms = {message["room_id"] for message in messages}
+        for room_id in rooms:
+            if self.active.get(room_id):
+                self.overlaps += 1
+            self.active[room_id] = True
+        #コミットを待っている間に他のタスクが動けるようにする
+        await asyncio.sleep(0.01)
+        for room_id in rooms:
+            self.active[room_id] = False
+        if self.bad & set(ids):
+            raise DataError("invalid input syntax for type uuid")
+        self.saved.extend(ids)
+        self.rows.extend(messages)
+        return ids
+
+    def history(self, room_id):
+        """履歴・未読メッセージの取得と同じ(created_at, id)の順に返す"""
+        rows = sorted((row for row in self.rows if row["room_id"] == room_id), key=lambda row: (row["created_at"], row["id"]))
+        return [row["id"] for row in rows]
+
+@pytest.fixture
+def database(monkeypatch):
+    fake = FakeDatabase()
+    monkeypatch.setattr(async_database, "unit_of_work", fake.unit_of_work)
+    monkeypatch.setattr(async_database, "insert_messages", fake.insert_messages)
+    return fake
+
+def message(i, room_id="room"):
+    return {"id": f"m{i}", "room_id": room_id, "sender_id": "alice", "type": "text", "content": "hi"}
+
+def test_messages_of_one_room_are_committed_in_order_by_one_task(database):
+    async def main():
+        writer = MessageWriter(max_batch=2, concurrency=4)
+        writer.start()
+        #write()が返った順に配信されるため、返った順がコミットの順と一致することを確かめる
+        returned = []
+        async def send(i):
+            await writer.write(message(i))
+            returned.append(f"m{i}")
+        await asyncio.gather(*(send(i) for i in range(7)))
+        await writer.stop()
+        return returned
+    returned = asyncio.run(main())
+    assert database.overlaps == 0
+    assert database.saved == [f"m{i}" for i in range(7)]
+    assert returned == database.saved
+
+def test_failed_batch_is_bisected_to_isolate_the_bad_message(database):
+    database.bad = {"m5"}
+    async def main():
+        writer = MessageWriter(max_batch=16, concurrency=1)
+        writer.start()
+        results = await asyncio.gather(*(writer.write(message(i)) for i in range(16)), return_exceptions=True)
+        metrics = writer.metrics()
+        await writer.stop()
+        return results, metrics
+    results, metrics = asyncio.run(main())
+    assert [i for i, result in enumerate(results) if isinstance(result, Exception)] == [5]
+    assert sorted(database.saved) == sorted(f"m{i}" for i in range(16) if i != 5)
+    #一件ずつ保存し直す(17回)のではなく、半分ずつに分けて保存し直す(1 + 2 * log2(16)回)
+    assert len(database.inserts) == 9
+    assert metrics["failed"] == 1
+
+def test_messages_in_one_batch_read_back_in_send_order(database):
+    async def main():
+        writer = MessageWriter(max_batch=16, concurrency=1)
+        writer.start()
+        #idの順序(m9, m8, ...)が送信の順序と逆でも、created_atで送信の順序になる
+        await asyncio.gather(*(writer.write(message(9 - i)) for i in range(10)))
+        await writer.stop()
+    asyncio.run(main())
+    assert len(database.inserts) == 1
+    assert database.history("room") == [f"m{9 - i}" for i in range(10)]
+
+def test_connection_errors_fail_the_whole_batch_at_once(database):
+    database.error = OperationalError("connection refused")
+    async def main():
+        writer = MessageWriter(max_batch=16, concurrency=1)
+        writer.start()
+        results = await asyncio.gather(*(writer.write(message(i)) for i in range(16)), return_exceptions=True)
+        metrics = writer.metrics()
+        await writer.stop()
+        return results, metrics
+    results, metrics = asyncio.run(main())
+    assert all(isinstance(result, OperationalError) for result in results)
+    #接続できない間は分割して保存し直さない
+    assert len(database.inserts) == 1
+    assert metrics["failed"] == 16
@@ -0,0 +1,81 @@
+from contextlib import contextmanager
+import pytest
+from database.database import database
+from websocket.notifier import NotificationDispatcher, FakeTransport
+
+NOTIFICATION = {"title": "新しいメッセージ", "body": "hi"}
+
+class FakeDatabase:
+    """ルームの参加者のトークンを返し、削除したトークンを記録する"""
+    def __init__(self, rooms):
+        self.rooms = rooms
+        self.lookups = []
+        self.cleared = []
+
+    @contextmanager
+    def get_connection(self):
+        yield self
+
+    @contextmanager
+    def cursor(self, row_factory=None):
+        yield None
+
+    def fetch_room_fcm_tokens(self, cursor, room_id, exclude_user_ids):
+        self.lookups.append(room_id)
+        return [token for user_id, token in self.rooms[room_id].items() if user_id not in exclude_user_ids]
+
+    def clear_fcm_tokens(self, cursor, tokens):
+        self.cleared.extend(tokens)
+        return len(tokens)
+
+@pytest.fixture
+def fake_database(monkeypatch):
+    fake = FakeDatabase({
+        "room1": {"alice": "t-alice", "bob": "t-bob", "carol": "t-carol"},
+        "room2": {"bob": "t-bob", "dave": "t-dave"},
+    })
+    for name in ("get_connection", "fetch_room_fcm_tokens", "clear_fcm_tokens"):
+        monkeypatch.setattr(database, name, getattr(fake, name))
+    return fake
+
+def test_same_notification_is_sent_once_per_device_in_batches(fake_database):
+    transport = FakeTransport()
+    dispatcher = NotificationDispatcher(transport, workers=1, batch_size=2, retry_base=0)
+    dispatcher.notify_room("room1", ["alice"], NOTIFICATION)
+    dispatcher.notify_room("room2", [], NOTIFICATION)
+    dispatcher.notify_tokens(["t-erin"], NOTIFICATION)
+    #キューに溜まっている通知は一度にまとめて取り出される
+    dispatcher.start()
+    dispatcher.stop(timeout=5)
+    #t-bobは二つのルームの参加者だが一度だけ送信する
+    assert sorted(token for token, _ in transport.delivered) == ["t-bob", "t-carol", "t-dave", "t-erin"]
+    assert all(len(tokens) <= 2 for tokens, _ in transport.batches)
+    assert dispatcher.metrics()["sent"] == 4
+
+def test_transient_failures_are_retried(fake_database):
+    transport = FakeTransport(failures=2)
+    dispatcher = NotificationDispatcher(transport, max_retries=3, retry_base=0)
+    dispatcher.dispatch([("tokens", None, ["t-alice", "t-bob"], NOTIFICATION)])
+    assert len(transport.batches) == 3
+    assert sorted(token for token, _ in transport.delivered) == ["t-alice", "t-bob"]
+    assert dispatcher.metrics()["retried"] == 4
+
+def test_retries_give_up_after_max_retries(fake_database):
+    transport = FakeTransport(failures=10)
+    dispatcher = NotificationDispatcher(transport, max_retries=2, retry_base=0)
+    dispatcher.dispatch([("tokens", None, ["t-alice"], NOTIFICATION)])
+    assert len(transport.batches) == 3
+    assert dispatcher.metrics()["failed"] == 1
+
+def test_invalid_tokens_are_removed_from_users(fake_database):
+    transport = FakeTransport(invalid_tokens=["t-carol"])
+    dispatcher = NotificationDispatcher(transport, retry_base=0)
+    dispatcher.dispatch([("room", "room1", ["alice"], NOTIFICATION)])
+    assert fake_database.cleared == ["t-carol"]
+    assert dispatcher.metrics()["invalidated"] == 1
+
+def test_notifications_are_dropped_when_the_queue_is_full(fake_database):
+    dispatcher = NotificationDispatcher(FakeTransport(), queue_size=1)
+    assert dispatcher.notify_tokens(["t-alice"], NOTIFICATION)
+    assert not dispatcher.notify_tokens(["t-bob"], NOTIFICATION)
+    assert dispatcher.metrics()["dropped"] == 1
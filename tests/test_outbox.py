@@ -0,0 +1,99 @@
+import asyncio
+import json
+import pytest
+from websocket.outbox import Outbox
+from tests.fakes import FakeWebSocket
+
+async def settle():
+    """送信タスクを進める"""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+def test_sends_in_order():
+    async def main():
+        ws = FakeWebSocket()
+        outbox = Outbox(ws, 4)
+        outbox.start()
+        for i in range(3):
+            assert outbox.put({"n": i})
+        await settle()
+        outbox.close()
+        return ws, outbox
+    ws, outbox = asyncio.run(main())
+    assert [json.loads(frame)["n"] for frame in ws.sent] == [0, 1, 2]
+    assert outbox.metrics()["sent"] == 3
+
+def test_drop_oldest_discards_oldest_ephemeral_message():
+    async def main():
+        ws = FakeWebSocket(blocked=True)
+        outbox = Outbox(ws, 3, "drop_oldest")
+        outbox.put({"n": 0})
+        outbox.put({"n": 1}, ephemeral=True)
+        outbox.put({"n": 2}, ephemeral=True)
+        assert outbox.put({"n": 3})
+        return outbox
+    outbox = asyncio.run(main())
+    assert [message["n"] for message, _, _ in outbox.queue] == [0, 2, 3]
+    assert outbox.metrics()["dropped"] == 1
+    assert not outbox.closed
+
+def test_drop_oldest_disconnects_when_nothing_is_ephemeral():
+    async def main():
+        ws = FakeWebSocket(blocked=True)
+        outbox = Outbox(ws, 2, "drop_oldest")
+        outbox.put({"n": 0})
+        outbox.put({"n": 1})
+        assert not outbox.put({"n": 2})
+        await settle()
+        return ws, outbox
+    ws, outbox = asyncio.run(main())
+    assert outbox.closed and outbox.overflowed
+    assert ws.closed_code == 1008
+    assert not outbox.put({"n": 3})
+
+def test_disconnect_policy_closes_even_with_ephemeral_messages():
+    async def main():
+        ws = FakeWebSocket(blocked=True)
+        outbox = Outbox(ws, 1, "disconnect")
+        outbox.put({"n": 0}, ephemeral=True)
+        assert not outbox.put({"n": 1}, ephemeral=True)
+        #切断タスクは完了するまで送信キューが参照を保持する
+        assert outbox.close_task is not None
+        await settle()
+        return ws, outbox
+    ws, outbox = asyncio.run(main())
+    assert outbox.closed
+    assert ws.closed_code == 1008
+    assert outbox.close_task is None
+
+def test_wait_for_space_resumes_after_sends():
+    async def main():
+        ws = FakeWebSocket(blocked=True)
+        outbox = Outbox(ws, 10)
+        outbox.start()
+        for i in range(4):
+            outbox.put({"n": i})
+        waiter = asyncio.create_task(outbox.wait_for_space(1))
+        await settle()
+        assert not waiter.done()
+        ws.unblocked.set()
+        result = await asyncio.wait_for(waiter, 1)
+        outbox.close()
+        return result
+    assert asyncio.run(main())
+
+def test_wait_for_space_returns_false_when_closed():
+    async def main():
+        outbox = Outbox(FakeWebSocket(blocked=True), 10)
+        outbox.start()
+        for i in range(4):
+            outbox.put({"n": i})
+        waiter = asyncio.create_task(outbox.wait_for_space(1))
+        await settle()
+        outbox.close()
+        return await asyncio.wait_for(waiter, 1)
+    assert not asyncio.run(main())
+
+def test_invalid_policy_is_rejected():
+    with pytest.raises(ValueError):
+        Outbox(FakeWebSocket(), 1, "block")
@@ -0,0 +1,124 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import pytest
+from psycopg.errors import DataError
+from database.database import async_database
+from websocket import getlatestmsg
+from websocket.readposition import ReadPositionBuffer
+from tests.fakes import FakeWebSocket
+
+T0 = datetime(2024, 1, 1)
+ROOM = "6f1c2a4e-8d3b-4c5a-9e7f-1a2b3c4d5e6f"
+OTHER_ROOM = "11111111-2222-4333-8444-555555555555"
+ALICE = "0b7e3d2c-1a9f-4e8d-b6c5-a4f3e2d1c0b9"
+BOB = "9a8b7c6d-5e4f-4a3b-8c2d-1e0f9a8b7c6d"
+
+class FakeDatabase:
+    """既読位置の書き込みと未読メッセージの取得を順に記録する"""
+    def __init__(self):
+        self.calls = []
+        self.error = None
+        #このルームを含む書き込みはDataErrorで失敗させる
+        self.bad_room = None
+        #設定した場合は書き込みの途中で止める
+        self.gate: asyncio.Event | None = None
+
+    @asynccontextmanager
+    async def unit_of_work(self):
+        yield SimpleNamespace(cursor=None)
+
+    @asynccontextmanager
+    async def get_connection(self):
+        yield self
+
+    @asynccontextmanager
+    async def cursor(self, row_factory=None):
+        yield None
+
+    async def update_last_viewed_at(self, cursor, room_ids, user_ids, viewed_at):
+        if self.error is not None:
+            raise self.error
+        if self.bad_room in room_ids:
+            raise DataError("timestamp out of range")
+        if self.gate is not None:
+            await self.gate.wait()
+        self.calls.append(("update", sorted(zip(room_ids, user_ids, viewed_at))))
+        return len(room_ids)
+
+    async def fetch_unread_messages(self, cursor, user_id, limit, chunk_size, after=None):
+        self.calls.append(("unread", user_id))
+        return [], {}, None
+
+    async def fetch(self, cursor, table, filters):
+        return []
+
+@pytest.fixture
+def database(monkeypatch):
+    fake = FakeDatabase()
+    for name in ("unit_of_work", "get_connection", "update_last_viewed_at", "fetch_unread_messages", "fetch"):
+        monkeypatch.setattr(async_database, name, getattr(fake, name))
+    return fake
+
+def test_keeps_only_the_newest_position_per_room(database):
+    buffer = ReadPositionBuffer()
+    buffer.mark(ROOM, ALICE, T0 + timedelta(seconds=2))
+    buffer.mark(ROOM, ALICE, T0)
+    asyncio.run(buffer.flush())
+    assert database.calls == [("update", [(ROOM, ALICE, T0 + timedelta(seconds=2))])]
+
+def test_flush_user_writes_only_that_user(database):
+    buffer = ReadPositionBuffer()
+    buffer.mark(ROOM, ALICE, T0)
+    buffer.mark(ROOM, BOB, T0)
+    asyncio.run(buffer.flush_user(ALICE))
+    assert database.calls == [("update", [(ROOM, ALICE, T0)])]
+    assert buffer.metrics()["pending"] == 1
+
+def test_failed_write_is_retried_but_invalid_values_are_dropped(database):
+    buffer = ReadPositionBuffer()
+    buffer.mark(ROOM, ALICE, T0)
+    database.error = ConnectionError("database unavailable")
+    asyncio.run(buffer.flush())
+    assert buffer.metrics()["pending"] == 1
+    database.error = DataError("invalid input syntax for type uuid")
+    asyncio.run(buffer.flush())
+    assert buffer.metrics()["pending"] == 0
+
+def test_unread_backlog_reads_after_pending_positions_are_written(database, monkeypatch):
+    buffer = ReadPositionBuffer()
+    monkeypatch.setattr(getlatestmsg, "read_positions", buffer)
+    buffer.mark(ROOM, ALICE, T0)
+    asyncio.run(getlatestmsg.get_latest_message(FakeWebSocket(), ALICE))
+    assert database.calls == [("update", [(ROOM, ALICE, T0)]), ("unread", ALICE)]
+
+def test_invalid_entries_are_dropped_without_losing_the_others(database):
+    buffer = ReadPositionBuffer()
+    database.bad_room = OTHER_ROOM
+    buffer.mark(ROOM, ALICE, T0)
+    buffer.mark(OTHER_ROOM, ALICE, T0)
+    buffer.mark(ROOM, BOB, T0)
+    buffer.mark("not-a-uuid", BOB, T0)
+    asyncio.run(buffer.flush())
+    written = sorted(entry for _, entries in database.calls for entry in entries)
+    assert written == [(ROOM, ALICE, T0), (ROOM, BOB, T0)]
+    assert buffer.metrics()["pending"] == 0
+
+def test_stop_waits_for_the_write_in_progress(database):
+    async def main():
+        buffer = ReadPositionBuffer(flush_ms=1)
+        database.gate = asyncio.Event()
+        buffer.start()
+        buffer.mark(ROOM, ALICE, T0)
+        #定期的な書き込みが更新を取り出して書き込んでいる途中で止める
+        while buffer.metrics()["pending"]:
+            await asyncio.sleep(0.001)
+        buffer.mark(ROOM, BOB, T0)
+        stopping = asyncio.create_task(buffer.stop())
+        await asyncio.sleep(0.01)
+        database.gate.set()
+        await stopping
+    asyncio.run(main())
+    written = sorted(entry for _, entries in database.calls for entry in entries)
+    assert written == [(ROOM, ALICE, T0), (ROOM, BOB, T0)]
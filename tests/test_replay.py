@@ -0,0 +1,99 @@
+import asyncio
+import json
+import pytest
+from websocket import cache
+from websocket.manager import ConnectionManager
+from tests.fakes import FakeWebSocket
+
+ROOM_ID = "6f1c2a4e-8d3b-4c5a-9e7f-1a2b3c4d5e6f"
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    return clock
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+async def connect(manager: ConnectionManager, user_id: str, rooms=(), resume_from=None, epoch=None):
+    """routers/websocket.pyと同じ順で接続し、(websocket, 再送できたか, epoch, seq)を返す"""
+    ws = FakeWebSocket()
+    await manager.verified_connect(ws, user_id)
+    manager.user_rooms.setdefault(user_id, set())
+    for room_id in rooms:
+        manager.add_room_member(room_id, user_id)
+    resumed, epoch, seq = manager.check_resume(user_id, resume_from, epoch)
+    manager.replay(ws, user_id, resume_from if resumed else None)
+    return ws, resumed, epoch, seq
+
+def send(manager: ConnectionManager, text: str):
+    manager.broadcast_room({"type":"ReceiveMessage","content":{"text":text}}, ROOM_ID, exclude_user_id="alice")
+
+def received(ws: FakeWebSocket):
+    return [(frame["seq"], frame["content"]["text"]) for frame in map(json.loads, ws.sent)]
+
+def test_room_message_sent_while_disconnected_is_replayed_on_resume(clock):
+    async def main():
+        manager = ConnectionManager()
+        await connect(manager, "alice", [ROOM_ID])
+        first, _, epoch, _ = await connect(manager, "bob", [ROOM_ID])
+        send(manager, "before")
+        await settle()
+        last_seq = received(first)[-1][0]
+        await manager.disconnect(first, "bob")
+        send(manager, "during")
+        second, resumed, _, _ = await connect(manager, "bob", [ROOM_ID], last_seq, epoch)
+        send(manager, "after")
+        await settle()
+        return first, second, resumed
+    first, second, resumed = asyncio.run(main())
+    assert received(first) == [(1, "before")]
+    assert resumed
+    assert received(second) == [(2, "during"), (3, "after")]
+
+def test_detached_rooms_expire_with_the_buffer(clock):
+    async def main():
+        manager = ConnectionManager()
+        await connect(manager, "alice", [ROOM_ID])
+        ws, _, epoch, _ = await connect(manager, "bob", [ROOM_ID])
+        await manager.disconnect(ws, "bob")
+        assert manager.get_room_recipients(ROOM_ID) == {"alice", "bob"}
+        clock.now += manager.replay_buffers.detached.ttl + 1
+        send(manager, "after expiry")
+        assert manager.get_room_recipients(ROOM_ID) == {"alice"}
+        assert manager.replay_buffers.detached_rooms == {}
+        _, resumed, new_epoch, seq = await connect(manager, "bob", [ROOM_ID], 0, epoch)
+        return resumed, new_epoch != epoch, seq
+    assert asyncio.run(main()) == (False, True, 0)
+
+def test_rooms_joined_or_left_while_disconnected_are_tracked(clock):
+    async def main():
+        manager = ConnectionManager()
+        ws, _, _, _ = await connect(manager, "bob", [ROOM_ID])
+        await manager.disconnect(ws, "bob")
+        manager.add_room_member("other-room", "bob", publish=False)
+        manager.remove_room_member(ROOM_ID, "bob", publish=False)
+        return manager.get_room_recipients("other-room"), manager.get_room_recipients(ROOM_ID)
+    joined, left = asyncio.run(main())
+    assert joined == {"bob"}
+    assert left == set()
+
+def test_reconnect_clears_detached_membership(clock):
+    async def main():
+        manager = ConnectionManager()
+        ws, _, _, _ = await connect(manager, "bob", [ROOM_ID])
+        await manager.disconnect(ws, "bob")
+        await connect(manager, "bob", [ROOM_ID])
+        return manager.replay_buffers.detached_rooms, manager.get_room_recipients(ROOM_ID)
+    detached_rooms, recipients = asyncio.run(main())
+    assert detached_rooms == {}
+    assert recipients == {"bob"}
@@ -0,0 +1,83 @@
+import asyncio
+from contextlib import asynccontextmanager
+import pytest
+from database.database import async_database
+from websocket.manager import ConnectionManager
+from websocket.schemas import SendMessageRequest, JoinRoomRequest, LeaveRoomRequest, FocusRequest
+
+ROOM_ID = "6f1c2a4e-8d3b-4c5a-9e7f-1a2b3c4d5e6f"
+USER_ID = "0b7e3d2c-1a9f-4e8d-b6c5-a4f3e2d1c0b9"
+
+class FakeParticipants:
+    """room_participantsの代わりに(ルームID, ユーザーID)の集合を参照する"""
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = 0
+
+    @asynccontextmanager
+    async def get_connection(self):
+        yield self
+
+    @asynccontextmanager
+    async def cursor(self, row_factory=None):
+        yield None
+
+    async def fetch(self, cursor, table, filters):
+        self.queries += 1
+        if (filters["id"], filters["user_id"]) in self.rows:
+            return [{"id": filters["id"], "user_id": filters["user_id"]}]
+        return []
+
+@pytest.fixture
+def participants(monkeypatch):
+    fake = FakeParticipants({(ROOM_ID, USER_ID)})
+    monkeypatch.setattr(async_database, "get_connection", fake.get_connection)
+    monkeypatch.setattr(async_database, "fetch", fake.fetch)
+    return fake
+
+def online_manager() -> ConnectionManager:
+    manager = ConnectionManager()
+    manager.user_rooms[USER_ID] = set()
+    return manager
+
+def test_indexed_room_does_not_query(participants):
+    manager = online_manager()
+    manager.add_room_member(ROOM_ID, USER_ID)
+    assert asyncio.run(manager.is_room_member(ROOM_ID, USER_ID))
+    assert participants.queries == 0
+
+def test_stale_index_falls_back_to_database_and_is_filled(participants):
+    manager = online_manager()
+    assert asyncio.run(manager.is_room_member(ROOM_ID, USER_ID))
+    assert participants.queries == 1
+    assert USER_ID in manager.get_online_room_members(ROOM_ID)
+    assert asyncio.run(manager.is_room_member(ROOM_ID, USER_ID))
+    assert participants.queries == 1
+
+def test_non_canonical_uuid_matches_index(participants):
+    manager = online_manager()
+    manager.add_room_member(ROOM_ID, USER_ID)
+    assert asyncio.run(manager.is_room_member(ROOM_ID.upper(), USER_ID))
+    assert participants.queries == 0
+
+@pytest.mark.parametrize("roomid", [ROOM_ID.upper(), ROOM_ID.replace("-", ""), "{" + ROOM_ID + "}"])
+def test_room_ids_are_canonical_when_received(participants, roomid):
+    manager = online_manager()
+    manager.add_room_member(ROOM_ID, USER_ID)
+    requests = [
+        SendMessageRequest.model_validate({"id": 1, "type": "SendMessage", "content": {"type": "text", "roomid": roomid, "message": "hi"}}),
+        JoinRoomRequest.model_validate({"id": 1, "type": "JoinRoom", "content": {"roomid": roomid, "participants": USER_ID}}),
+        LeaveRoomRequest.model_validate({"id": 1, "type": "LeaveRoom", "content": {"roomid": roomid}}),
+        FocusRequest.model_validate({"id": 1, "type": "Focus", "content": {"roomid": roomid}}),
+    ]
+    for request in requests:
+        #配信・通知の除外はハンドラが受け取ったルームIDでインデックスを参照する
+        assert request.content.roomid == ROOM_ID
+        assert USER_ID in manager.get_online_room_members(request.content.roomid)
+
+def test_non_member_is_rejected(participants):
+    manager = online_manager()
+    other_room = "11111111-2222-4333-8444-555555555555"
+    assert not asyncio.run(manager.is_room_member(other_room, USER_ID))
+    assert not asyncio.run(manager.is_room_member("not-a-uuid", USER_ID))
+    assert participants.queries == 1
@@ -0,0 +1,27 @@
+import asyncio
+from database.database import async_database
+from database.migrate import AsyncRecordingCursor, SAMPLE_UUID
+
+def search(key, after=None):
+    cursor = AsyncRecordingCursor()
+    asyncio.run(async_database.search_users(cursor, key, SAMPLE_UUID, 21, after))
+    query, params = cursor.queries[0]
+    return query.as_string(None), params
+
+def test_orders_by_trigram_distance_for_knn_scan():
+    query, params = search("user")
+    assert "ORDER BY name <-> %(key)s, id" in query
+    assert params["pattern"] == "%user%"
+
+def test_short_key_uses_prefix_match():
+    _, params = search("us")
+    assert params["pattern"] == "us%"
+
+def test_like_wildcards_in_key_are_escaped():
+    _, params = search("a_b%c")
+    assert params["pattern"] == "%a\\_b\\%c%"
+
+def test_next_page_continues_after_distance_and_id():
+    query, params = search("user", {"score": 0.25, "id": SAMPLE_UUID})
+    assert "(name <-> %(key)s, id) > (%(after_score)s::real, %(after_id)s::uuid)" in query
+    assert (params["after_score"], params["after_id"]) == (0.25, SAMPLE_UUID)
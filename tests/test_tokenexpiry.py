@@ -0,0 +1,89 @@
+import asyncio
+import pytest
+from websocket import tokenexpiry
+from websocket.tokenexpiry import TimerWheel, TokenExpiryTimer
+
+def advance_until(wheel: TimerWheel, ticks: int):
+    """ticks tick進め、期限に達したkeyを(tick, key)のリストで返す"""
+    fired = []
+    for _ in range(ticks):
+        fired.extend((wheel.current_tick, key) for key in wheel.advance())
+    return fired
+
+def test_wheel_fires_at_deadline():
+    wheel = TimerWheel(8)
+    wheel.schedule("a", 3)
+    wheel.schedule("b", 5)
+    assert advance_until(wheel, 6) == [(3, "a"), (5, "b")]
+    assert len(wheel) == 0
+
+def test_wheel_deadline_beyond_one_rotation_waits_for_its_round():
+    wheel = TimerWheel(4)
+    wheel.schedule("a", 10)
+    assert advance_until(wheel, 12) == [(10, "a")]
+
+def test_wheel_reschedule_and_cancel():
+    wheel = TimerWheel(8)
+    wheel.schedule("a", 2)
+    wheel.schedule("a", 6)
+    wheel.schedule("b", 3)
+    wheel.cancel("b")
+    assert advance_until(wheel, 8) == [(6, "a")]
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(tokenexpiry.time, "monotonic", clock)
+    monkeypatch.setattr(tokenexpiry, "TOKEN_EXPIRY_WARNING_SECONDS", 10)
+    return clock
+
+class Recorder:
+    def __init__(self):
+        self.warned = []
+        self.expired = []
+
+    async def warn(self, user_ids):
+        self.warned.append(sorted(user_ids))
+
+    async def expire(self, user_ids):
+        self.expired.append(sorted(user_ids))
+
+def run_ticks(timer: TokenExpiryTimer, clock: Clock, ticks: int):
+    async def main():
+        for _ in range(ticks):
+            clock.now += timer.tick_seconds
+            await timer.process(timer.wheel.advance())
+    asyncio.run(main())
+
+def test_timer_warns_then_expires_in_batches(clock):
+    recorder = Recorder()
+    timer = TokenExpiryTimer(recorder.warn, recorder.expire, tick_seconds=1, slots=16)
+    timer.renew("alice", 30)
+    timer.renew("bob", 30)
+    run_ticks(timer, clock, 20)
+    assert recorder.warned == [["alice", "bob"]]
+    assert recorder.expired == []
+    run_ticks(timer, clock, 10)
+    assert recorder.expired == [["alice", "bob"]]
+    assert len(timer.wheel) == 0
+
+def test_renew_postpones_and_remove_cancels(clock):
+    recorder = Recorder()
+    timer = TokenExpiryTimer(recorder.warn, recorder.expire, tick_seconds=1, slots=16)
+    timer.renew("alice", 30)
+    timer.renew("bob", 30)
+    run_ticks(timer, clock, 15)
+    timer.renew("alice", 30)
+    timer.remove("bob")
+    run_ticks(timer, clock, 15)
+    assert recorder.warned == []
+    run_ticks(timer, clock, 20)
+    assert recorder.warned == [["alice"]]
+    assert recorder.expired == [["alice"]]
@@ -0,0 +1,90 @@
+import asyncio
+import time
+from typing import Dict, Tuple
+from config import MAX_IN_FLIGHT_PER_CONNECTION, MAX_IN_FLIGHT_GLOBAL, RATE_LIMITS, DEFAULT_RATE_LIMIT
+
+class TokenBucket:
+    """
+    トークンバケットによる流量制限
+    rate(個/秒)でトークンが補充され、capacityまで貯まる
+    """
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def try_acquire(self) -> float:
+        """
+        トークンを一つ消費する
+        消費できた場合は0を、できなかった場合は次のトークンが補充されるまでの秒数を返す
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+class AdmissionController:
+    """
+    ハンドラの実行数の制御(全接続の合計)
+    接続ごとの制御はconnection()で取得するConnectionAdmissionで行う
+    """
+    def __init__(self, max_in_flight: int = MAX_IN_FLIGHT_GLOBAL):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.rejected: Dict[str, int] = {}
+
+    def connection(self) -> "ConnectionAdmission":
+        return ConnectionAdmission(self)
+
+    def record_rejection(self, reason: str):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+
+    def metrics(self) -> Dict[str, object]:
+        return {"in_flight": self.in_flight, "max_in_flight": self.max_in_flight, "rejected": dict(self.rejected)}
+
+class ConnectionAdmission:
+    """
+    接続ごとのハンドラの実行数の制御及びメッセージの種類ごとの流量制限
+    """
+    def __init__(self, controller: AdmissionController, max_in_flight: int = MAX_IN_FLIGHT_PER_CONNECTION):
+        self.controller = controller
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.buckets: Dict[str, TokenBucket] = {}
+
+    def admit(self, message_type: str) -> Tuple[str, int] | None:
+        """
+        ハンドラを実行してよいか判定する
+        実行してよい場合は実行数を加算してNoneを、拒否する場合は(理由, 再試行までのミリ秒)を返す
+        実行してよい場合はハンドラの終了後にrelease()を呼び出すこと
+        """
+        if self.in_flight >= self.max_in_flight:
+            return self.reject("too_many_requests", 100)
+        if self.controller.in_flight >= self.controller.max_in_flight:
+            return self.reject("server_busy", 500)
+        if message_type not in self.buckets:
+            rate, capacity = RATE_LIMITS.get(message_type, DEFAULT_RATE_LIMIT)
+            self.buckets[message_type] = TokenBucket(rate, capacity)
+        wait = self.buckets[message_type].try_acquire()
+        if wait > 0:
+            return self.reject("rate_limited", int(wait * 1000) + 1)
+        self.in_flight += 1
+        self.controller.in_flight += 1
+        return None
+
+    def reject(self, reason: str, retry_after_ms: int) -> Tuple[str, int]:
+        self.controller.record_rejection(reason)
+        return reason, retry_after_ms
+
+    def release(self, task: asyncio.Task | None = None):
+        """
+        ハンドラの終了時に実行数を減算する(タスクの完了時のコールバックとしても使用できる)
+        """
+        self.in_flight -= 1
+        self.controller.in_flight -= 1
+
+admission_controller = AdmissionController()
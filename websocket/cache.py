@@ -0,0 +1,42 @@
+from collections import OrderedDict
+from typing import Callable, Hashable
+import time
+
+class TTLCache:
+    """
+    有効期限付きのLRUキャッシュ
+    max_sizeを超えた場合は最も古く参照した項目から削除し、ttl秒を過ぎた項目は参照時に削除する
+    on_evictを指定した場合は上限・有効期限により削除した項目を(key, value)で通知する(pop()で削除した場合は通知しない)
+    """
+    def __init__(self, max_size: int, ttl: float, on_evict: Callable[[Hashable, object], None] | None = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.items: OrderedDict = OrderedDict()
+
+    def get(self, key: Hashable):
+        item = self.items.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at < time.monotonic():
+            del self.items[key]
+            if self.on_evict is not None:
+                self.on_evict(key, value)
+            return None
+        self.items.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value):
+        self.items[key] = (value, time.monotonic() + self.ttl)
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_size:
+            evicted_key, (evicted, _) = self.items.popitem(last=False)
+            if self.on_evict is not None:
+                self.on_evict(evicted_key, evicted)
+
+    def pop(self, key: Hashable):
+        self.items.pop(key, None)
+
+    def __len__(self):
+        return len(self.items)
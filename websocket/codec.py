@@ -0,0 +1,141 @@
+import base64
+import binascii
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+#接続時(init)に選択できる形式(msgpackはインストールされている場合のみ)
+#jsonはテキストフレーム、msgpackはバイナリフレームで送受信する
+DEFAULT_FORMAT = "json"
+FORMATS = ("json", "msgpack") if msgpack is not None else ("json",)
+
+def negotiate_format(requested) -> str:
+    """
+    クライアントが要求した形式のうち使用できるものを返す(要求がない場合や使用できない場合はjson)
+    """
+    if isinstance(requested, str) and requested in FORMATS:
+        return requested
+    return DEFAULT_FORMAT
+
+def encode_json(message) -> str:
+    """
+    メッセージをwebsocketのテキストフレーム用のJSON文字列にエンコードする
+    orjsonがインストールされている場合はorjsonを使用する(出力はsend_jsonと同じ形式)
+    """
+    if orjson is not None:
+        return orjson.dumps(message).decode("utf-8")
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+def encode_msgpack(message) -> bytes:
+    """
+    メッセージをwebsocketのバイナリフレーム用のMessagePackにエンコードする
+    画像はbase64の文字列ではなくバイナリで送信する(pack_images)
+    """
+    return msgpack.packb(pack_images(message), use_bin_type=True)
+
+#画像のメッセージ({"type": "image", ...})で画像(base64)を持つ項目
+IMAGE_FIELDS = ("image", "content")
+
+def pack_image(item):
+    """画像のメッセージの画像(base64の文字列)をバイナリに変換する(base64として不正な値は変換しない)"""
+    if not (isinstance(item, dict) and item.get("type") == "image"):
+        return item
+    images = {}
+    for field in IMAGE_FIELDS:
+        if isinstance(item.get(field), str):
+            try:
+                images[field] = base64.b64decode(item[field], validate=True)
+            except (binascii.Error, ValueError):
+                pass
+    return {**item, **images} if images else item
+
+def pack_images(message):
+    """
+    フレームのcontent(ReceiveMessageのメッセージ、またはLatest-Message・GetHistoryなどのメッセージのリスト)に含まれる画像をバイナリに変換する
+    MessagePackで送信する場合のみ変換し、JSONは文字列のまま送信する(画像を含まないフレームはコピーせずにそのまま返す)
+    """
+    if not isinstance(message, dict):
+        return message
+    content = message.get("content")
+    if isinstance(content, list):
+        packed = [pack_image(item) for item in content]
+        if any(new is not old for new, old in zip(packed, content)):
+            return {**message, "content": packed}
+    elif isinstance(content, dict):
+        packed = pack_image(content)
+        if packed is not content:
+            return {**message, "content": packed}
+    return message
+
+def encode(message, format: str = DEFAULT_FORMAT, seq: int | None = None) -> str | bytes:
+    """
+    メッセージを指定した形式のフレームにエンコードする
+    messageはdict、Frameまたはエンコード済みのJSON文字列
+    seqを指定した場合はフレームに"seq"を追加する
+    """
+    if isinstance(message, Frame):
+        data = message.encode(format)
+        return data if seq is None else add_seq(data, format, seq)
+    if isinstance(message, str):
+        data = message if format == "json" else encode_msgpack(json.loads(message))
+        return data if seq is None else add_seq(data, format, seq)
+    if seq is not None:
+        message = {**message, "seq": seq}
+    if format == "msgpack":
+        return encode_msgpack(message)
+    return encode_json(message)
+
+def add_seq(data: str | bytes, format: str, seq: int) -> str | bytes:
+    """
+    エンコード済みのフレーム(オブジェクト)に"seq"を追加する
+    共有するFrameをユーザーごとにエンコードし直さないよう、エンコード済みのフレームの末尾に追加する
+    """
+    if format == "msgpack":
+        #要素数15未満のfixmapはヘッダの要素数を増やして末尾に追加する(それ以外はエンコードし直す)
+        if 0x80 <= data[0] < 0x8f:
+            return bytes((data[0] + 1,)) + data[1:] + encode_msgpack("seq") + encode_msgpack(seq)
+        return encode_msgpack({**decode(data), "seq": seq})
+    #空のオブジェクト({})には区切りの","を付けない
+    body = data.rstrip()
+    if not (body.startswith("{") and body.endswith("}")):
+        raise ValueError("Frame is not a JSON object")
+    body = body[:-1].rstrip()
+    separator = "" if body.endswith("{") else ","
+    return f'{body}{separator}"seq":{seq}}}'
+
+def decode(raw_data: str | bytes):
+    """
+    受信したフレームをデコードする(テキストフレームはJSON、バイナリフレームはMessagePack)
+    """
+    if isinstance(raw_data, bytes):
+        if msgpack is None:
+            raise ValueError("MessagePack is not supported")
+        return msgpack.unpackb(raw_data, raw=False)
+    return json.loads(raw_data)
+
+class Frame:
+    """
+    複数の接続に送信するメッセージ
+    形式ごとに最初に必要になった時点で一度だけエンコードし、同じ形式の接続にはエンコード済みのフレームを送信する
+    他のワーカーからエンコード済みのJSON文字列で受け取ったフレームはjson_textに渡す
+    """
+    def __init__(self, message=None, json_text: str | None = None):
+        self.message = message
+        self.encoded = {}
+        if json_text is not None:
+            self.encoded["json"] = json_text
+
+    def encode(self, format: str = DEFAULT_FORMAT) -> str | bytes:
+        if format not in self.encoded:
+            if self.message is None:
+                self.message = json.loads(self.encoded["json"])
+            self.encoded[format] = encode_msgpack(self.message) if format == "msgpack" else encode_json(self.message)
+        return self.encoded[format]
@@ -0,0 +1,128 @@
+from fastapi import WebSocket
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+from typing import Annotated, Awaitable, Callable, Dict, Tuple, Type, Union
+import time
+from pydantic_core import InitErrorDetails
+from websocket.codec import decode
+from websocket.manager import manager
+from websocket.schemas import (
+    ReAuthRequest, SendMessageRequest, CreateRoomRequest, JoinRoomRequest, LeaveRoomRequest,
+    FriendRequest, UnFriendRequest, FocusRequest, UnFocusRequest, GetRoomsInfoRequest,
+    SearchUsersRequest, GetFriendListRequest, GetHistoryRequest)
+from websocket.reauth import ReAuth
+from websocket.sendmessage import SendMessage
+from websocket.room import JoinRoom, CreateRoom, LeaveRoom
+from websocket.friend import Friend, UnFriend, GetFriendList
+from websocket.focus import Focus, UnFocus
+from websocket.getroomsinfo import GetRoomsInfo
+from websocket.searchuser import SearchUsers
+from websocket.gethistory import GetHistory
+
+Handler = Callable[[WebSocket, str, BaseModel], Awaitable[None]]
+
+#メッセージの種類 -> (ハンドラ, 形式)
+#メッセージの種類を追加する場合はここに登録する
+ROUTES: Dict[str, Tuple[Handler, Type[BaseModel]]] = {
+    "ReAuth": (ReAuth, ReAuthRequest),
+    "SendMessage": (SendMessage, SendMessageRequest),
+    "CreateRoom": (CreateRoom, CreateRoomRequest),
+    "JoinRoom": (JoinRoom, JoinRoomRequest),
+    "LeaveRoom": (LeaveRoom, LeaveRoomRequest),
+    "Friend": (Friend, FriendRequest),
+    "UnFriend": (UnFriend, UnFriendRequest),
+    "Focus": (Focus, FocusRequest),
+    "UnFocus": (UnFocus, UnFocusRequest),
+    "GetRoomsInfo": (GetRoomsInfo, GetRoomsInfoRequest),
+    "SearchUsers": (SearchUsers, SearchUsersRequest),
+    "GetFriendList": (GetFriendList, GetFriendListRequest),
+    "GetHistory": (GetHistory, GetHistoryRequest),
+}
+
+#全ての形式をtypeで判別する一つのスキーマにまとめ、起動時に一度だけ構築する
+#受信したJSONはこのスキーマで解析と検証を一度に行う
+request_adapter = TypeAdapter(Annotated[
+    Union[tuple(model for _, model in ROUTES.values())],
+    Field(discriminator="type")])
+
+class ValidationMetrics:
+    """
+    メッセージの種類ごとの検証回数・失敗回数・所要時間
+    """
+    def __init__(self):
+        self.count: Dict[str, int] = {}
+        self.failures: Dict[str, int] = {}
+        self.total_ns: Dict[str, int] = {}
+
+    def record(self, message_type: str, elapsed_ns: int, failed: bool):
+        self.count[message_type] = self.count.get(message_type, 0) + 1
+        self.total_ns[message_type] = self.total_ns.get(message_type, 0) + elapsed_ns
+        if failed:
+            self.failures[message_type] = self.failures.get(message_type, 0) + 1
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {
+            message_type: {
+                "count": count,
+                "failures": self.failures.get(message_type, 0),
+                "mean_us": self.total_ns[message_type] / count / 1000,
+            }
+            for message_type, count in self.count.items()
+        }
+
+validation_metrics = ValidationMetrics()
+
+def parse_request(raw_data: str | bytes) -> BaseModel:
+    """
+    受信したフレームを解析・検証し、メッセージの種類に対応する形式のオブジェクトを返す
+    テキストフレームはJSON、バイナリフレームはMessagePackとして解析する
+    形式が正しくない場合はValidationErrorを送出する(MessagePackとして解析できない場合もjson_invalidとする)
+    """
+    start = time.perf_counter_ns()
+    try:
+        if isinstance(raw_data, bytes):
+            try:
+                data = decode(raw_data)
+            except Exception as e:
+                raise ValidationError.from_exception_data("Request", [InitErrorDetails(type="json_invalid", loc=(), input=raw_data, ctx={"error": str(e)})])
+            request = request_adapter.validate_python(data)
+        else:
+            request = request_adapter.validate_json(raw_data)
+    except ValidationError as e:
+        validation_metrics.record(error_message_type(e), time.perf_counter_ns() - start, True)
+        raise
+    validation_metrics.record(request.type, time.perf_counter_ns() - start, False)
+    return request
+
+def error_message_type(error: ValidationError) -> str:
+    """
+    検証エラーからメッセージの種類を求める(判別できない場合は"invalid")
+    判別できた種類の内容の形式が正しくない場合、エラーの位置の先頭がメッセージの種類になる
+    """
+    for detail in error.errors():
+        if detail["loc"] and detail["loc"][0] in ROUTES:
+            return detail["loc"][0]
+    return "invalid"
+
+async def reply_validation_error(ws: WebSocket, raw_data: str | bytes, error: ValidationError):
+    """
+    形式が正しくないメッセージに対してエラーを返す
+    """
+    error_types = {detail["type"] for detail in error.errors()}
+    if "json_invalid" in error_types:
+        await manager.send_personal_message({"type":"Error","content":{"message":"Invalid message format"}}, ws)
+        return
+    #応答に含めるidと種類を取得するため、エラーの場合のみ改めて解析する
+    data = decode(raw_data)
+    if not isinstance(data, dict) or not "type" in data.keys():
+        await manager.send_personal_message({"type":"Error","content":{"message":"Invalid json key"}}, ws)
+    elif any(detail["type"] == "union_tag_invalid" and not detail["loc"] for detail in error.errors()):
+        #typeが登録されていない場合(contentの中の判別に失敗した場合は形式のエラーとする)
+        await manager.send_personal_message({"id":data.get("id"),"type":f"reply-{data['type']}","content":{"message":"Invalid message type"}}, ws)
+    elif any(detail["type"] == "missing" and len(detail["loc"]) == 2 for detail in error.errors()):
+        #id又はcontentがない場合
+        await manager.send_personal_message({"type":f"reply-{data['type']}","content":{"message":"Invalid json key"}}, ws)
+    else:
+        await manager.send_personal_message({"id":data.get("id"),"type":f"reply-{data['type']}","content":{"message":"Invalid message format"}}, ws)
+
+def get_handler(request: BaseModel) -> Handler:
+    return ROUTES[request.type][0]
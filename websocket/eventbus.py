@@ -0,0 +1,176 @@
+from abc import ABC, abstractmethod
+import asyncio
+import json
+from typing import Awaitable, Callable, Dict, List
+from uuid import uuid4
+import psycopg
+from psycopg import sql
+from database.database import async_database
+from config import DATABASE_CONNINFO, EVENT_BUS_BACKEND, EVENT_BUS_CHANNEL, EVENT_PAYLOAD_TTL_SECONDS
+
+NOTIFY_PAYLOAD_LIMIT = 7900 #NOTIFYのペイロードの上限(8000バイト)より小さい値
+
+EventHandler = Callable[[Dict], Awaitable[None]]
+
+class EventBus(ABC):
+    """
+    ワーカー間でイベントを配送するイベントバス
+    publish()したイベントは他のワーカーのハンドラに配送される(発行したワーカー自身には配送しない)
+    publish()はキューに追加するだけで返り、送信は送信タスクがまとめて行う
+    """
+    def __init__(self):
+        self.node_id = str(uuid4())
+        self.handler: EventHandler | None = None
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.publish_task: asyncio.Task | None = None
+
+    async def start(self, handler: EventHandler):
+        self.handler = handler
+        self.publish_task = asyncio.create_task(self.run_publisher())
+
+    async def stop(self):
+        if self.publish_task is not None:
+            self.publish_task.cancel()
+            self.publish_task = None
+
+    def publish(self, event: Dict):
+        event["origin"] = self.node_id
+        #同じトランザクション内の同じ内容のNOTIFYは一つにまとめられるため、イベントごとにIDを付与する
+        event["event_id"] = str(uuid4())
+        self.queue.put_nowait(event)
+
+    async def run_publisher(self):
+        """
+        キューのイベントをまとめて送信する
+        """
+        while True:
+            events = [await self.queue.get()]
+            while not self.queue.empty():
+                events.append(self.queue.get_nowait())
+            try:
+                await self.send(events)
+            except Exception as e:
+                print(f"Error publishing events: {e}")
+
+    @abstractmethod
+    async def send(self, events: List[Dict]):
+        """
+        イベントを他のワーカーに送信する(バックエンドごとに実装する)
+        """
+
+    async def deliver(self, event: Dict):
+        """
+        受信したイベントをハンドラに渡す(自身が発行したイベントは無視する)
+        """
+        if event.get("origin") == self.node_id or self.handler is None:
+            return
+        try:
+            await self.handler(event)
+        except Exception as e:
+            print(f"Error handling event: {e}")
+
+class InProcessEventBus(EventBus):
+    """
+    同一プロセス内のイベントバス(テスト用、tests/test_eventbus.py)
+    同じhubを共有するインスタンス間でイベントを配送するため、一つのプロセス内で複数のワーカーを模擬できる
+    """
+    def __init__(self, hub: List["InProcessEventBus"] | None = None):
+        super().__init__()
+        self.hub = hub if hub is not None else []
+        self.hub.append(self)
+
+    async def send(self, events: List[Dict]):
+        for event in events:
+            #ワーカー間の配送と同じくJSONを経由させる
+            payload = json.dumps(event)
+            for bus in list(self.hub):
+                await bus.deliver(json.loads(payload))
+
+    async def stop(self):
+        await super().stop()
+        if self in self.hub:
+            self.hub.remove(self)
+
+class PostgresEventBus(EventBus):
+    """
+    PostgreSQLのLISTEN/NOTIFYを使用するイベントバス
+    NOTIFYのペイロードの上限を超えるイベントはevent_payloadsテーブルに保存し、IDのみを通知する
+    """
+    def __init__(self, conninfo: str = DATABASE_CONNINFO, channel: str = EVENT_BUS_CHANNEL):
+        super().__init__()
+        self.conninfo = conninfo
+        self.channel = channel
+        self.listen_task: asyncio.Task | None = None
+
+    async def start(self, handler: EventHandler):
+        await super().start(handler)
+        self.listen_task = asyncio.create_task(self.listen())
+
+    async def stop(self):
+        await super().stop()
+        if self.listen_task is not None:
+            self.listen_task.cancel()
+            self.listen_task = None
+
+    async def listen(self):
+        """
+        LISTEN用の専用の接続で通知を受信する(接続が切れた場合は再接続する)
+        """
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(self.conninfo, autocommit=True) as conn:
+                    await conn.execute(sql.SQL("LISTEN {}").format(sql.Identifier(self.channel)))
+                    async for notify in conn.notifies():
+                        event = json.loads(notify.payload)
+                        if event.get("origin") == self.node_id:
+                            continue
+                        if "payload_id" in event:
+                            event = await self.load_payload(event["payload_id"])
+                            if event is None:
+                                continue
+                        await self.deliver(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error listening events: {e}")
+                await asyncio.sleep(1)
+
+    async def send(self, events: List[Dict]):
+        """
+        イベントを一つのトランザクションで通知する(コミット時に配送される)
+        """
+        async with async_database.get_connection() as conn:
+            stored = False
+            for event in events:
+                payload = json.dumps(event, ensure_ascii=False)
+                if len(payload.encode("utf-8")) > NOTIFY_PAYLOAD_LIMIT:
+                    payload_id = event["event_id"]
+                    await conn.execute("INSERT INTO event_payloads (id, payload) VALUES (%s, %s)", [payload_id, payload])
+                    payload = json.dumps({"payload_id": payload_id, "origin": event["origin"]})
+                    stored = True
+                await conn.execute("SELECT pg_notify(%s, %s)", [self.channel, payload])
+            if stored:
+                #全てのワーカーが読み終えた古いペイロードを削除する
+                await conn.execute("DELETE FROM event_payloads WHERE created_at < now() - make_interval(secs => %s)", [EVENT_PAYLOAD_TTL_SECONDS])
+
+    async def load_payload(self, payload_id: str) -> Dict | None:
+        async with async_database.get_connection() as conn:
+            cursor = await conn.execute("SELECT payload FROM event_payloads WHERE id = %s", [payload_id])
+            row = await cursor.fetchone()
+        if row is None:
+            print(f"Event payload not found: {payload_id}")
+            return None
+        return json.loads(row[0])
+
+def create_event_bus(backend: str = EVENT_BUS_BACKEND) -> EventBus | None:
+    """
+    config.pyの設定に応じたイベントバスを生成する
+    "none"の場合はNoneを返す(ワーカーが一つの場合はイベントを送信しない)
+    """
+    if backend == "none":
+        return None
+    if backend == "postgres":
+        return PostgresEventBus()
+    elif backend == "inprocess":
+        return InProcessEventBus()
+    raise ValueError(f"Invalid event bus backend: {backend}")
@@ -2,92 +2,41 @@ from fastapi import WebSocket
 from typing import Dict
 from datetime import datetime, timedelta
 import pytz
-from database.database import database
-from psycopg.rows import dict_row
 from websocket.manager import manager
+from websocket.readposition import read_positions
+from websocket.schemas import FocusRequest, UnFocusRequest
 
 
-async def Focus(ws: WebSocket, user_id: str, data: Dict):
+async def Focus(ws: WebSocket, user_id: str, data: FocusRequest):
     """
     ルームへのフォーカス(画面にルームのチャットが表示されている状態)を処理する
+    既読位置はread_positionsに記録し、まとめてデータベースに書き込む
     """
-    def msg_key_check(data: Dict):
-        content = data["content"]
-        if (not "roomid" in content.keys()):
-            raise KeyError
-    
-    try:
-        msg_key_check(data)
-    except Exception as e:
-        await manager.send_personal_message({"id":data["id"],"type":"reply-Focus","content":{"message":"Invalid message format"}}, ws)
-        return
-
-    try:
-        with database.get_connection() as conn:
-            with conn.cursor(row_factory=dict_row) as cursor:
-                room_participants = database.fetch(cursor,"room_participants", {"id": data["content"]["roomid"]})
-                if room_participants == []:
-                    await manager.send_personal_message({"id":data["id"],"type":"reply-Focus","content":{"message":"Room not found"}}, ws)
-                    return
-                
-                cursor.execute("BEGIN")
-                if not database.update(cursor,"room_participants", 
-                                {"last_viewed_at": pytz.timezone('Asia/Tokyo').localize(datetime.now())+timedelta(hours=9)},
-                                {"id": data["content"]["roomid"],"user_id":user_id}):
-                    raise Exception
-                conn.commit()
-                if user_id in manager.focus_room and manager.focus_room[user_id] == data["content"]["roomid"]:
-                    await manager.send_personal_message({"id":data["id"],"type":"reply-Focus","content":{"message":"Already focused"}}, ws)
-                else:
-                    manager.focus_room[user_id] = data["content"]["roomid"]
-                    await manager.send_personal_message({"id":data["id"],"type":"reply-Focus","content":{"message":"Focused"}}, ws)
-    except Exception as e:
-        print(f"Error fetching room data: {e}")
-        if conn:
-            conn.rollback()
-            print("rollback")
-        await manager.send_personal_message({"id":data["id"],"type":"reply-Focus","content":{"message":"Error fetching room data"}}, ws)
+    #参加しているルームか(接続時に読み込んだルームの参加者のインデックスを参照し、ない場合のみデータベースを参照する)
+    if not await manager.is_room_member(data.content.roomid, user_id):
+        await manager.send_personal_message({"id":data.id,"type":"reply-Focus","content":{"message":"Room not found"}}, ws)
         return
+    
+    read_positions.mark(data.content.roomid, user_id, pytz.timezone('Asia/Tokyo').localize(datetime.now())+timedelta(hours=9))
+    if user_id in manager.focus_room and manager.focus_room[user_id] == data.content.roomid:
+        await manager.send_personal_message({"id":data.id,"type":"reply-Focus","content":{"message":"Already focused"}}, ws)
+    else:
+        manager.focus_room[user_id] = data.content.roomid
+        await manager.send_personal_message({"id":data.id,"type":"reply-Focus","content":{"message":"Focused"}}, ws)
 
-async def UnFocus(ws: WebSocket, user_id: str, data: Dict):
+async def UnFocus(ws: WebSocket, user_id: str, data: UnFocusRequest):
     """
     ルームからのフォーカス解除(画面にルームのチャットが表示されていない状態)を処理する
+    既読位置はread_positionsに記録し、まとめてデータベースに書き込む
     """
-    def msg_key_check(data: Dict):
-        content = data["content"]
-        if (not "roomid" in content.keys()):
-            raise KeyError
+    #参加しているルームか(接続時に読み込んだルームの参加者のインデックスを参照し、ない場合のみデータベースを参照する)
+    if not await manager.is_room_member(data.content.roomid, user_id):
+        await manager.send_personal_message({"id":data.id,"type":"reply-UnFocus","content":{"message":"Room not found"}}, ws)
+        return
     
-    try:
-        msg_key_check(data)
-    except Exception as e:
-        await manager.send_personal_message({"id":data["id"],"type":"reply-UnFocus","content":{"message":"Invalid message format"}}, ws)
+    if (user_id in manager.focus_room and manager.focus_room[user_id] == "")or(not user_id in manager.focus_room):
+        await manager.send_personal_message({"id":data.id,"type":"reply-UnFocus","content":{"message":"Already unfocused"}}, ws)
         return
-
-    try:
-        with database.get_connection() as conn:
-            with conn.cursor(row_factory=dict_row) as cursor:
-                room_participants = database.fetch(cursor,"room_participants", {"id": data["content"]["roomid"]})
-                if room_participants == []:
-                    await manager.send_personal_message({"id":data["id"],"type":"reply-UnFocus","content":{"message":"Room not found"}}, ws)
-                    return
-                
-                if (user_id in manager.focus_room and manager.focus_room[user_id] == "")or(not user_id in manager.focus_room):
-                    await manager.send_personal_message({"id":data["id"],"type":"reply-UnFocus","content":{"message":"Already unfocused"}}, ws)
-                    return
-                elif user_id in manager.focus_room and manager.focus_room[user_id] != "":
-                    cursor.execute("BEGIN")
-                    if not database.update(cursor,"room_participants", 
-                                    {"last_viewed_at": pytz.timezone('Asia/Tokyo').localize(datetime.now())+timedelta(hours=9)},
-                                    {"id": manager.focus_room[user_id],"user_id":user_id}):
-                        raise Exception
-                    manager.focus_room[user_id] = ""
-                    conn.commit()
-                await manager.send_personal_message({"id":data["id"],"type":"reply-UnFocus","content":{"message":"Unfocused"}}, ws)
-    except Exception as e:
-        print(f"Error fetching room data: {e}")
-        if conn:
-            conn.rollback()
-            print("rollback")
-        await manager.send_personal_message({"id":data["id"],"type":"reply-UnFocus","content":{"message":"Error fetching room data"}}, ws)
-        return
\ No newline at end of file
+    read_positions.mark(manager.focus_room[user_id], user_id, pytz.timezone('Asia/Tokyo').localize(datetime.now())+timedelta(hours=9))
+    manager.focus_room[user_id] = ""
+    await manager.send_personal_message({"id":data.id,"type":"reply-UnFocus","content":{"message":"Unfocused"}}, ws)
@@ -1,184 +1,158 @@
 from fastapi import WebSocket
 from typing import Dict
-from database.database import database
+from database.database import async_database
 from psycopg.rows import dict_row
 from websocket.manager import manager
+from websocket.schemas import FriendRequest, UnFriendRequest, GetFriendListRequest
+from websocket.friendrequests import friend_requests
 
-async def Friend(ws: WebSocket, user_id: str, data: Dict):
+async def Friend(ws: WebSocket, user_id: str, data: FriendRequest):
     """
     友達申請リクエストを処理する
     """
-    def msg_key_check(data: Dict):
-        content = data["content"]
-        if (not "friend_id" in content.keys()):
-            raise KeyError
-    
     async def is_friend(user_id: str, friend_id: str) -> bool:
         """
         既に友達か確認する
         """
         try:
-            with database.get_connection() as conn:
-                with conn.cursor(row_factory=dict_row) as cursor:
-                    is_friend = database.fetch(cursor,"friendships", {"id": user_id, "friend_id": friend_id})
-                    if is_friend == []:
-                        return False
-                    else:
-                        await manager.send_personal_message({"id":data["id"],"type":"reply-Friend","content":{"message":"Already friend"}}, ws)
-                        return True
+            async with async_database.get_connection() as conn:
+                async with conn.cursor(row_factory=dict_row) as cursor:
+                    is_friend = await async_database.fetch(cursor,"friendships", {"id": user_id, "friend_id": friend_id})
+            if is_friend == []:
+                return False
+            else:
+                await manager.send_personal_message({"id":data.id,"type":"reply-Friend","content":{"message":"Already friend"}}, ws)
+                return True
         except Exception as e:
             print(f"Error checking is friend: {e}")
-            await manager.send_personal_message({"id":data["id"],"type":"reply-Friend","content":{"message":"Error checking is friend"}}, ws)
+            await manager.send_personal_message({"id":data.id,"type":"reply-Friend","content":{"message":"Error checking is friend"}}, ws)
             return False
 
-    try:
-        msg_key_check(data)
-    except Exception as e:
-        await manager.send_personal_message({"id":data["id"],"type":"reply-Friend","content":{"message":"Invalid message format"}}, ws)
-        return
-    
     #自分自身に対するリクエストは無効
-    if user_id == data["content"]["friend_id"]:
-        await manager.send_personal_message({"id":data["id"],"type":"reply-Friend","content":{"message":"Invalid friend_id"}}, ws)
+    if user_id == data.content.friend_id:
+        await manager.send_personal_message({"id":data.id,"type":"reply-Friend","content":{"message":"Invalid friend_id"}}, ws)
         return
     
     #相手ユーザーが存在するか
     try:
-        with database.get_connection() as conn:
-            with conn.cursor(row_factory=dict_row) as cursor:
-                friend = database.fetch(cursor,"users", {"id": data["content"]["friend_id"]})
-                if friend == []:
-                    await manager.send_personal_message({"id":data["id"],"type":"reply-Friend","content":{"message":"Friend not found"}}, ws)
-                    return
+        async with async_database.get_connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cursor:
+                friend = await async_database.fetch(cursor,"users", {"id": data.content.friend_id})
+        if friend == []:
+            await manager.send_personal_message({"id":data.id,"type":"reply-Friend","content":{"message":"Friend not found"}}, ws)
+            return
     except Exception as e:
         print(f"Error fetching friend data: {e}")
-        await manager.send_personal_message({"id":data["id"],"type":"reply-Friend","content":{"message":"Error fetching friend data"}}, ws)
+        await manager.send_personal_message({"id":data.id,"type":"reply-Friend","content":{"message":"Error fetching friend data"}}, ws)
         return
     
     #既に友達であるか否か
-    if await is_friend(user_id, data["content"]["friend_id"]):
+    if await is_friend(user_id, data.content.friend_id):
         return
     
-    is_send = False
-    is_recv_request = False
-
-    async with manager.lock:
-        if data["content"]["friend_id"] in manager.friend_requests:
-            is_send = user_id in manager.friend_requests[data["content"]["friend_id"]]
-        else:
-            manager.friend_requests[data["content"]["friend_id"]] = set()
-        if user_id in manager.friend_requests:
-            is_recv_request = data["content"]["friend_id"] in manager.friend_requests[user_id]
-        else:
-            manager.friend_requests[user_id] = set()
+    #既に友達申請を送っているか、相手から友達申請を受け取っているか
+    try:
+        async with async_database.get_connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cursor:
+                is_send = user_id in await friend_requests.get_requests(data.content.friend_id, cursor)
+                is_recv_request = data.content.friend_id in await friend_requests.get_requests(user_id, cursor)
+    except Exception as e:
+        print(f"Error fetching friend request data: {e}")
+        await manager.send_personal_message({"id":data.id,"type":"reply-Friend","content":{"message":"Error fetching friend data"}}, ws)
+        return
     
     #既に友達申請を送っている場合
     if is_send:
-        await manager.send_personal_message({"id":data["id"],"type":"reply-Friend","content":{"message":"Already sent friend request"}}, ws)
+        await manager.send_personal_message({"id":data.id,"type":"reply-Friend","content":{"message":"Already sent friend request"}}, ws)
         return
     
     #友達申請を受け取っている場合は友達登録
     if is_recv_request:
         try:
-            with database.get_connection() as conn:
-                with conn.cursor(row_factory=dict_row) as cursor:
-                    cursor.execute("BEGIN")
-                    if (database.insert(cursor,"friendships", {"id": user_id, "friend_id": data["content"]["friend_id"]}) and
-                        database.insert(cursor,"friendships", {"id": data["content"]["friend_id"], "friend_id": user_id})):
-                        conn.commit()
-                        manager.friend_requests[user_id].remove(data["content"]["friend_id"])
-                        if data["content"]["friend_id"] in manager.active_connections:
-                            friend_ws = manager.active_connections[data["content"]["friend_id"]]
-                            await manager.send_personal_message({"type":"Friend","content":user_id},friend_ws)
-                        await manager.send_personal_message({"id":data["id"],"type":"reply-Friend","content":{"message":"Friend is made"}}, ws)
-                    else:
-                        raise Exception
+            #送信処理はコミットして接続を返却した後に行う
+            async with async_database.unit_of_work() as uow:
+                if (await async_database.insert(uow.cursor,"friendships", {"id": user_id, "friend_id": data.content.friend_id}) and
+                    await async_database.insert(uow.cursor,"friendships", {"id": data.content.friend_id, "friend_id": user_id}) and
+                    await friend_requests.remove(uow, user_id, data.content.friend_id)):
+                    uow.after_commit(manager.send_to_user, {"type":"Friend","content":user_id}, data.content.friend_id)
+                    uow.after_commit(manager.send_personal_message, {"id":data.id,"type":"reply-Friend","content":{"message":"Friend is made"}}, ws)
+                else:
+                    raise Exception
         except Exception as e:
             print(f"Error making friend: {e}")
-            if conn:
-                conn.rollback()
-                print("transaction rollback")
-            await manager.send_personal_message({"id":data["id"],"type":"reply-Friend","content":{"message":"Error making friend"}}, ws)
+            print("transaction rollback")
+            await manager.send_personal_message({"id":data.id,"type":"reply-Friend","content":{"message":"Error making friend"}}, ws)
             return
     #申請を受け取っていない場合は友達申請を送る
     else:
-        async with manager.lock:
-            manager.friend_requests[data["content"]["friend_id"]].add(user_id)
-            #websocket通信中なら通知
-            if data["content"]["friend_id"] in manager.active_connections:
-                friend_ws = manager.active_connections[data["content"]["friend_id"]]
+        try:
+            async with async_database.unit_of_work() as uow:
+                #同時に申請した場合は一方のみ保存される
+                if not await friend_requests.add(uow, data.content.friend_id, user_id):
+                    uow.after_commit(manager.send_personal_message, {"id":data.id,"type":"reply-Friend","content":{"message":"Already sent friend request"}}, ws)
+                    return
+                #websocket通信中なら通知(他のワーカーに接続している場合はイベントバスを経由する)
                 id_list = []
                 id_list.append(user_id)
-                await manager.send_personal_message({"type":"FriendRequest","content":id_list},friend_ws)
-            await manager.send_personal_message({"id":data["id"],"type":"reply-Friend","content":{"message":"Friend request sent"}}, ws)
+                uow.after_commit(manager.send_to_user, {"type":"FriendRequest","content":id_list}, data.content.friend_id)
+                uow.after_commit(manager.send_personal_message, {"id":data.id,"type":"reply-Friend","content":{"message":"Friend request sent"}}, ws)
+        except Exception as e:
+            print(f"Error sending friend request: {e}")
+            print("transaction rollback")
+            await manager.send_personal_message({"id":data.id,"type":"reply-Friend","content":{"message":"Error sending friend request"}}, ws)
+            return
 
-async def UnFriend(ws: WebSocket, user_id: str, data: Dict):
+async def UnFriend(ws: WebSocket, user_id: str, data: UnFriendRequest):
     """
     友達解除リクエストを処理する
     """
-    def msg_key_check(data: Dict):
-        content = data["content"]
-        if (not "friend_id" in content.keys()):
-            raise KeyError
-    
-    try:
-        msg_key_check(data)
-    except Exception as e:
-        await manager.send_personal_message({"id":data["id"],"type":"reply-UnFriend","content":{"message":"Invalid message format"}}, ws)
-        return
     
     #自分自身に対するリクエストは無効
-    if user_id == data["content"]["friend_id"]:
-        await manager.send_personal_message({"id":data["id"],"type":"reply-UnFriend","content":{"message":"Invalid friend_id"}}, ws)
+    if user_id == data.content.friend_id:
+        await manager.send_personal_message({"id":data.id,"type":"reply-UnFriend","content":{"message":"Invalid friend_id"}}, ws)
         return
 
     try:
-        with database.get_connection() as conn:
-            with conn.cursor(row_factory=dict_row) as cursor:
-                #相手ユーザーが存在するか
-                friend_data = database.fetch(cursor,"users", {"id": data["content"]["friend_id"]})
-                if friend_data == []:
-                    await manager.send_personal_message({"id":data["id"],"type":"reply-UnFriend","content":{"message":"Friend not found"}}, ws)
-                    return
-                
-                #友達であるか否か
-                is_friend = database.fetch(cursor,"friendships", {"id": user_id, "friend_id": data["content"]["friend_id"]})
-                if is_friend == []:
-                    await manager.send_personal_message({"id":data["id"],"type":"reply-UnFriend","content":{"message":"Not friend"}}, ws)
-                    return
-                
-                #友達解除
-                cursor.execute("BEGIN")
-                if (database.delete(cursor,"friendships", {"id": user_id, "friend_id": data["content"]["friend_id"]}) and
-                    database.delete(cursor,"friendships", {"id": data["content"]["friend_id"], "friend_id": user_id})):
-                    await manager.send_personal_message({"id":data["id"],"type":"reply-UnFriend","content":{"message":"Friend is removed"}}, ws)
-                    conn.commit()
-                else:
-                    raise Exception
+        #送信処理はコミットして接続を返却した後に行う
+        async with async_database.unit_of_work() as uow:
+            #相手ユーザーが存在するか
+            friend_data = await async_database.fetch(uow.cursor,"users", {"id": data.content.friend_id})
+            if friend_data == []:
+                uow.after_commit(manager.send_personal_message, {"id":data.id,"type":"reply-UnFriend","content":{"message":"Friend not found"}}, ws)
+                return
+            
+            #友達であるか否か
+            is_friend = await async_database.fetch(uow.cursor,"friendships", {"id": user_id, "friend_id": data.content.friend_id})
+            if is_friend == []:
+                uow.after_commit(manager.send_personal_message, {"id":data.id,"type":"reply-UnFriend","content":{"message":"Not friend"}}, ws)
+                return
+            
+            #友達解除
+            if (await async_database.delete(uow.cursor,"friendships", {"id": user_id, "friend_id": data.content.friend_id}) and
+                await async_database.delete(uow.cursor,"friendships", {"id": data.content.friend_id, "friend_id": user_id})):
+                uow.after_commit(manager.send_personal_message, {"id":data.id,"type":"reply-UnFriend","content":{"message":"Friend is removed"}}, ws)
+            else:
+                raise Exception
     except Exception as e:
         print(f"Error unfriending: {e}")
-        if conn:
-            conn.rollback()
-            print("transaction rollback")
-        await manager.send_personal_message({"id":data["id"],"type":"reply-UnFriend","content":{"message":"Error unfriending"}}, ws)
+        print("transaction rollback")
+        await manager.send_personal_message({"id":data.id,"type":"reply-UnFriend","content":{"message":"Error unfriending"}}, ws)
         return
 
-async def GetFriendList(ws: WebSocket, user_id: str, data: Dict):
+async def GetFriendList(ws: WebSocket, user_id: str, data: GetFriendListRequest):
     """
     友達リスト取得リクエストを処理する
     """
     try:
-        with database.get_connection() as conn:
-            with conn.cursor(row_factory=dict_row) as cursor:
-                friends = database.fetch(cursor,"friendships", {"id": user_id})
-                friend_list = []
-                for friend in friends:
-                    friend_list.append(str(friend["friend_id"]))
-                friend_request_list = []
-                if user_id in manager.friend_requests:
-                    for req in manager.friend_requests[user_id]:
-                        friend_request_list.append(str(req))
-                await manager.send_personal_message({"id":data["id"],"type":"reply-GetFriendList","content":{"friend":friend_list,"request":friend_request_list}}, ws)
+        async with async_database.get_connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cursor:
+                friends = await async_database.fetch(cursor,"friendships", {"id": user_id})
+                requests = await friend_requests.get_requests(user_id, cursor)
+        friend_list = []
+        for friend in friends:
+            friend_list.append(str(friend["friend_id"]))
+        friend_request_list = list(requests)
+        await manager.send_personal_message({"id":data.id,"type":"reply-GetFriendList","content":{"friend":friend_list,"request":friend_request_list}}, ws)
     except Exception as e:
-        await manager.send_personal_message({"id":data["id"],"type":"reply-GetFriendList","content":{"message":"Error fetching friend data"}}, ws)
+        await manager.send_personal_message({"id":data.id,"type":"reply-GetFriendList","content":{"message":"Error fetching friend data"}}, ws)
         print(f"Error fetching friend data: {e}")
\ No newline at end of file
@@ -0,0 +1,75 @@
+from typing import Dict, Set
+from config import FRIEND_REQUEST_CACHE_SIZE, FRIEND_REQUEST_CACHE_TTL_SECONDS
+from database.database import async_database
+from psycopg.rows import dict_row
+from websocket.manager import manager
+from websocket.cache import TTLCache
+
+class FriendRequestStore:
+    """
+    承認待ちの友達申請
+    friend_requestsテーブルを正とし、ユーザーごとの受け取った申請をTTLCacheに保持する
+    申請を追加・削除した場合はコミット後にキャッシュを無効化し、イベントバスで他のワーカーのキャッシュも無効化する
+    """
+    def __init__(self, max_size: int = FRIEND_REQUEST_CACHE_SIZE, ttl: float = FRIEND_REQUEST_CACHE_TTL_SECONDS):
+        self.cache = TTLCache(max_size, ttl)
+        #無効化の回数(取得中に無効化された場合に古い内容をキャッシュしないために使用する)
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def get_requests(self, user_id: str, cursor=None) -> Set[str]:
+        """
+        user_idが受け取った友達申請の申請者のIDの集合を返す
+        cursorを省略した場合は接続プールから接続を取得する
+        """
+        requests = self.cache.get(user_id)
+        if requests is not None:
+            self.hits += 1
+            return requests
+        self.misses += 1
+        generation = self.generation
+        if cursor is None:
+            async with async_database.get_connection() as conn:
+                async with conn.cursor(row_factory=dict_row) as cursor:
+                    rows = await async_database.fetch(cursor, "friend_requests", {"user_id": user_id})
+        else:
+            rows = await async_database.fetch(cursor, "friend_requests", {"user_id": user_id})
+        requests = frozenset(str(row["requester_id"]) for row in rows)
+        if generation == self.generation:
+            self.cache.set(user_id, requests)
+        return requests
+
+    async def add(self, uow, user_id: str, requester_id: str) -> bool:
+        """
+        requester_idからuser_idへの友達申請を保存する(既に申請済みの場合はFalse)
+        """
+        inserted = await async_database.insert_friend_request(uow.cursor, user_id, requester_id)
+        if inserted:
+            uow.after_commit(self.invalidate, user_id)
+        return inserted
+
+    async def remove(self, uow, user_id: str, requester_id: str) -> bool:
+        """
+        requester_idからuser_idへの友達申請を削除する
+        """
+        if not await async_database.delete(uow.cursor, "friend_requests", {"user_id": user_id, "requester_id": requester_id}):
+            return False
+        uow.after_commit(self.invalidate, user_id)
+        return True
+
+    def invalidate(self, user_id: str, publish: bool = True):
+        self.cache.pop(user_id)
+        self.generation += 1
+        if publish:
+            manager.publish({"type":"friend_request","user_id":user_id})
+
+    def handle_event(self, event: Dict):
+        """他のワーカーで申請が変更された場合にキャッシュを無効化する"""
+        self.invalidate(event["user_id"], publish=False)
+
+    def metrics(self) -> Dict[str, int]:
+        return {"size": len(self.cache), "hits": self.hits, "misses": self.misses}
+
+friend_requests = FriendRequestStore()
+manager.register_event_handler("friend_request", friend_requests.handle_event)
@@ -0,0 +1,39 @@
+from fastapi import WebSocket
+from typing import Dict
+from config import HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE
+from database.database import async_database
+from psycopg.rows import dict_row
+from websocket.manager import manager
+from websocket.schemas import GetHistoryRequest
+
+async def GetHistory(ws: WebSocket, user_id: str, data: GetHistoryRequest):
+    """
+    メッセージ履歴の取得リクエストを処理する
+    content: {"roomid": ルームID, "cursor": 前のページのnext(省略時は最新のページ), "limit": 件数(省略可)}
+    """
+    limit = min(data.content.limit or HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE)
+    before = data.content.cursor.model_dump() if data.content.cursor is not None else None
+    #ルームに参加しているか(オンラインのユーザーのルームはインデックスで管理し、インデックスにない場合のみデータベースを参照する)
+    if not await manager.is_room_member(data.content.roomid, user_id):
+        await manager.send_personal_message({"id":data.id,"type":"reply-GetHistory","content":{"message":"User not in room"}}, ws)
+        return
+
+    try:
+        async with async_database.get_connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cursor:
+                #次のページの有無を確認するため1件多く取得
+                messages = await async_database.fetch_message_history(cursor, data.content.roomid, limit+1, before)
+    except Exception as e:
+        print(f"Error fetching message data: {e}")
+        await manager.send_personal_message({"id":data.id,"type":"reply-GetHistory","content":{"message":"Error fetching message data"}}, ws)
+        return
+
+    next_cursor = None
+    if len(messages) > limit:
+        messages.pop(limit)
+        next_cursor = {"created_at":str(messages[-1]["created_at"]),"id":messages[-1]["id"]}
+    for message in messages:
+        message["created_at"] = str(message["created_at"])
+    #古い順に並べて送信(次のページのカーソルはreply-SearchUsersと同様にcontentの外のnextに設定する)
+    messages.reverse()
+    await manager.send_personal_message({"id":data.id,"type":"reply-GetHistory","content":messages,"next":next_cursor}, ws)
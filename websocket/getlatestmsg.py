@@ -1,39 +1,43 @@
 from fastapi import WebSocket
 from typing import Dict
-from datetime import datetime, timedelta
-import pytz
-from database.database import database
+from config import UNREAD_BACKLOG_LIMIT, UNREAD_CHUNK_SIZE, UNREAD_MAX_QUEUED_FRAMES
+from database.database import async_database
 from psycopg.rows import dict_row
 from websocket.manager import manager
+from websocket.friendrequests import friend_requests
+from websocket.readposition import read_positions
 
 async def get_latest_message(ws: WebSocket, user_id: str):
     """
     最新のメッセージ(未読のメッセージ)を取得し送信する
     """
     # ユーザーが参加しているルームの最新のメッセージを送信
-    message = []
+    #未読メッセージはUNREAD_CHUNK_SIZE件ずつ(ルームID, 作成日時, ID)のキーセットで取得し、フレームに分けて送信する
+    #チャンクごとに接続を取得して返却するため、送信キューが空くのを待つ間(クライアントの受信速度に依存する)は接続もトランザクションも保持しない
+    #送信キューにUNREAD_MAX_QUEUED_FRAMESを超えるフレームがある間は次の取得を待つため、未読の件数によらず保持するメッセージは一定になる
+    #最後に送信した件数を含むLatest-Message-Endを送信する
+    count = 0
+    after = None
     try:
-        with database.get_connection() as conn:
-            with conn.cursor(row_factory=dict_row) as cursor:
-                join_rooms = database.fetch(cursor, "room_participants", {"user_id": user_id})
-                if join_rooms == []:
-                    return
-                room_ids = [str(room["id"]) for room in join_rooms]
-                rooms_last_viewed_at = {str(room["id"]): room["last_viewed_at"] for room in join_rooms}
-                for room_id in room_ids:
-                    latest_message = database.fetch_after_datetime(cursor, "messages", {"room_id":room_id},"created_at", str(rooms_last_viewed_at[room_id]))
-                    if latest_message == []:
-                        continue
-                    for i in range(len(latest_message)):
-                        latest_message[i]["id"] = str(latest_message[i]["id"])
-                        latest_message[i]["room_id"] = str(latest_message[i]["room_id"])
-                        latest_message[i]["sender_id"] = str(latest_message[i]["sender_id"])
-                        latest_message[i]["created_at"] = str(latest_message[i]["created_at"])
-                    message += latest_message
-                if message == []:
-                    #await manager.send_personal_message({"type":"Latest-Message","content":{"message":"No new messages"}}, ws)
-                    return
+        #未読の範囲はlast_viewed_atで決まるため、このワーカーに溜まっている既読位置を先に書き込む
+        await read_positions.flush_user(user_id)
+        while True:
+            async with async_database.get_connection() as conn:
+                async with conn.cursor(row_factory=dict_row) as cursor:
+                    message, unread_counts, after = await async_database.fetch_unread_messages(cursor, user_id, UNREAD_BACKLOG_LIMIT, UNREAD_CHUNK_SIZE, after)
+            for latest_message in message:
+                latest_message["created_at"] = str(latest_message["created_at"])
+            if message != []:
                 await manager.send_personal_message({"type":"Latest-Message","content":message}, ws)
+                count += len(message)
+            #上限を超えたルームは未読件数のみ送信
+            if unread_counts != {}:
+                await manager.send_personal_message({"type":"Unread-Count","content":unread_counts}, ws)
+            if after is None:
+                break
+            if not await manager.wait_for_space(ws, UNREAD_MAX_QUEUED_FRAMES):
+                return
+        await manager.send_personal_message({"type":"Latest-Message-End","content":{"count":count}}, ws)
     except Exception as e:
         print(f"Error fetching message data: {e}")
         await manager.send_personal_message({"type":"Latest-Message","content":{"message":"Error fetching message data"}}, ws)
@@ -41,10 +45,9 @@ async def get_latest_message(ws: WebSocket, user_id: str):
     
     #ユーザに対するフレンドリクエストが来ている場合は送信
     try:
-        friend_requests = []
-        if user_id in manager.friend_requests and not manager.friend_requests[user_id] == []:
-            friend_requests = manager.friend_requests[user_id]
-            await manager.send_personal_message({"type":"FriendRequest","content":friend_requests}, ws)
+        requests = await friend_requests.get_requests(user_id)
+        if requests:
+            await manager.send_personal_message({"type":"FriendRequest","content":list(requests)}, ws)
     except Exception as e:
         print(f"Error fetching friend request data: {e}")
-        return
\ No newline at end of file
+        return
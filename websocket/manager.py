@@ -1,47 +1,359 @@
 from fastapi import APIRouter, WebSocket
-from typing import List, Dict
+from typing import Callable, List, Dict, Set, Tuple
 import asyncio
+import uuid
 from datetime import datetime, timedelta
 import pytz
+from database.database import async_database
+from psycopg.rows import dict_row
+from websocket.outbox import Outbox
+from websocket.codec import DEFAULT_FORMAT, Frame
+from websocket.eventbus import EventBus
+from websocket.tokenexpiry import TokenExpiryTimer
+from websocket.replay import ReplayStore
+from websocket.readposition import read_positions
+from config import OUTBOX_MAX_SIZE, OUTBOX_OVERFLOW_POLICY, CONNECTION_LOCK_STRIPES
 
 router = APIRouter()
 
 class ConnectionManager:
     """
     websocketの接続管理を行う
+    接続の登録・解除はユーザーごと(ユーザーIDのハッシュで分割したロック)に排他し、
+    オンラインであるか・ルームに参加しているかなどの参照はロックを取得せずに辞書と集合から行う
     """
     def __init__(self):
         self.active_connections: Dict[str,WebSocket] = {}
-        self.active_users_id: List[str] = []
         self.focus_room: Dict[str, str] = {}
         self.latest_token_valid: Dict[str, datetime] = {}
-        self.friend_requests: Dict[str, set] = {}
-        self.lock = asyncio.Lock()
+        self.search_tasks: Dict[str, asyncio.Task] = {}
+        #ルームの参加者のうちオンラインのユーザー(ルームID -> ユーザーID)
+        self.room_members: Dict[str, Set[str]] = {}
+        #オンラインのユーザーが参加しているルーム(ユーザーID -> ルームID)
+        self.user_rooms: Dict[str, Set[str]] = {}
+        #認証済みの接続の送信キュー
+        self.outboxes: Dict[WebSocket, Outbox] = {}
+        #他のワーカーに接続しているユーザーへの送信に使用するイベントバス
+        self.event_bus: EventBus | None = None
+        #イベントの種類 -> 処理(接続管理以外のイベントの処理を登録する)
+        self.event_handlers: Dict[str, Callable[[Dict], None]] = {}
+        #ユーザーIDのハッシュで分割したロック(同じユーザーの接続・切断などを排他する)
+        self.locks: List[asyncio.Lock] = [asyncio.Lock() for _ in range(CONNECTION_LOCK_STRIPES)]
+        #全ての接続のアクセストークンの有効期限
+        self.token_timer = TokenExpiryTimer(self.warn_token_expiry, self.expire_sessions)
+        #ユーザーごとの送信済みイベント(再接続時の再送に使用する)
+        self.replay_buffers = ReplayStore()
+        #再接続の処理中の接続 -> 接続時のseq(replay()を呼び出すまでイベントを送信キューに追加しない)
+        self.resuming: Dict[WebSocket, int] = {}
+
+    def user_lock(self, user_id: str) -> asyncio.Lock:
+        """
+        ユーザーに対応するロックを返す
+        """
+        return self.locks[hash(user_id) % len(self.locks)]
+
+    def is_online(self, user_id: str) -> bool:
+        """
+        ユーザーがこのワーカーに接続しているか
+        """
+        return user_id in self.active_connections
+
+    async def start_event_bus(self, event_bus: EventBus | None):
+        """
+        イベントバスを開始する(Noneの場合は他のワーカーにイベントを送信しない)
+        """
+        self.event_bus = event_bus
+        if event_bus is not None:
+            await event_bus.start(self.handle_event)
+
+    async def stop_event_bus(self):
+        if self.event_bus is not None:
+            await self.event_bus.stop()
+            self.event_bus = None
+
+    def register_event_handler(self, event_type: str, handler: Callable[[Dict], None]):
+        """
+        他のワーカーから受信したイベントの処理を登録する
+        """
+        self.event_handlers[event_type] = handler
+
+    def publish(self, event: Dict):
+        """
+        他のワーカーにイベントを送信する(イベントバスがない場合は何もしない)
+        """
+        if self.event_bus is not None:
+            self.event_bus.publish(event)
+
+    async def handle_event(self, event: Dict):
+        """
+        他のワーカーから受信したイベントをこのワーカーに接続しているユーザーに反映する
+        """
+        if event["type"] == "users":
+            self.deliver_frame(Frame(json_text=event["frame"]), event["user_ids"], event.get("ephemeral", False))
+        elif event["type"] == "room":
+            members = [member for member in self.get_room_recipients(event["room_id"]) if not member == event.get("exclude_user_id")]
+            self.deliver_frame(Frame(json_text=event["frame"]), members, event.get("ephemeral", False))
+        elif event["type"] == "room_member":
+            if event["op"] == "add":
+                self.add_room_member(event["room_id"], event["user_id"], publish=False)
+            else:
+                self.remove_room_member(event["room_id"], event["user_id"], publish=False)
+        elif event["type"] in self.event_handlers:
+            self.event_handlers[event["type"]](event)
+        else:
+            print(f"Unknown event type: {event['type']}")
 
     async def connect(self, websocket: WebSocket, user_id: str):
         await websocket.accept()
     
-    async def verified_connect(self, websocket: WebSocket, user_id: str):
-        async with self.lock:
+    async def verified_connect(self, websocket: WebSocket, user_id: str, format: str = DEFAULT_FORMAT):
+        """
+        認証済みの接続を登録し、接続時に選択した形式(format)で送信する送信キューを開始する
+        """
+        async with self.user_lock(user_id):
             self.active_connections[user_id] = websocket
-            self.active_users_id.append(user_id)
             self.latest_token_valid[user_id] = pytz.timezone('Asia/Tokyo').localize(datetime.now())+timedelta(hours=9)
+            self.token_timer.renew(user_id)
+            self.resuming[websocket] = self.replay_buffers.attach(user_id).seq
+            outbox = Outbox(websocket, OUTBOX_MAX_SIZE, OUTBOX_OVERFLOW_POLICY, format)
+            outbox.start()
+            self.outboxes[websocket] = outbox
+
+    async def load_user_rooms(self, user_id: str):
+        """
+        接続したユーザーが参加しているルームを取得し、ルームの参加者のインデックスに追加する
+        """
+        self.user_rooms.setdefault(user_id, set())
+        async with async_database.get_connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cursor:
+                rooms = await async_database.fetch(cursor, "room_participants", {"user_id": user_id})
+        #取得中に切断された場合は追加しない
+        if user_id not in self.user_rooms:
+            return
+        for room in rooms:
+            self.add_room_member(str(room["id"]), user_id)
+
+    def add_room_member(self, room_id: str, user_id: str, publish: bool = True):
+        """
+        ルームの参加者のインデックスにユーザーを追加する(オフラインのユーザーは追加しない)
+        このワーカーに接続していないユーザーは他のワーカーに通知する
+        """
+        if user_id not in self.user_rooms:
+            #切断中のユーザーは再接続時に再送できるようルームのイベントの記録を続ける
+            self.replay_buffers.join_room(room_id, user_id)
+            if publish:
+                self.publish({"type":"room_member","op":"add","room_id":room_id,"user_id":user_id})
+            return
+        self.user_rooms[user_id].add(room_id)
+        self.room_members.setdefault(room_id, set()).add(user_id)
+
+    def remove_room_member(self, room_id: str, user_id: str, publish: bool = True):
+        """
+        ルームの参加者のインデックスからユーザーを削除する(オンラインの参加者がいなくなったルームは削除する)
+        このワーカーに接続していないユーザーは他のワーカーに通知する
+        """
+        if user_id in self.user_rooms:
+            self.user_rooms[user_id].discard(room_id)
+        else:
+            self.replay_buffers.leave_room(room_id, user_id)
+            if publish:
+                self.publish({"type":"room_member","op":"remove","room_id":room_id,"user_id":user_id})
+        if room_id in self.room_members:
+            self.room_members[room_id].discard(user_id)
+            if not self.room_members[room_id]:
+                del self.room_members[room_id]
+
+    def get_online_room_members(self, room_id: str) -> Set[str]:
+        """
+        ルームの参加者のうちオンラインのユーザーを返す
+        """
+        return self.room_members.get(room_id, set())
+
+    def get_room_recipients(self, room_id: str) -> Set[str]:
+        """
+        ルームのイベントを受け取るユーザー(オンラインの参加者と、再送用のバッファを保持している切断中の参加者)を返す
+        切断中の参加者にはバッファへの記録のみ行う(deliver_frame)
+        """
+        detached = self.replay_buffers.get_detached_room_members(room_id)
+        if not detached:
+            return self.get_online_room_members(room_id)
+        return self.get_online_room_members(room_id) | detached
+
+    async def is_room_member(self, room_id: str, user_id: str) -> bool:
+        """
+        オンラインのユーザーがルームに参加しているか
+        インデックスにある場合はデータベースを参照しない
+        インデックスにない場合(イベントの取りこぼしなど)はデータベースで確認し、参加している場合はインデックスに追加する
+        ハンドラが受け取るルームIDはschemasで小文字・ハイフン区切りの表記に揃えられている
+        (それ以外から呼び出された場合もインデックスに異なる表記のIDを追加しないよう、ここでも変換する)
+        """
+        if room_id in self.user_rooms.get(user_id, ()):
+            return True
+        try:
+            room_id = str(uuid.UUID(room_id))
+        except (ValueError, TypeError, AttributeError):
+            return False
+        if room_id in self.user_rooms.get(user_id, ()):
+            return True
+        try:
+            async with async_database.get_connection() as conn:
+                async with conn.cursor(row_factory=dict_row) as cursor:
+                    rooms = await async_database.fetch(cursor, "room_participants", {"id": room_id, "user_id": user_id})
+        except Exception as e:
+            print(f"Error fetching room data: {e}")
+            return False
+        if rooms == []:
+            return False
+        self.add_room_member(room_id, user_id, publish=False)
+        return True
 
     async def disconnect(self, websocket: WebSocket, user_id: str):
         print("disconnect")
-        async with self.lock:
-            if user_id in self.active_connections:
+        async with self.user_lock(user_id):
+            if websocket in self.outboxes:
+                self.outboxes.pop(websocket).close()
+            self.resuming.pop(websocket, None)
+            #同じユーザーが再接続している場合は新しい接続の情報を削除しない
+            if self.active_connections.get(user_id) is websocket:
+                #切断中も参加しているルームのイベントを記録するため、ルームとともにバッファを保持する
+                self.replay_buffers.detach(user_id, self.user_rooms.get(user_id, ()))
+                for room_id in list(self.user_rooms.get(user_id, ())):
+                    self.remove_room_member(room_id, user_id)
+                self.user_rooms.pop(user_id, None)
                 del self.active_connections[user_id]
-            if user_id in self.active_users_id:
-                self.active_users_id.remove(user_id)
-            if user_id in self.latest_token_valid:
-                del self.latest_token_valid[user_id]
+                self.latest_token_valid.pop(user_id, None)
+                self.token_timer.remove(user_id)
+                self.search_tasks.pop(user_id, None)
+        #切断したユーザーの既読位置はすぐに書き込む
+        await read_positions.flush_user(user_id)
         try:
             await websocket.close()
         except Exception as e:
             pass
 
-    async def send_personal_message(self, message, websocket: WebSocket):
-        await websocket.send_json(message)
+    def check_resume(self, user_id: str, resume_from, epoch) -> Tuple[bool, str, int]:
+        """
+        再接続したクライアントが指定したseq(resume_from)より後のイベントを再送できるか確認する
+        戻り値: (再送できるか, 現在のepoch, 現在のseq)
+        同じepochのバッファがresume_fromより後のイベントを全て保持している場合のみ再送できる
+        """
+        buffer = self.replay_buffers.attach(user_id)
+        resumed = (isinstance(resume_from, int) and not isinstance(resume_from, bool) and
+                   epoch == buffer.epoch and buffer.since(resume_from) is not None)
+        return resumed, buffer.epoch, buffer.seq
+
+    def replay(self, websocket: WebSocket, user_id: str, resume_from: int | None = None):
+        """
+        再接続の処理を終え、イベントの送信を開始する
+        resume_fromを指定した場合はそれより後のイベントを、指定しない場合は接続してから記録したイベントを送信キューに追加する
+        """
+        start_seq = self.resuming.pop(websocket, None)
+        outbox = self.outboxes.get(websocket)
+        if start_seq is None or outbox is None:
+            return
+        if resume_from is not None:
+            start_seq = resume_from
+        for seq, frame in self.replay_buffers.attach(user_id).since(start_seq) or []:
+            outbox.put(frame, False, seq)
+
+    async def warn_token_expiry(self, user_ids: List[str]):
+        """
+        アクセストークンの有効期限が近い接続に警告を送信する(内容は同じため一度だけエンコードする)
+        """
+        frame = Frame({"type":"AuthInfo","content":{"message":"Your access token has expired after 10 minutes. Please refresh access token."}})
+        self.deliver_frame(frame, user_ids)
+
+    async def expire_sessions(self, user_ids: List[str]):
+        """
+        アクセストークンの有効期限が切れた接続をまとめて切断する
+        """
+        sessions = [(self.active_connections[user_id], user_id) for user_id in user_ids if user_id in self.active_connections]
+        await asyncio.gather(*(self.disconnect(websocket, user_id) for websocket, user_id in sessions))
+
+    async def send_personal_message(self, message, websocket: WebSocket, ephemeral: bool = False):
+        """
+        メッセージを送信する
+        認証済みの接続は送信キューに追加するだけで返る(送信は接続ごとの送信タスクが行う)
+        ephemeralがTrueのメッセージは送信キューが上限に達した場合に破棄されることがある
+        """
+        outbox = self.outboxes.get(websocket)
+        if outbox is None:
+            #認証前の接続は直接送信する
+            await websocket.send_json(message)
+            return
+        outbox.put(message, ephemeral)
+
+    async def wait_for_space(self, websocket: WebSocket, limit: int) -> bool:
+        """
+        送信キューの長さがlimit以下になるまで待つ
+        接続が閉じられた場合はFalseを返す(送信キューのない認証前の接続は待たずにTrueを返す)
+        """
+        outbox = self.outboxes.get(websocket)
+        if outbox is None:
+            return True
+        return await outbox.wait_for_space(limit)
+
+    def deliver_frame(self, frame: Frame, user_ids, ephemeral: bool = False) -> List[str]:
+        """
+        フレームをこのワーカーに接続しているユーザーの送信キューに追加する
+        戻り値はこのワーカーに接続していないユーザーのリスト
+        """
+        not_connected = []
+        for user_id in user_ids:
+            websocket = self.active_connections.get(user_id)
+            outbox = self.outboxes.get(websocket)
+            #エフェメラルでないイベントは番号を付けて再送用に記録する(切断後に保持しているバッファにも記録する)
+            seq = None
+            if not ephemeral:
+                buffer = self.replay_buffers.get(user_id)
+                if buffer is not None:
+                    seq = buffer.record(frame)
+            if outbox is None:
+                not_connected.append(user_id)
+                continue
+            #再接続の処理中は記録のみ行い、replay()で送信キューに追加する
+            if websocket in self.resuming:
+                continue
+            outbox.put(frame, ephemeral, seq)
+        return not_connected
+
+    def broadcast(self, message, user_ids, ephemeral: bool = False):
+        """
+        同じメッセージを複数のユーザーに送信する
+        メッセージは形式ごとに一度だけエンコードし、エンコード済みのフレームを各接続に送信する
+        このワーカーに接続していないユーザー宛てのフレームはJSONでイベントバスから他のワーカーに送信する
+        """
+        frame = Frame(message)
+        not_connected = self.deliver_frame(frame, user_ids, ephemeral)
+        if not_connected:
+            self.publish({"type":"users","user_ids":not_connected,"frame":frame.encode("json"),"ephemeral":ephemeral})
+
+    def broadcast_room(self, message, room_id: str, exclude_user_id: str | None = None, ephemeral: bool = False):
+        """
+        ルームのオンラインの参加者全員(exclude_user_idを除く)にメッセージを送信する
+        他のワーカーに接続している参加者には各ワーカーのルームの参加者のインデックスを使用して送信する
+        切断中の参加者は再接続時に再送するためバッファにのみ記録する
+        """
+        frame = Frame(message)
+        members = [member for member in self.get_room_recipients(room_id) if not member == exclude_user_id]
+        self.deliver_frame(frame, members, ephemeral)
+        if self.event_bus is not None:
+            self.publish({"type":"room","room_id":room_id,"exclude_user_id":exclude_user_id,"frame":frame.encode("json"),"ephemeral":ephemeral})
+
+    def send_to_user(self, message, user_id: str, ephemeral: bool = False):
+        """
+        ユーザーにメッセージを送信する(他のワーカーに接続している場合はイベントバスを経由する)
+        """
+        self.broadcast(message, [user_id], ephemeral)
+
+    def get_outbox_metrics(self) -> Dict[str, Dict[str, int]]:
+        """
+        接続ごとの送信キューのメトリクス(キューの長さ、最大長、送信数、破棄数)を返す
+        """
+        metrics = {}
+        for user_id, websocket in list(self.active_connections.items()):
+            if websocket in self.outboxes:
+                metrics[user_id] = self.outboxes[websocket].metrics()
+        return metrics
 
 manager = ConnectionManager()
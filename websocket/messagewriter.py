@@ -0,0 +1,121 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Tuple
+from psycopg import DataError, IntegrityError
+from config import MESSAGE_WRITER_MAX_BATCH, MESSAGE_WRITER_CONCURRENCY
+from database.database import async_database
+
+class MessageWriter:
+    """
+    メッセージの保存をまとめて行う(グループコミット)
+    write()はキューにメッセージを追加し、保存タスクがキューに溜まっているメッセージ(最大max_batch件)を
+    一度のINSERTと一度のコミットで保存する。write()はコミットが完了した後に返る
+    コミットを待っている間に届いたメッセージは次のコミットでまとめて保存されるため、送信者が多いほどまとめる件数が増える
+    保存タスクはconcurrency個あり、同じルームのメッセージは常に同じタスクが保存する
+    created_atはwrite()の呼び出し順に単調増加する時刻を設定する(同じコミットの中でもcreated_atの順序が送信の順序になる)
+    (同じルームのメッセージが同時にコミットされ、created_atの順序と送信・配信の順序が食い違わないようにするため)
+    """
+    def __init__(self, max_batch: int = MESSAGE_WRITER_MAX_BATCH, concurrency: int = MESSAGE_WRITER_CONCURRENCY):
+        self.max_batch = max_batch
+        self.concurrency = concurrency
+        #保存タスクごとのキュー(ルームIDで振り分ける)
+        self.queues: List[asyncio.Queue[Tuple[Dict, asyncio.Future]]] = []
+        self.tasks: List[asyncio.Task] = []
+        #最後に設定したcreated_at
+        self.last_created_at = datetime.min.replace(tzinfo=timezone.utc)
+        #メトリクス
+        self.written = 0
+        self.commits = 0
+        self.failed = 0
+
+    def start(self):
+        self.queues = [asyncio.Queue() for _ in range(self.concurrency)]
+        self.tasks = [asyncio.create_task(self.run(queue)) for queue in self.queues]
+
+    async def stop(self):
+        """
+        キューに残っているメッセージを保存してから止める(アプリケーションの終了時に呼び出す)
+        """
+        for queue in self.queues:
+            await queue.join()
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+        self.queues = []
+
+    async def write(self, message: Dict):
+        """
+        メッセージを保存する(コミットが完了するまで待つ)
+        messageは{"id", "room_id", "sender_id", "type", "content"}(created_atはここで設定する)
+        保存に失敗した場合は例外を送出する
+        """
+        if not self.queues:
+            raise RuntimeError("MessageWriter is not running")
+        message = {**message, "created_at": self.next_created_at()}
+        future = asyncio.get_running_loop().create_future()
+        self.queues[hash(message["room_id"]) % len(self.queues)].put_nowait((message, future))
+        await future
+
+    def next_created_at(self) -> datetime:
+        """
+        前回より後の時刻を返す(時計の精度内で同時に呼び出された場合や、時計が戻った場合は1マイクロ秒ずらす)
+        """
+        created_at = max(datetime.now(timezone.utc), self.last_created_at + timedelta(microseconds=1))
+        self.last_created_at = created_at
+        return created_at
+
+    async def run(self, queue: asyncio.Queue):
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.max_batch and not queue.empty():
+                batch.append(queue.get_nowait())
+            try:
+                await self.write_batch(batch)
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    async def write_batch(self, batch: List[Tuple[Dict, asyncio.Future]]):
+        try:
+            async with async_database.unit_of_work() as uow:
+                await async_database.insert_messages(uow.cursor, [message for message, _ in batch])
+        except (DataError, IntegrityError) as e:
+            if len(batch) > 1:
+                #一件の不正なメッセージで他のメッセージが失敗しないよう、半分に分けて保存し直す
+                #(不正なメッセージが少なければ、やり直すトランザクションはlog2(件数)程度で済む)
+                half = len(batch) // 2
+                await self.write_batch(batch[:half])
+                await self.write_batch(batch[half:])
+                return
+            self.failed += 1
+            self.resolve(batch, e)
+            return
+        except Exception as e:
+            #接続のエラー・接続プールのタイムアウトなどはやり直しても失敗するため、バッチ全体を失敗させる
+            self.failed += len(batch)
+            self.resolve(batch, e)
+            return
+        self.written += len(batch)
+        self.commits += 1
+        self.resolve(batch)
+
+    def resolve(self, batch: List[Tuple[Dict, asyncio.Future]], error: Exception | None = None):
+        for _, future in batch:
+            #送信者のハンドラが取り消されている場合は結果を設定しない
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+
+    def metrics(self) -> Dict[str, float]:
+        return {
+            "queued": sum(queue.qsize() for queue in self.queues),
+            "written": self.written,
+            "commits": self.commits,
+            "failed": self.failed,
+            "mean_batch": self.written / self.commits if self.commits else 0,
+        }
+
+message_writer = MessageWriter()
@@ -0,0 +1,242 @@
+import json
+import queue
+import random
+import threading
+import time
+from typing import Dict, Iterable, List, Tuple
+from psycopg.rows import dict_row
+from firebase_admin import messaging, exceptions
+from config import NOTIFY_TRANSPORT, NOTIFY_WORKERS, NOTIFY_QUEUE_SIZE, NOTIFY_BATCH_SIZE, NOTIFY_DRAIN_SIZE, NOTIFY_MAX_RETRIES, NOTIFY_RETRY_BASE_SECONDS
+from database.database import database
+
+#デバイスごとの送信結果
+SENT = "sent"
+RETRY = "retry" #一時的なエラー(再送する)
+INVALID = "invalid" #無効なトークン(users.fcm_tokenから削除する)
+FAILED = "failed" #再送しても成功しないエラー
+
+def classify_error(error: Exception) -> str:
+    """
+    FCMのエラーを送信結果に分類する
+    """
+    if isinstance(error, (messaging.UnregisteredError, messaging.SenderIdMismatchError)):
+        return INVALID
+    #INVALID_ARGUMENTは通知の内容が不正な場合にも返るため、トークンが不正な場合のみ削除する
+    if isinstance(error, exceptions.InvalidArgumentError) and "registration token" in str(error):
+        return INVALID
+    if isinstance(error, (messaging.QuotaExceededError, exceptions.UnavailableError, exceptions.InternalError, exceptions.DeadlineExceededError)):
+        return RETRY
+    return FAILED
+
+class FCMTransport:
+    """
+    Firebase Cloud Messagingでプッシュ通知を送信する
+    """
+    def send(self, tokens: List[str], notification: Dict) -> List[str]:
+        """
+        tokensのデバイスに同じ通知を送信し、デバイスごとの送信結果を返す(tokensは500件まで)
+        notificationは{"title", "body", "data"(任意)}
+        """
+        response = messaging.send_each_for_multicast(messaging.MulticastMessage(
+            notification=messaging.Notification(title=notification["title"], body=notification["body"]),
+            data=notification.get("data"),
+            tokens=tokens))
+        return [SENT if result.success else classify_error(result.exception) for result in response.responses]
+
+class FakeTransport:
+    """
+    送信せずに記録する(ローカル環境・テスト用)
+    invalid_tokensのトークンは無効なトークンとして扱い、最初のfailures回の送信は一時的なエラーを返す
+    """
+    def __init__(self, invalid_tokens: Iterable[str] = (), failures: int = 0):
+        self.invalid_tokens = set(invalid_tokens)
+        self.failures = failures
+        self.lock = threading.Lock()
+        #送信を試みたバッチ(tokens, notification)と、送信に成功した(token, notification)
+        self.batches: List[Tuple[List[str], Dict]] = []
+        self.delivered: List[Tuple[str, Dict]] = []
+
+    def send(self, tokens: List[str], notification: Dict) -> List[str]:
+        with self.lock:
+            self.batches.append((list(tokens), notification))
+            if self.failures > 0:
+                self.failures -= 1
+                return [RETRY] * len(tokens)
+            results = []
+            for token in tokens:
+                if token in self.invalid_tokens:
+                    results.append(INVALID)
+                else:
+                    self.delivered.append((token, notification))
+                    results.append(SENT)
+            return results
+
+def create_transport(kind: str = NOTIFY_TRANSPORT):
+    if kind == "fake":
+        return FakeTransport()
+    return FCMTransport()
+
+class NotificationDispatcher:
+    """
+    プッシュ通知を専用のスレッドで送信する
+    notify_room()・notify_tokens()はキューに追加するだけで、FCMのAPIやデータベースの応答を待たない
+    (キューが上限に達している場合は通知を破棄する)
+    送信スレッドはキューに溜まっている通知をdrain_size件までまとめて取り出し、同じ内容の通知はデバイスをまとめて
+    batch_size件ずつ送信する。一時的なエラーのデバイスには待ち時間を2倍にしながら再送し、
+    無効になったトークンはusers.fcm_tokenから削除する
+    """
+    def __init__(self, transport=None, workers: int = NOTIFY_WORKERS, queue_size: int = NOTIFY_QUEUE_SIZE,
+                 batch_size: int = NOTIFY_BATCH_SIZE, drain_size: int = NOTIFY_DRAIN_SIZE, max_retries: int = NOTIFY_MAX_RETRIES, retry_base: float = NOTIFY_RETRY_BASE_SECONDS):
+        self.transport = transport if transport is not None else create_transport()
+        self.workers = workers
+        self.batch_size = batch_size
+        self.drain_size = drain_size
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.queue: queue.Queue = queue.Queue(queue_size)
+        self.threads: List[threading.Thread] = []
+        self.lock = threading.Lock()
+        #メトリクス
+        self.counts = {"enqueued": 0, "dropped": 0, "batches": 0, "sent": 0, "retried": 0, "failed": 0, "invalidated": 0}
+
+    def count(self, name: str, n: int = 1):
+        with self.lock:
+            self.counts[name] += n
+
+    def start(self):
+        self.threads = [threading.Thread(target=self.run, name=f"notifier-{i}", daemon=True) for i in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self, timeout: float | None = None):
+        """
+        キューに残っている通知を送信してから止める(アプリケーションの終了時に呼び出す)
+        """
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+
+    def notify_room(self, room_id: str, exclude_user_ids: Iterable[str], notification: Dict) -> bool:
+        """
+        ルームの参加者(exclude_user_idsを除く)のデバイスに通知を送信する
+        キューに追加できなかった場合はFalseを返す
+        (オンラインかどうかはワーカーごとにしか分からないため、他のワーカーに接続中の参加者にも通知が送信される)
+        """
+        return self.enqueue(("room", room_id, list(exclude_user_ids), notification))
+
+    def notify_tokens(self, tokens: Iterable[str], notification: Dict) -> bool:
+        """
+        指定したデバイスに通知を送信する
+        キューに追加できなかった場合はFalseを返す
+        """
+        return self.enqueue(("tokens", None, list(tokens), notification))
+
+    def enqueue(self, job: Tuple) -> bool:
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            self.count("dropped")
+            print("Error sending FCM notification: queue is full")
+            return False
+        self.count("enqueued")
+        return True
+
+    def run(self):
+        while True:
+            jobs = [self.queue.get()]
+            stopping = jobs[0] is None
+            #キューに溜まっている通知をまとめて取り出す
+            while not stopping and len(jobs) < self.drain_size:
+                try:
+                    job = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    stopping = True
+                    break
+                jobs.append(job)
+            jobs = [job for job in jobs if job is not None]
+            if jobs:
+                try:
+                    self.dispatch(jobs)
+                except Exception as e:
+                    print(f"Error sending FCM notification: {e}")
+            if stopping:
+                return
+
+    def dispatch(self, jobs: List[Tuple]):
+        """
+        通知の送信先のトークンを取得し、同じ内容の通知ごとにまとめて送信する
+        """
+        groups: Dict[str, Tuple[Dict, Dict[str, None]]] = {}
+        room_jobs = [job for job in jobs if job[0] == "room"]
+        resolved: Dict[int, List[str]] = {}
+        if room_jobs:
+            with database.get_connection() as conn:
+                with conn.cursor(row_factory=dict_row) as cursor:
+                    for job in room_jobs:
+                        resolved[id(job)] = database.fetch_room_fcm_tokens(cursor, job[1], job[2])
+        for job in jobs:
+            kind, _, targets, notification = job
+            tokens = resolved[id(job)] if kind == "room" else targets
+            key = json.dumps(notification, sort_keys=True, ensure_ascii=False)
+            #同じデバイスに同じ通知を二重に送信しないよう、順序を保ったまま重複を除く
+            group = groups.setdefault(key, (notification, {}))
+            group[1].update(dict.fromkeys(tokens))
+        for notification, tokens in groups.values():
+            tokens = list(tokens)
+            for i in range(0, len(tokens), self.batch_size):
+                self.send_batch(tokens[i:i + self.batch_size], notification)
+
+    def send_batch(self, tokens: List[str], notification: Dict):
+        """
+        一つのバッチを送信する(一時的なエラーのデバイスにはmax_retries回まで再送する)
+        """
+        pending = tokens
+        invalid = []
+        for attempt in range(self.max_retries + 1):
+            try:
+                results = self.transport.send(pending, notification)
+            except Exception as e:
+                #ネットワークのエラーなどでバッチ全体が失敗した場合は全てのデバイスに再送する
+                print(f"Error sending FCM notification: {e}")
+                results = [RETRY] * len(pending)
+            self.count("batches")
+            retry = []
+            for token, result in zip(pending, results):
+                if result == SENT:
+                    self.count("sent")
+                elif result == INVALID:
+                    invalid.append(token)
+                elif result == RETRY:
+                    retry.append(token)
+                else:
+                    self.count("failed")
+            if not retry:
+                break
+            if attempt == self.max_retries:
+                self.count("failed", len(retry))
+                break
+            self.count("retried", len(retry))
+            #FCMの負荷が高い場合に再送が集中しないよう待ち時間をずらす
+            time.sleep(self.retry_base * 2 ** attempt * random.uniform(0.5, 1.5))
+            pending = retry
+        if invalid:
+            self.prune(invalid)
+
+    def prune(self, tokens: List[str]):
+        """無効になったトークンをusers.fcm_tokenから削除する"""
+        try:
+            with database.get_connection() as conn:
+                with conn.cursor() as cursor:
+                    self.count("invalidated", database.clear_fcm_tokens(cursor, tokens))
+        except Exception as e:
+            print(f"Error removing FCM tokens: {e}")
+
+    def metrics(self) -> Dict[str, int]:
+        with self.lock:
+            return {"queued": self.queue.qsize(), **self.counts}
+
+notifier = NotificationDispatcher()
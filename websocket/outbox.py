@@ -0,0 +1,146 @@
+from fastapi import WebSocket
+from collections import deque
+from typing import Deque, Tuple, Dict
+import asyncio
+from websocket.codec import DEFAULT_FORMAT, encode
+
+class Outbox:
+    """
+    接続ごとの送信キュー
+    put()はキューに追加するだけで返り、接続ごとの送信タスクがキューの先頭から順に送信する
+    (送信の遅いクライアントがいても送信側のハンドラや他のユーザーへの送信を待たせない)
+
+    キューが上限に達した場合の動作(overflow_policy)
+        "drop_oldest": キュー内の最も古いエフェメラルなイベントを破棄する(エフェメラルなイベントがない場合は切断する)
+        "disconnect":  切断する
+
+    メッセージは送信時に接続時に選択した形式(format)でエンコードする
+    """
+    def __init__(self, websocket: WebSocket, max_size: int, overflow_policy: str = "drop_oldest", format: str = DEFAULT_FORMAT):
+        if overflow_policy not in ("drop_oldest", "disconnect"):
+            raise ValueError(f"Invalid overflow policy: {overflow_policy}")
+        self.websocket = websocket
+        self.max_size = max_size
+        self.overflow_policy = overflow_policy
+        self.format = format
+        #(メッセージ, エフェメラルか, seq)
+        self.queue: Deque[Tuple[object, bool, int | None]] = deque()
+        self.event = asyncio.Event()
+        #送信するたびにセットする(wait_for_space()で使用する)
+        self.space = asyncio.Event()
+        self.task: asyncio.Task | None = None
+        #キューの上限で切断する場合の切断タスク(完了するまで参照を保持する)
+        self.close_task: asyncio.Task | None = None
+        self.closed = False
+        self.overflowed = False
+        #メトリクス
+        self.sent = 0
+        self.dropped = 0
+        self.high_water = 0
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    def put(self, message, ephemeral: bool = False, seq: int | None = None) -> bool:
+        """
+        メッセージを送信キューに追加する
+        messageはdict、Frameまたはエンコード済みのJSON文字列
+        ephemeralがTrueのメッセージは上限に達した場合に破棄してよいもの(検索結果など)
+        seqを指定した場合は送信時にフレームに"seq"を追加する(再送用の番号)
+        キューに追加できなかった場合はFalseを返す
+        """
+        if self.closed:
+            return False
+        if len(self.queue) >= self.max_size and not self.handle_overflow():
+            return False
+        self.queue.append((message, ephemeral, seq))
+        self.high_water = max(self.high_water, len(self.queue))
+        self.event.set()
+        return True
+
+    async def wait_for_space(self, limit: int) -> bool:
+        """
+        キューの長さがlimit以下になるまで待つ(大量のメッセージを順に追加する場合の背圧に使用する)
+        送信キューが閉じられた場合はFalseを返す
+        """
+        while not self.closed and len(self.queue) > limit:
+            self.space.clear()
+            await self.space.wait()
+        return not self.closed
+
+    def handle_overflow(self) -> bool:
+        """
+        キューが上限に達した場合の処理
+        空きを作れた場合はTrue、切断した場合はFalseを返す
+        """
+        if self.overflow_policy == "drop_oldest":
+            for i, (_, ephemeral, _) in enumerate(self.queue):
+                if ephemeral:
+                    del self.queue[i]
+                    self.dropped += 1
+                    return True
+        print(f"Outbox overflow: {len(self.queue)} messages queued, disconnecting")
+        self.overflowed = True
+        self.dropped += len(self.queue)
+        self.close()
+        #送信中のタスクは遅いクライアントへの送信で止まっている可能性があるため取り消してから切断する
+        self.close_task = asyncio.create_task(self.close_websocket())
+        self.close_task.add_done_callback(self.close_done)
+        return False
+
+    async def run(self):
+        """
+        キューのメッセージを順に送信する
+        """
+        try:
+            while True:
+                while not self.queue:
+                    if self.closed:
+                        return
+                    self.event.clear()
+                    await self.event.wait()
+                message, _, seq = self.queue.popleft()
+                #Frame(broadcast)は形式ごとに一度だけエンコードされる
+                data = encode(message, self.format, seq)
+                if isinstance(data, bytes):
+                    await self.websocket.send_bytes(data)
+                else:
+                    await self.websocket.send_text(data)
+                self.sent += 1
+                self.space.set()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"Error sending message: {e}")
+            self.closed = True
+            self.queue.clear()
+            self.space.set()
+
+    def close(self):
+        """
+        送信キューを閉じる(キューに残っているメッセージは破棄する)
+        """
+        self.closed = True
+        self.queue.clear()
+        self.event.set()
+        self.space.set()
+        if self.task is not None and self.task is not asyncio.current_task():
+            self.task.cancel()
+
+    async def close_websocket(self):
+        try:
+            await self.websocket.close(code=1008)
+        except Exception as e:
+            print(f"Error closing websocket: {e}")
+
+    def close_done(self, task: asyncio.Task):
+        self.close_task = None
+
+    def metrics(self) -> Dict[str, int]:
+        return {
+            "depth": len(self.queue),
+            "high_water": self.high_water,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "overflowed": int(self.overflowed),
+        }
@@ -0,0 +1,129 @@
+import asyncio
+import uuid
+from datetime import datetime
+from typing import Dict, List, Tuple
+from psycopg.errors import DataError
+from config import READ_POSITION_FLUSH_MS
+from database.database import async_database
+
+class ReadPositionBuffer:
+    """
+    既読位置(room_participants.last_viewed_at)の書き込みを遅延してまとめる
+    同じ(ルーム, ユーザー)への更新は最新の値のみを保持し、flush_ms毎に一度のUPDATEで書き込む
+    切断時はflush_user()で、終了時はstop()でそれまでの更新を書き込む
+    書き込みに失敗した場合は次回の書き込みで再試行する(値が不正な更新はその更新のみ破棄する)
+    last_viewed_atを読む処理(未読メッセージの取得)は先にflush_user()でこのワーカーの更新を書き込む
+    他のワーカーに溜まっている更新は書き込まれるまで(最大でflush_ms)反映されない
+    """
+    def __init__(self, flush_ms: int = READ_POSITION_FLUSH_MS):
+        self.flush_interval = flush_ms / 1000
+        #ユーザーID -> {ルームID: 既読日時}
+        self.pending: Dict[str, Dict[str, datetime]] = {}
+        self.task: asyncio.Task | None = None
+        self.stopping: asyncio.Event | None = None
+        #メトリクス
+        self.marked = 0
+        self.written = 0
+        self.flushes = 0
+
+    def start(self):
+        self.stopping = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """
+        定期的な書き込みを止め、残っている更新を書き込む(アプリケーションの終了時に呼び出す)
+        書き込み中の更新が失われないよう、取り消さずに書き込みの完了を待ってから止める
+        """
+        if self.task is not None:
+            self.stopping.set()
+            await self.task
+            self.task = None
+        await self.flush()
+
+    def mark(self, room_id: str, user_id: str, viewed_at: datetime):
+        """
+        既読位置の更新を記録する(データベースには次回の書き込みで反映する)
+        """
+        self.merge(room_id, user_id, viewed_at)
+        self.marked += 1
+
+    def merge(self, room_id: str, user_id: str, viewed_at: datetime):
+        rooms = self.pending.setdefault(user_id, {})
+        if room_id not in rooms or rooms[room_id] < viewed_at:
+            rooms[room_id] = viewed_at
+
+    async def run(self):
+        while not self.stopping.is_set():
+            try:
+                await asyncio.wait_for(self.stopping.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                await self.flush()
+
+    async def flush(self):
+        """
+        記録している全ての更新を書き込む
+        """
+        pending, self.pending = self.pending, {}
+        await self.write(pending)
+
+    async def flush_user(self, user_id: str):
+        """
+        ユーザーの更新のみを書き込む(切断時に呼び出す)
+        """
+        rooms = self.pending.pop(user_id, None)
+        if rooms:
+            await self.write({user_id: rooms})
+
+    async def write(self, pending: Dict[str, Dict[str, datetime]]):
+        entries = []
+        for user_id, rooms in pending.items():
+            for room_id, value in rooms.items():
+                try:
+                    uuid.UUID(room_id)
+                    uuid.UUID(user_id)
+                except (ValueError, TypeError, AttributeError):
+                    #IDが不正な更新は書き込めないため、その更新のみ破棄する
+                    print(f"Error writing read position (discarded): invalid id {room_id!r}, {user_id!r}")
+                    continue
+                entries.append((room_id, user_id, value))
+        if entries:
+            await self.write_entries(entries)
+
+    async def write_entries(self, entries: List[Tuple[str, str, datetime]]):
+        try:
+            async with async_database.unit_of_work() as uow:
+                await async_database.update_last_viewed_at(uow.cursor, *map(list, zip(*entries)))
+            self.written += len(entries)
+            self.flushes += 1
+        except DataError as e:
+            if len(entries) > 1:
+                #不正な値の更新のみを破棄するよう、半分に分けて書き込み直す
+                half = len(entries) // 2
+                await self.write_entries(entries[:half])
+                await self.write_entries(entries[half:])
+                return
+            #値が不正な場合は再試行しても失敗するため破棄する
+            print(f"Error writing read positions (discarded): {e}")
+        except asyncio.CancelledError:
+            #切断時の書き込みが取り消された場合も、更新は次回の書き込みに残す
+            self.requeue(entries)
+            raise
+        except Exception as e:
+            print(f"Error writing read positions: {e}")
+            self.requeue(entries)
+
+    def requeue(self, entries: List[Tuple[str, str, datetime]]):
+        """書き込めなかった更新を次回に再試行する(その間に記録された新しい値を優先する)"""
+        for room_id, user_id, value in entries:
+            self.merge(room_id, user_id, value)
+
+    def metrics(self) -> Dict[str, int]:
+        return {
+            "pending": sum(len(rooms) for rooms in self.pending.values()),
+            "marked": self.marked,
+            "written": self.written,
+            "flushes": self.flushes,
+        }
+
+read_positions = ReadPositionBuffer()
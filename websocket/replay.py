@@ -0,0 +1,129 @@
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Set, Tuple
+import uuid
+from config import REPLAY_BUFFER_SIZE, REPLAY_RETENTION_SECONDS, REPLAY_MAX_DETACHED
+from websocket.cache import TTLCache
+from websocket.codec import Frame
+
+class ReplayBuffer:
+    """
+    ユーザーごとの送信済みイベントのバッファ
+    イベントには1から順に増加する番号(seq)を付け、新しいものからmax_size件を保持する
+    バッファを作り直した場合はseqが1からやり直しになるため、epochでバッファを区別する
+    """
+    def __init__(self, max_size: int = REPLAY_BUFFER_SIZE):
+        self.epoch = uuid.uuid4().hex
+        self.seq = 0
+        self.frames: Deque[Tuple[int, Frame]] = deque(maxlen=max_size)
+        #切断中に参加しているルーム(切断中もルームのイベントを記録するために使用する)
+        self.rooms: Set[str] = set()
+
+    def record(self, frame: Frame) -> int:
+        """
+        イベントを記録し、付けた番号を返す
+        """
+        self.seq += 1
+        self.frames.append((self.seq, frame))
+        return self.seq
+
+    def since(self, seq: int) -> List[Tuple[int, Frame]] | None:
+        """
+        seqより後のイベントを(番号, フレーム)のリストで返す
+        seqより後のイベントを既に破棄している場合やseqが不正な場合はNoneを返す
+        """
+        if seq < 0 or seq > self.seq:
+            return None
+        first_seq = self.frames[0][0] if self.frames else self.seq + 1
+        if seq < first_seq - 1:
+            return None
+        return [(event_seq, frame) for event_seq, frame in self.frames if event_seq > seq]
+
+class ReplayStore:
+    """
+    ユーザーごとのReplayBuffer
+    接続中のユーザーのバッファに加えて、切断したユーザーのバッファをretention秒間(最大max_detached人分)保持し、
+    その間に同じワーカーに再接続した場合は同じバッファを使用する
+    切断したユーザーが参加しているルームも保持し、切断中に送信されたルームのイベントもバッファに記録できるようにする
+    """
+    def __init__(self, retention: float = REPLAY_RETENTION_SECONDS, max_detached: int = REPLAY_MAX_DETACHED):
+        self.buffers: Dict[str, ReplayBuffer] = {}
+        self.detached = TTLCache(max_detached, retention, on_evict=self.forget_rooms)
+        #ルームID -> 切断中の参加者
+        self.detached_rooms: Dict[str, Set[str]] = {}
+
+    def attach(self, user_id: str) -> ReplayBuffer:
+        """
+        接続したユーザーのバッファを返す(保持しているバッファがない場合は新しく作成する)
+        """
+        buffer = self.buffers.get(user_id)
+        if buffer is None:
+            buffer = self.detached.get(user_id)
+            self.detached.pop(user_id)
+            if buffer is None:
+                buffer = ReplayBuffer()
+            else:
+                self.forget_rooms(user_id, buffer)
+            self.buffers[user_id] = buffer
+        return buffer
+
+    def detach(self, user_id: str, rooms: Iterable[str] = ()):
+        """
+        切断したユーザーのバッファを参加しているルームとともに一定時間保持する
+        """
+        buffer = self.buffers.pop(user_id, None)
+        if buffer is not None:
+            buffer.rooms = set(rooms)
+            for room_id in buffer.rooms:
+                self.detached_rooms.setdefault(room_id, set()).add(user_id)
+            self.detached.set(user_id, buffer)
+
+    def forget_rooms(self, user_id: str, buffer: ReplayBuffer):
+        """
+        保持しなくなったバッファのルームを切断中の参加者から削除する
+        """
+        for room_id in buffer.rooms:
+            self.discard_member(room_id, user_id)
+        buffer.rooms = set()
+
+    def discard_member(self, room_id: str, user_id: str):
+        members = self.detached_rooms.get(room_id)
+        if members is not None:
+            members.discard(user_id)
+            if not members:
+                del self.detached_rooms[room_id]
+
+    def join_room(self, room_id: str, user_id: str):
+        """
+        切断中のユーザーがルームに参加した場合に記録する(バッファを保持していない場合は何もしない)
+        """
+        buffer = self.detached.get(user_id)
+        if buffer is not None:
+            buffer.rooms.add(room_id)
+            self.detached_rooms.setdefault(room_id, set()).add(user_id)
+
+    def leave_room(self, room_id: str, user_id: str):
+        """
+        切断中のユーザーがルームから退出した場合に記録する
+        """
+        self.discard_member(room_id, user_id)
+        buffer = self.detached.get(user_id)
+        if buffer is not None:
+            buffer.rooms.discard(room_id)
+
+    def get_detached_room_members(self, room_id: str) -> Set[str]:
+        """
+        ルームの切断中の参加者のうちバッファを保持しているユーザーを返す(有効期限を過ぎたユーザーはここで削除される)
+        """
+        members = self.detached_rooms.get(room_id)
+        if not members:
+            return set()
+        return {user_id for user_id in list(members) if self.detached.get(user_id) is not None}
+
+    def get(self, user_id: str) -> ReplayBuffer | None:
+        buffer = self.buffers.get(user_id)
+        if buffer is None:
+            buffer = self.detached.get(user_id)
+        return buffer
+
+    def metrics(self) -> Dict[str, int]:
+        return {"attached": len(self.buffers), "detached": len(self.detached), "detached_rooms": len(self.detached_rooms)}
@@ -0,0 +1,134 @@
+"""
+websocketで受信するメッセージの形式
+各メッセージは {"id": 任意, "type": メッセージの種類, "content": 内容} の形式で、typeにより内容の形式が決まる
+"""
+from pydantic import BaseModel, Field, AfterValidator, BeforeValidator
+from typing import Annotated, Any, List, Literal, Optional, Union
+from datetime import datetime
+import base64
+import uuid
+
+def canonical_uuid(value: str) -> str:
+    """
+    UUIDの形式であるか確認し、小文字・ハイフン区切りの表記に変換する
+    (ルームのインデックス・イベントバスはこの表記のIDを使用するため、受信した時点で揃える)
+    """
+    return str(uuid.UUID(value))
+
+UUIDStr = Annotated[str, AfterValidator(canonical_uuid)]
+
+def encode_image(value):
+    """MessagePackでバイナリとして受信した画像はbase64の文字列に変換する(保存・JSONでの送信はbase64)"""
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode("ascii")
+    return value
+
+ImageData = Annotated[str, BeforeValidator(encode_image)]
+
+class Request(BaseModel):
+    #idはクライアントが応答との対応付けに使用する値で、そのまま応答に含める
+    id: Any
+    content: Any
+
+#ReAuth
+class ReAuthContent(BaseModel):
+    access_token: str
+    device_id: str
+
+class ReAuthRequest(Request):
+    type: Literal["ReAuth"]
+    content: ReAuthContent
+
+#SendMessage
+class TextMessageContent(BaseModel):
+    type: Literal["text"]
+    roomid: UUIDStr
+    message: str
+
+class ImageMessageContent(BaseModel):
+    type: Literal["image"]
+    roomid: UUIDStr
+    image: ImageData
+
+class SendMessageRequest(Request):
+    type: Literal["SendMessage"]
+    content: Annotated[Union[TextMessageContent, ImageMessageContent], Field(discriminator="type")]
+
+#CreateRoom, JoinRoom, LeaveRoom
+class CreateRoomContent(BaseModel):
+    roomname: str
+    participants: List[str]
+
+class CreateRoomRequest(Request):
+    type: Literal["CreateRoom"]
+    content: CreateRoomContent
+
+class JoinRoomContent(BaseModel):
+    roomid: UUIDStr
+    participants: str #参加するユーザーのID
+
+class JoinRoomRequest(Request):
+    type: Literal["JoinRoom"]
+    content: JoinRoomContent
+
+class RoomContent(BaseModel):
+    roomid: UUIDStr
+
+class LeaveRoomRequest(Request):
+    type: Literal["LeaveRoom"]
+    content: RoomContent
+
+#Friend, UnFriend
+class FriendContent(BaseModel):
+    friend_id: str
+
+class FriendRequest(Request):
+    type: Literal["Friend"]
+    content: FriendContent
+
+class UnFriendRequest(Request):
+    type: Literal["UnFriend"]
+    content: FriendContent
+
+#Focus, UnFocus
+class FocusRequest(Request):
+    type: Literal["Focus"]
+    content: RoomContent
+
+class UnFocusRequest(Request):
+    type: Literal["UnFocus"]
+    content: RoomContent
+
+#GetRoomsInfo, GetFriendList(内容は使用しない)
+class GetRoomsInfoRequest(Request):
+    type: Literal["GetRoomsInfo"]
+
+class GetFriendListRequest(Request):
+    type: Literal["GetFriendList"]
+
+#SearchUsers
+class SearchCursor(BaseModel):
+    score: float
+    id: UUIDStr
+
+class SearchUsersContent(BaseModel):
+    key: str
+    cursor: Optional[SearchCursor] = None
+
+class SearchUsersRequest(Request):
+    type: Literal["SearchUsers"]
+    content: SearchUsersContent
+
+#GetHistory
+class HistoryCursor(BaseModel):
+    created_at: datetime
+    id: UUIDStr
+
+class GetHistoryContent(BaseModel):
+    roomid: UUIDStr
+    cursor: Optional[HistoryCursor] = None
+    limit: Optional[Annotated[int, Field(ge=1, strict=True)]] = None
+
+class GetHistoryRequest(Request):
+    type: Literal["GetHistory"]
+    content: GetHistoryContent
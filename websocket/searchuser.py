@@ -2,50 +2,61 @@ from fastapi import WebSocket, Response
 from datetime import datetime, timedelta
 import pytz
 import uuid
-from database.database import database
+import asyncio
+from config import SEARCH_PAGE_SIZE, SEARCH_DEBOUNCE_MS
+from database.database import async_database
 from psycopg.rows import dict_row
 from websocket.manager import manager
+from websocket.schemas import SearchUsersRequest
 
-async def SearchUsers(ws: WebSocket, user_id: str, data: dict):
+async def SearchUsers(ws: WebSocket, user_id: str, data: SearchUsersRequest):
     """
     ユーザー検索リクエストを処理する
+    content: {"key": 検索文字列, "cursor": 前のページのnext(省略時は1ページ目)}
     """
-    def msg_key_check(data: dict):
-        content = data["content"]
-        if not "key" in content.keys():
-            raise KeyError
-
-    try:
-        msg_key_check(data)
-    except Exception as e:
-        await manager.send_personal_message({"id":data["id"],"type":"reply-SearchUsers","content":{"message":"Invalid message format"}}, ws)
+    search_key = data.content.key
+    after = data.content.cursor.model_dump() if data.content.cursor is not None else None
+    if (search_key == None or search_key == ""):
+        await manager.send_personal_message({"id":data.id,"type":"reply-SearchUsers","content":{"message":"Invalid search key"}}, ws)
         return
 
-    users = []
-    search_key = data["content"]["key"]
+    #入力中の連続した検索は最後のもの以外を取り消す
+    previous_task = manager.search_tasks.get(user_id)
+    if previous_task is not None and not previous_task.done():
+        previous_task.cancel()
+    manager.search_tasks[user_id] = asyncio.current_task()
     try:
-        with database.get_connection() as conn:
-            with conn.cursor(row_factory=dict_row) as cursor:
-                if (search_key == None or search_key == ""):
-                    await manager.send_personal_message({"id":data["id"],"type":"reply-SearchUsers","content":{"message":"Invalid search key"}}, ws)
-                    return
-                elif search_key in '#':
+        if after is None:
+            await asyncio.sleep(SEARCH_DEBOUNCE_MS/1000)
+
+        users_list = []
+        next_cursor = None
+        async with async_database.get_connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cursor:
+                if search_key.startswith('#'):
                     # ID検索
-                    users = database.fetch(cursor, "users", {"id":search_key})
+                    try:
+                        search_id = str(uuid.UUID(search_key[1:]))
+                    except ValueError:
+                        search_id = None
+                    users = []
+                    if search_id is not None and search_id != user_id:
+                        users = await async_database.bulk_fetch(cursor, "users", "id", [search_id], ["id", "name", "avatar_path"], {"id": "uuid"})
                 else:
-                    #名前検索 個数制限あり
-                    users = database.like(cursor, "users", {}, {"name":search_key},"21")
-                    for i in range(len(users)):
-                        if str(users[i]["id"]) == user_id:
-                            users.pop(i)
-                            break
-                    if len(users) == 21:
-                        users.pop(20)
-                    users_list = []
-                    for user in users:
-                        users_list.append({"id":str(user["id"]),"name":user["name"],"avatar_path":f"/avatars/users{user["avatar_path"]}"})
-                await manager.send_personal_message({"id":data["id"],"type":"reply-SearchUsers","content":users_list}, ws)
+                    #名前検索 類似度順にページ単位で取得
+                    users = await async_database.search_users(cursor, search_key, user_id, SEARCH_PAGE_SIZE+1, after)
+                    if len(users) > SEARCH_PAGE_SIZE:
+                        users.pop(SEARCH_PAGE_SIZE)
+                        next_cursor = {"score":users[-1]["score"],"id":users[-1]["id"]}
+        for user in users:
+            users_list.append({"id":str(user["id"]),"name":user["name"],"avatar_path":f"/avatars/users{user["avatar_path"]}"})
+        await manager.send_personal_message({"id":data.id,"type":"reply-SearchUsers","content":users_list,"next":next_cursor}, ws, ephemeral=True)
+    except asyncio.CancelledError:
+        #新しい検索に置き換えられた・切断された(取り消しを呼び出し元に伝えるため再送出する)
+        raise
     except Exception as e:
-        await manager.send_personal_message({"id":data["id"],"type":"reply-SearchUsers","content":{"message":"Error fetching user data"}}, ws)
+        await manager.send_personal_message({"id":data.id,"type":"reply-SearchUsers","content":{"message":"Error fetching user data"}}, ws)
         print(f"Error fetching user data: {e}")
-        
\ No newline at end of file
+    finally:
+        if manager.search_tasks.get(user_id) is asyncio.current_task():
+            del manager.search_tasks[user_id]
@@ -0,0 +1,126 @@
+import asyncio
+import math
+import time
+from typing import Awaitable, Callable, Dict, Hashable, List, Set
+from config import VALIDITY_HOURS, TOKEN_TIMER_TICK_SECONDS, TOKEN_TIMER_SLOTS, TOKEN_EXPIRY_WARNING_SECONDS
+
+class TimerWheel:
+    """
+    ハッシュ化タイマーホイール
+    期限をtick単位に丸め、tick % slotsのスロットに登録する
+    登録・取り消し・再登録はO(1)で、advance()は現在のスロットのみを確認する
+    (slots tick以上先の期限はスロットを一周するごとに確認される)
+    """
+    def __init__(self, slots: int):
+        self.slots: List[Set[Hashable]] = [set() for _ in range(slots)]
+        self.deadlines: Dict[Hashable, int] = {}
+        self.current_tick = 0
+
+    def schedule(self, key: Hashable, ticks: int):
+        """
+        keyの期限をticks tick後に設定する(登録済みの場合は期限を変更する)
+        """
+        self.cancel(key)
+        deadline = self.current_tick + max(1, ticks)
+        self.deadlines[key] = deadline
+        self.slots[deadline % len(self.slots)].add(key)
+
+    def cancel(self, key: Hashable):
+        deadline = self.deadlines.pop(key, None)
+        if deadline is not None:
+            self.slots[deadline % len(self.slots)].discard(key)
+
+    def advance(self) -> List[Hashable]:
+        """
+        1 tick進め、期限に達したkeyのリストを返す
+        """
+        self.current_tick += 1
+        slot = self.slots[self.current_tick % len(self.slots)]
+        due = [key for key in slot if self.deadlines[key] <= self.current_tick]
+        for key in due:
+            slot.discard(key)
+            del self.deadlines[key]
+        return due
+
+    def __len__(self):
+        return len(self.deadlines)
+
+class TokenExpiryTimer:
+    """
+    全ての接続のアクセストークンの有効期限を一つのタスクで管理する
+    有効期限のTOKEN_EXPIRY_WARNING_SECONDS秒前にwarn、有効期限にexpireを呼び出す
+    期限に達した接続はtickごとにまとめて処理する
+    """
+    def __init__(self,
+                 warn: Callable[[List[str]], Awaitable[None]],
+                 expire: Callable[[List[str]], Awaitable[None]],
+                 tick_seconds: float = TOKEN_TIMER_TICK_SECONDS,
+                 slots: int = TOKEN_TIMER_SLOTS):
+        self.warn = warn
+        self.expire = expire
+        self.tick_seconds = tick_seconds
+        self.wheel = TimerWheel(slots)
+        #ユーザーID -> 有効期限(time.monotonic)
+        self.expires_at: Dict[str, float] = {}
+        #警告を送信済みのユーザー
+        self.warned: Set[str] = set()
+        self.task: asyncio.Task | None = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def renew(self, user_id: str, validity_seconds: float = VALIDITY_HOURS["access_token"]*3600):
+        """
+        接続時及び再認証時に有効期限を設定し直す(O(1))
+        """
+        self.expires_at[user_id] = time.monotonic() + validity_seconds
+        self.warned.discard(user_id)
+        self.wheel.schedule(user_id, self.ticks_until(validity_seconds - TOKEN_EXPIRY_WARNING_SECONDS))
+
+    def remove(self, user_id: str):
+        self.wheel.cancel(user_id)
+        self.expires_at.pop(user_id, None)
+        self.warned.discard(user_id)
+
+    def ticks_until(self, seconds: float) -> int:
+        return math.ceil(max(0, seconds) / self.tick_seconds)
+
+    async def run(self):
+        """
+        tick_secondsごとにホイールを進め、期限に達した接続をまとめて処理する
+        """
+        next_tick = time.monotonic()
+        while True:
+            next_tick += self.tick_seconds
+            await asyncio.sleep(max(0, next_tick - time.monotonic()))
+            try:
+                await self.process(self.wheel.advance())
+            except Exception as e:
+                print(f"Error processing token expiry: {e}")
+
+    async def process(self, due: List[str]):
+        if not due:
+            return
+        now = time.monotonic()
+        to_warn = []
+        to_expire = []
+        for user_id in due:
+            if user_id not in self.expires_at:
+                continue
+            remaining = self.expires_at[user_id] - now
+            if user_id in self.warned or remaining <= 0:
+                to_expire.append(user_id)
+                self.remove(user_id)
+            else:
+                to_warn.append(user_id)
+                self.warned.add(user_id)
+                self.wheel.schedule(user_id, self.ticks_until(remaining))
+        if to_warn:
+            await self.warn(to_warn)
+        if to_expire:
+            await self.expire(to_expire)
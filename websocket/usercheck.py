@@ -2,7 +2,7 @@ from fastapi import WebSocket, Response
 from datetime import datetime, timedelta
 import pytz
 import uuid
-from database.database import database
+from database.database import async_database
 from psycopg.rows import dict_row
 from websocket.manager import manager
 
@@ -27,9 +27,9 @@ async def check_user_id(ws:WebSocket, user_id: str) -> bool:
     
     access_token = ""
     try:
-        with database.get_connection() as conn:
-            with conn.cursor(row_factory=dict_row) as cursor:
-                user = database.fetch(cursor,"users", {"id": user_id})
+        async with async_database.get_connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cursor:
+                user = await async_database.fetch(cursor,"users", {"id": user_id})
                 if user == []:
                     response = {"type":"reply-init", "content":{"stauts":"404","message":"User not found"}}
                     await manager.send_personal_message(response,ws)
@@ -57,9 +57,9 @@ async def check_access_token(ws: WebSocket, data, users_access_token) -> bool:
         await manager.send_personal_message(response,ws)
         return False
     try:
-        with database.get_connection() as conn:
-            with conn.cursor(row_factory=dict_row) as cursor:
-                access_token_data = database.fetch(cursor,"access_tokens", {"access_token": access_token})
+        async with async_database.get_connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cursor:
+                access_token_data = await async_database.fetch(cursor,"access_tokens", {"access_token": access_token})
                 if access_token_data == []:
                     response = {"type":"reply-init", "content":{"stauts":"401","message":"invalid access_token"}}
                     await manager.send_personal_message(response,ws)